@@ -107,6 +107,29 @@ test('capture Label README screenshots', async ({ page }) => {
     })
   })
 
+  // The grid view requests the layout as server-sent events.
+  await page.route('**/assignGrid/stream', async (route) => {
+    if (route.request().method() === 'OPTIONS') {
+      await route.fulfill({ status: 204 })
+      return
+    }
+    const posted = JSON.parse(route.request().postData() ?? '{}') as {
+      uuids?: string[]
+      nRows?: number
+      nCols?: number
+    }
+    const uuids = posted.uuids ?? []
+    const nRows = posted.nRows ?? 1
+    const nCols = posted.nCols ?? uuids.length
+    const assignment = rowMajorAssignGrid(uuids, nRows, nCols)
+    await route.fulfill({
+      status: 200,
+      contentType: 'text/event-stream',
+      headers: { 'access-control-allow-origin': '*' },
+      body: `event: layout\ndata: ${JSON.stringify({ stage: 'final', assignment })}\n\n`,
+    })
+  })
+
   await page.route('**/findCenter', async (route) => {
     if (route.request().method() === 'OPTIONS') {
       await route.fulfill({ status: 204 })
@@ -1,4 +1,5 @@
 import type { Category, TreeNode } from '@image-taxonomy-labeler/ui/label-tasks/taxonomization/useLabelTask'
+import { withSelection } from '@image-taxonomy-labeler/shared/services/selection'
 import { getCaptions } from '~/services/captioning'
 import { clustering, findCenters } from '~/services/clustering'
 import { generateUniqueName as generateUniqueNameFrom } from './uniqueName'
@@ -189,8 +190,10 @@ export const useOperators = (uuids: Ref<string[]>, userName: Ref<string | null>)
     const imageUuidsInTaxon = getImageUuidsInTaxon(taxon)
     if (imageUuidsInTaxon.length === 0) return
 
-    const nClusters = Math.floor(Math.sqrt(imageUuidsInTaxon.length))
-    const clusterLabels = await clustering(imageUuidsInTaxon, nClusters)
+    const clusterLabels = await withSelection(
+      imageUuidsInTaxon,
+      (selected) => clustering(selected, 'auto'),
+    )
     const groups = clusterLabelsToGroups(clusterLabels)
     const uuidClusters = groups.map((group) => (
       group.map((index) => imageUuidsInTaxon[index])
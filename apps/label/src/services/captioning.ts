@@ -1,4 +1,6 @@
+import type { Uuids } from '@image-taxonomy-labeler/shared/services/selection'
 import { BASE_ALGORITHM_URL as BASE_URL } from '@image-taxonomy-labeler/shared/services/params'
+import { toUuidsBody } from '@image-taxonomy-labeler/shared/services/selection'
 import axios from 'axios'
 import withProgressBar from 'with-progress-bar'
 import 'with-progress-bar/style.css'
@@ -35,3 +37,25 @@ export const getCaptions = withProgressBar(async (
   ).data as (string | null)[]
   return captions
 })
+
+/** A page of the UUIDs whose captions match a search query. */
+export interface CaptionSearchResult {
+  total: number
+  offset: number
+  uuids: string[]
+}
+
+/**
+ * Search the captions for all the query terms (a term ending with * matches as a prefix),
+ * optionally among the given UUIDs or registered selection.
+ */
+export const searchCaptions = async (
+  query: string,
+  { uuids, offset = 0, limit = 100 }: { uuids?: Uuids, offset?: number, limit?: number } = {},
+): Promise<CaptionSearchResult> => (
+  await axios.post(
+    `${BASE_URL}/captions/search`,
+    JSON.stringify({ query, ...(uuids === undefined ? {} : toUuidsBody(uuids)), offset, limit }),
+    CONFIG,
+  )
+).data as CaptionSearchResult
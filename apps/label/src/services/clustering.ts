@@ -1,4 +1,6 @@
+import type { Uuids } from '@image-taxonomy-labeler/shared/services/selection'
 import { BASE_ALGORITHM_URL as BASE_URL } from '@image-taxonomy-labeler/shared/services/params'
+import { toUuidsBody } from '@image-taxonomy-labeler/shared/services/selection'
 import axios from 'axios'
 import withProgressBar from 'with-progress-bar'
 import 'with-progress-bar/style.css'
@@ -9,15 +11,28 @@ const CONFIG = {
   },
 }
 
-/** Clustering the data objects given their UUIDs. */
+/** The range of the number of clusters chosen by `nClusters: 'auto'`. */
+export interface AutoClusteringOptions {
+  minClusters?: number
+  maxClusters?: number
+  /** Seconds the server may spend choosing and fitting the number of clusters. */
+  timeBudget?: number
+}
+
+/**
+ * Clustering the data objects given their UUIDs or a registered selection.
+ * With `nClusters: 'auto'`, the server picks the number of clusters
+ * with the best silhouette score in the range of `options`.
+ */
 export const clustering = withProgressBar(async (
-  uuids: string[],
-  nClusters: number,
+  uuids: Uuids,
+  nClusters: number | 'auto',
+  options: AutoClusteringOptions = {},
 ) => {
   const labels = (
     await axios.post(
       `${BASE_URL}/clustering`,
-      JSON.stringify({ uuids, nClusters }),
+      JSON.stringify({ ...toUuidsBody(uuids), nClusters, ...options }),
       CONFIG,
     )
   ).data as number[]
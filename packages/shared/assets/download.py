@@ -1,19 +1,120 @@
 """
-Download the latest visualizations catalog into this package.
+Download the latest visualizations catalog into this package,
+and index it into visualizations.sqlite for lookups by uuid
+(e.g., by the POST /metadata endpoint of the server).
 """
 
+import json
+import os
+import sqlite3
+import sys
 from pathlib import Path
 
-if __name__ == "__main__":
-    try:
-        from oldvis_dataset import visualizations
-    except ImportError:
-        import pip
+_SCHEMA = """
+CREATE TABLE visualizations (
+    uuid TEXT PRIMARY KEY,
+    publish_year INTEGER,
+    source_name TEXT,
+    rights TEXT,
+    width INTEGER,
+    height INTEGER,
+    file_size INTEGER,
+    -- The record of visualizations.json, as compact JSON.
+    record TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX visualizations_publish_year ON visualizations (publish_year);
+CREATE INDEX visualizations_source_name ON visualizations (source_name);
+CREATE TABLE visualization_tags (
+    tag TEXT NOT NULL,
+    uuid TEXT NOT NULL,
+    PRIMARY KEY (tag, uuid)
+) WITHOUT ROWID;
+CREATE TABLE visualization_languages (
+    language TEXT NOT NULL,
+    uuid TEXT NOT NULL,
+    PRIMARY KEY (language, uuid)
+) WITHOUT ROWID;
+"""
+
+
+def _publish_year(publish_date) -> int | None:
+    """The year of a time point, or of the start of a time range."""
+
+    if publish_date is None:
+        return None
+    if isinstance(publish_date, list):
+        publish_date = publish_date[0]
+    return publish_date.get("year")
+
+
+def _row(d: dict) -> tuple:
+    resolution = d.get("resolution") or (None, None)
+    return (
+        d["uuid"],
+        _publish_year(d.get("publishDate")),
+        (d.get("source") or {}).get("name"),
+        d.get("rights"),
+        resolution[0],
+        resolution[1],
+        d.get("fileSize"),
+        json.dumps(d, ensure_ascii=False, separators=(",", ":")),
+    )
 
-        pip.main(args=["install", "oldvis_dataset"])
 
-        from oldvis_dataset import visualizations
+def build_index(json_path: Path, db_path: Path) -> int:
+    """
+    Index the catalog into a SQLite database keyed by uuid,
+    with columns and tables for the common filters.
+    The database is replaced atomically; returns the number of records.
+    """
 
+    with open(json_path, encoding="utf-8") as f:
+        records = json.load(f)
+    partial = db_path.with_name(db_path.name + ".partial")
+    partial.unlink(missing_ok=True)
+    connection = sqlite3.connect(partial)
+    try:
+        with connection:
+            connection.executescript(_SCHEMA)
+            connection.executemany(
+                "INSERT OR REPLACE INTO visualizations VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (_row(d) for d in records),
+            )
+            connection.executemany(
+                "INSERT OR IGNORE INTO visualization_tags VALUES (?, ?)",
+                ((tag, d["uuid"]) for d in records for tag in d.get("tags") or []),
+            )
+            connection.executemany(
+                "INSERT OR IGNORE INTO visualization_languages VALUES (?, ?)",
+                (
+                    (language, d["uuid"])
+                    for d in records
+                    for language in d.get("languages") or []
+                ),
+            )
+        connection.execute("VACUUM")
+    finally:
+        connection.close()
+    os.replace(partial, db_path)
+    return len(records)
+
+
+if __name__ == "__main__":
     dest = Path(__file__).with_name("visualizations.json")
-    visualizations.download(path=str(dest))
-    print(f"Wrote {dest}")
+    # With --index-only, index the catalog already downloaded.
+    if "--index-only" not in sys.argv[1:]:
+        try:
+            from oldvis_dataset import visualizations
+        except ImportError:
+            import pip
+
+            pip.main(args=["install", "oldvis_dataset"])
+
+            from oldvis_dataset import visualizations
+
+        visualizations.download(path=str(dest))
+        print(f"Wrote {dest}")
+
+    db_path = dest.with_suffix(".sqlite")
+    n_records = build_index(dest, db_path)
+    print(f"Indexed {n_records} records into {db_path}")
@@ -11,7 +11,7 @@ interface TimePoint {
   day?: number
 }
 
-interface RawVisualization {
+export interface RawVisualization {
   uuid: string
   authors: string[] | null
   displayName: string
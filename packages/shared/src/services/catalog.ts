@@ -0,0 +1,25 @@
+import axios from 'axios'
+import type { RawVisualization } from '../plugins/visualization'
+import type { Uuids } from './selection'
+import { BASE_ALGORITHM_URL as BASE_URL } from './params'
+
+const CONFIG = {
+  headers: {
+    'Content-Type': 'application/json',
+  },
+}
+
+/**
+ * Fetch the catalog records of the UUIDs (e.g., of the visible grid cells)
+ * from the server's catalog index, instead of loading the whole catalog.
+ * Returns the records in the order of the UUIDs, null for unknown UUIDs.
+ */
+export const getVisualizationRecords = async (
+  uuids: Uuids,
+): Promise<(RawVisualization | null)[]> => (
+  await axios.post(
+    `${BASE_URL}/metadata`,
+    JSON.stringify(uuids),
+    CONFIG,
+  )
+).data as (RawVisualization | null)[]
@@ -1,6 +1,8 @@
 import axios from 'axios'
 import withProgressBar from 'with-progress-bar'
+import type { Uuids } from './selection'
 import { BASE_ALGORITHM_URL as BASE_URL } from './params'
+import { toUuidsBody } from './selection'
 import 'with-progress-bar/style.css'
 
 const CONFIG = {
@@ -30,21 +32,118 @@ export const computeDenseGridShape = (
   return { nRows, nCols }
 }
 
+/** Decode little-endian int32 <row index, col index> pairs sent as binary. */
+export const decodeInt32Pairs = (buffer: ArrayBuffer): [number, number][] => {
+  const view = new DataView(buffer)
+  const pairs: [number, number][] = []
+  for (let offset = 0; offset + 8 <= buffer.byteLength; offset += 8) {
+    pairs.push([view.getInt32(offset, true), view.getInt32(offset + 4, true)])
+  }
+  return pairs
+}
+
 /**
- * Compute a grid layout for the data objects given their UUIDs.
+ * Compute a grid layout for the data objects given their UUIDs
+ * or a registered selection.
  * Returns the assignment stored as a list of <row index, col index>.
+ * With binary, the assignment is transferred as packed int32 values,
+ * which is smaller and faster to parse than JSON for large grids.
  */
 export const assignGrid = withProgressBar(async (
-  uuids: string[],
+  uuids: Uuids,
   nRows: number,
   nCols: number,
+  binary: boolean = false,
 ) => {
+  const body = JSON.stringify({ ...toUuidsBody(uuids), nRows, nCols })
+  if (binary) {
+    const buffer = (
+      await axios.post(`${BASE_URL}/assignGrid`, body, {
+        headers: { ...CONFIG.headers, Accept: 'application/octet-stream' },
+        responseType: 'arraybuffer',
+      })
+    ).data as ArrayBuffer
+    return decodeInt32Pairs(buffer)
+  }
   const assignment = (
-    await axios.post(
-      `${BASE_URL}/assignGrid`,
-      JSON.stringify({ uuids, nRows, nCols }),
-      CONFIG,
-    )
+    await axios.post(`${BASE_URL}/assignGrid`, body, CONFIG)
   ).data as [number, number][]
   return assignment
 })
+
+/** A stage of a progressive grid layout. */
+export interface GridLayout {
+  stage: 'coarse' | 'tsne' | 'final'
+  assignment: [number, number][]
+}
+
+/** A server-sent event. */
+export interface ServerSentEvent {
+  event: string
+  data: string
+}
+
+/**
+ * Parse the complete server-sent events in the buffered text.
+ * Returns the events and the incomplete remainder to prepend to the next chunk.
+ */
+export const parseServerSentEvents = (
+  text: string,
+): { events: ServerSentEvent[], rest: string } => {
+  const blocks = text.replace(/\r\n/g, '\n').split('\n\n')
+  const rest = blocks.pop() ?? ''
+  const events = blocks.filter((block) => block.trim() !== '').map((block) => {
+    let event = 'message'
+    const data: string[] = []
+    block.split('\n').forEach((line) => {
+      if (line.startsWith('event:')) event = line.slice(6).trim()
+      else if (line.startsWith('data:')) data.push(line.slice(5).trimStart())
+    })
+    return { event, data: data.join('\n') }
+  })
+  return { events, rest }
+}
+
+/**
+ * Compute a grid layout progressively: onLayout is called with a coarse layout
+ * as soon as it is available, then with refinements, and last with the stage
+ * "final", whose assignment equals the one of assignGrid and is returned.
+ */
+export const assignGridProgressive = withProgressBar(async (
+  uuids: Uuids,
+  nRows: number,
+  nCols: number,
+  onLayout: (layout: GridLayout) => void,
+): Promise<[number, number][]> => {
+  const response = await fetch(`${BASE_URL}/assignGrid/stream`, {
+    method: 'POST',
+    headers: { ...CONFIG.headers, Accept: 'text/event-stream' },
+    body: JSON.stringify({ ...toUuidsBody(uuids), nRows, nCols }),
+  })
+  if (!response.ok || response.body === null) {
+    // The status tells an evicted selection (404) apart.
+    throw Object.assign(
+      new Error(`assignGrid/stream failed with status ${response.status}`),
+      { status: response.status },
+    )
+  }
+
+  const reader = response.body.pipeThrough(new TextDecoderStream()).getReader()
+  let buffer = ''
+  let final: [number, number][] | undefined
+  while (true) {
+    const { done, value } = await reader.read()
+    if (done) break
+    const { events, rest } = parseServerSentEvents(buffer + value)
+    buffer = rest
+    events.filter((d) => d.event === 'layout').forEach((d) => {
+      const layout = JSON.parse(d.data) as GridLayout
+      if (layout.stage === 'final') final = layout.assignment
+      onLayout(layout)
+    })
+  }
+  if (final === undefined) {
+    throw new Error('assignGrid/stream ended before the final layout')
+  }
+  return final
+})
@@ -0,0 +1,105 @@
+import axios from 'axios'
+import { BASE_ALGORITHM_URL as BASE_URL } from './params'
+
+const CONFIG = {
+  headers: {
+    'Content-Type': 'application/json',
+  },
+}
+
+/** Reference to a UUID list registered on the server. */
+export interface SelectionRef {
+  selection: string
+}
+
+/** UUIDs given either explicitly or by a registered selection. */
+export type Uuids = string[] | SelectionRef
+
+/**
+ * Register the UUIDs on the server once,
+ * such that later compute calls can send the returned reference instead.
+ * The server evicts unused selections, in which case it responds with 404.
+ */
+export const registerSelection = async (
+  uuids: string[],
+): Promise<SelectionRef> => {
+  const { handle } = (
+    await axios.post(
+      `${BASE_URL}/selections`,
+      JSON.stringify(uuids),
+      CONFIG,
+    )
+  ).data as { handle: string, size: number }
+  return { selection: handle }
+}
+
+/**
+ * Lists shorter than this are sent as they are,
+ * as registering them would cost more than it saves.
+ */
+export const MIN_REGISTERED_SIZE = 1000
+
+/** Number of registered lists remembered; the oldest are forgotten. */
+const MAX_REGISTERED = 16
+
+/** The registered selections by digest of their list, oldest first. */
+const registered = new Map<string, Promise<SelectionRef>>()
+
+/** Get the digest of a UUID list, or null without Web Crypto (e.g., over HTTP). */
+const digestUuids = async (uuids: string[]): Promise<string | null> => {
+  if (globalThis.crypto?.subtle === undefined) return null
+  // Joined by a character that UUIDs do not contain.
+  const data = new TextEncoder().encode(uuids.join('\n'))
+  const digest = await globalThis.crypto.subtle.digest('SHA-256', data)
+  return Array.from(new Uint8Array(digest), (d) => d.toString(16).padStart(2, '0')).join('')
+}
+
+/** Whether the request failed with 404, e.g., for an evicted selection. */
+const isNotFound = (error: unknown): boolean => (
+  axios.isAxiosError(error)
+    ? error.response?.status === 404
+    : (error as { status?: number } | null)?.status === 404
+)
+
+/**
+ * Call a compute function with the UUIDs, by a registered selection
+ * for large lists: each list is registered once, such that calling again
+ * with the same list (e.g., a grid laid out again) sends only its handle.
+ * A selection evicted by the server is registered again.
+ */
+export const withSelection = async <T>(
+  uuids: string[],
+  call: (uuids: Uuids) => Promise<T>,
+): Promise<T> => {
+  if (uuids.length < MIN_REGISTERED_SIZE) return call(uuids)
+  const key = await digestUuids(uuids)
+  if (key === null) return call(uuids)
+
+  const register = (): Promise<SelectionRef> => {
+    const ref = registerSelection(uuids)
+    registered.delete(key)
+    registered.set(key, ref)
+    ref.catch(() => {
+      if (registered.get(key) === ref) registered.delete(key)
+    })
+    while (registered.size > MAX_REGISTERED) {
+      registered.delete(registered.keys().next().value as string)
+    }
+    return ref
+  }
+  const cached = registered.get(key)
+  try {
+    return await call(await (cached ?? register()))
+  }
+  catch (error) {
+    if (cached === undefined || !isNotFound(error)) throw error
+    return call(await register())
+  }
+}
+
+/** Get the request body fields identifying the UUIDs. */
+export const toUuidsBody = (
+  uuids: Uuids,
+): { uuids: string[] } | SelectionRef => (
+  Array.isArray(uuids) ? { uuids } : uuids
+)
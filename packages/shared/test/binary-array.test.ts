@@ -0,0 +1,15 @@
+import { describe, expect, it } from 'vitest'
+import { decodeInt32Pairs } from '../src/services/layout'
+
+describe('decodeInt32Pairs', () => {
+  it('decodes little-endian int32 pairs in row-major order', () => {
+    const values = new Int32Array([0, 1, 2, 3, 70000, 5])
+    const view = new DataView(new ArrayBuffer(values.length * 4))
+    values.forEach((v, i) => view.setInt32(i * 4, v, true))
+    expect(decodeInt32Pairs(view.buffer)).toEqual([[0, 1], [2, 3], [70000, 5]])
+  })
+
+  it('returns an empty list for an empty body', () => {
+    expect(decodeInt32Pairs(new ArrayBuffer(0))).toEqual([])
+  })
+})
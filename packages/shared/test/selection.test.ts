@@ -0,0 +1,42 @@
+import type { Uuids } from '../src/services/selection'
+import axios from 'axios'
+import { afterEach, describe, expect, it, vi } from 'vitest'
+import { MIN_REGISTERED_SIZE, toUuidsBody, withSelection } from '../src/services/selection'
+
+describe('toUuidsBody', () => {
+  it('sends explicit uuids as a list', () => {
+    expect(toUuidsBody(['a', 'b'])).toEqual({ uuids: ['a', 'b'] })
+  })
+
+  it('sends a registered selection by reference', () => {
+    expect(toUuidsBody({ selection: 'f00d' })).toEqual({ selection: 'f00d' })
+  })
+})
+
+describe('withSelection', () => {
+  afterEach(() => {
+    vi.restoreAllMocks()
+  })
+
+  it('sends short lists as they are', async () => {
+    const post = vi.spyOn(axios, 'post')
+    const call = vi.fn(async (uuids: Uuids) => uuids)
+    expect(await withSelection(['a', 'b'], call)).toEqual(['a', 'b'])
+    expect(post).not.toHaveBeenCalled()
+  })
+
+  it('registers a long list once, and again once evicted', async () => {
+    const post = vi.spyOn(axios, 'post').mockResolvedValue({
+      data: { handle: 'f00d', size: MIN_REGISTERED_SIZE },
+    })
+    const uuids = Array.from({ length: MIN_REGISTERED_SIZE }, (_, i) => `${i}`)
+    const call = vi.fn(async (selected: Uuids) => selected)
+    expect(await withSelection(uuids, call)).toEqual({ selection: 'f00d' })
+    expect(await withSelection([...uuids], call)).toEqual({ selection: 'f00d' })
+    expect(post).toHaveBeenCalledTimes(1)
+
+    call.mockRejectedValueOnce(Object.assign(new Error('Not Found'), { status: 404 }))
+    expect(await withSelection(uuids, call)).toEqual({ selection: 'f00d' })
+    expect(post).toHaveBeenCalledTimes(2)
+  })
+})
@@ -0,0 +1,17 @@
+import { describe, expect, it } from 'vitest'
+import { parseServerSentEvents } from '../src/services/layout'
+
+describe('parseServerSentEvents', () => {
+  it('parses complete events and keeps the incomplete remainder', () => {
+    const text = 'event: layout\ndata: {"stage":"coarse"}\n\nevent: lay'
+    const { events, rest } = parseServerSentEvents(text)
+    expect(events).toEqual([{ event: 'layout', data: '{"stage":"coarse"}' }])
+    expect(rest).toBe('event: lay')
+  })
+
+  it('joins multi-line data and defaults the event type', () => {
+    const { events, rest } = parseServerSentEvents('data: a\r\ndata: b\r\n\r\n')
+    expect(events).toEqual([{ event: 'message', data: 'a\nb' }])
+    expect(rest).toBe('')
+  })
+})
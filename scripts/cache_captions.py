@@ -3,11 +3,16 @@ Compute embeddings for images in a directory and save them to a JSONL file.
 """
 
 import json
+import logging
 import os
-from typing import Callable, NamedTuple, TypedDict
+import time
+from collections import deque
+from functools import cache
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Iterator, NamedTuple
 
 import torch
-from libquery.utils.jsonl import load_jl
 from PIL import Image
 from tqdm import tqdm
 from transformers import (
@@ -18,52 +23,148 @@ from transformers import (
     PreTrainedModel,
 )
 
+from manifest import filter_filenames, get_manifest_path, record, stat_source
+
 
 # Suppress PIL.Image.DecompressionBombError for large images.
 Image.MAX_IMAGE_PIXELS = 5e8
 
+logger = logging.getLogger(__name__)
+
 
-class EmbeddingObject(TypedDict):
-    filename: str
-    embedding: list[float]
+def encode_filename(filename: str) -> str:
+    return filename.replace("?", "%3F").replace(":", "%3A")
 
 
-def filter_filenames(filenames: list[str], embedding_path: str) -> list[str]:
+def get_image_area(path: str) -> int:
     """
-    Discards the images whose embeddings are readily computed.
+    Read the pixel count of an image from its header without decoding it.
+    Returns 0 if the image cannot be opened.
     """
 
-    stored: list[EmbeddingObject] = (
-        load_jl(embedding_path) if os.path.exists(embedding_path) else []
-    )
-    stored_filenames = set([d["filename"] for d in stored])
-    return [d for d in filenames if d not in stored_filenames]
+    try:
+        with Image.open(path) as image:
+            w, h = image.size
+            return w * h
+    except Exception:
+        return 0
 
 
-def try_open(path: str) -> Image.Image | None:
+def plan_batches(
+    filenames: list[str], img_dir: str, batch_size: int
+) -> list[list[str]]:
+    """
+    Split the filenames into batches of images with similar pixel counts.
+
+    The processor resizes every image to the same input resolution,
+    so the tensors in a batch never need padding.
+    Grouping images of similar size keeps the decode cost of each batch even,
+    such that one huge scan does not stall a batch of small images.
+    """
+
+    areas = {d: get_image_area(os.path.join(img_dir, d)) for d in filenames}
+    ordered = sorted(filenames, key=lambda d: areas[d])
+    return [ordered[i : i + batch_size] for i in range(0, len(ordered), batch_size)]
+
+
+def load_rgb(path: str, draft_size: tuple[int, int]) -> Image.Image | None:
+    """
+    Decode an image to RGB.
+    JPEG images are decoded at the smallest scale that still covers `draft_size`.
+    """
+
     try:
-        return Image.open(path)
-    except:
-        print(f"Failed to open image at {path}")
+        with Image.open(path) as image:
+            image.draft("RGB", draft_size)
+            return image.convert("RGB")
+    except Exception as exc:
+        logger.warning("Failed to open image at %s: %s", path, exc)
         return None
 
 
-def encode_filename(filename: str) -> str:
-    return filename.replace("?", "%3F").replace(":", "%3A")
+def prefetch_batches(
+    batches: list[list[str]],
+    img_dir: str,
+    draft_size: tuple[int, int],
+    n_workers: int = 4,
+    depth: int = 2,
+) -> Iterator[tuple[list[str], list[Image.Image | None]]]:
+    """
+    Yield the decoded images batch by batch,
+    while decoding up to `depth` upcoming batches in background threads.
+    """
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+
+        def submit(batch: list[str]) -> tuple[list[str], list[Future]]:
+            futures = [
+                executor.submit(load_rgb, os.path.join(img_dir, d), draft_size)
+                for d in batch
+            ]
+            return batch, futures
+
+        remaining = iter(batches)
+        pending = deque(submit(batch) for batch in islice(remaining, depth))
+        while pending:
+            batch, futures = pending.popleft()
+            upcoming = next(remaining, None)
+            if upcoming is not None:
+                pending.append(submit(upcoming))
+            yield batch, [d.result() for d in futures]
+
+
+def get_draft_size(processor: AutoProcessor) -> tuple[int, int]:
+    """Get the input resolution the processor resizes images to."""
+
+    size = processor.image_processor.size
+    if "height" in size and "width" in size:
+        return size["width"], size["height"]
+    edge = size.get("shortest_edge", 384)
+    return edge, edge
 
 
 @torch.no_grad()
+def caption_batch(
+    model: PreTrainedModel,
+    processor: AutoProcessor,
+    images: list[Image.Image],
+    prompt: str,
+    device: str,
+) -> list[str]:
+    """
+    Generate the captions for a batch of images with one `model.generate` call.
+    """
+
+    inputs = processor(
+        images=images,
+        text=[prompt] * len(images),
+        return_tensors="pt",
+        padding=True,
+    )
+    inputs = inputs.to(device)
+    outputs = model.generate(**inputs, max_new_tokens=30)
+    captions = processor.batch_decode(outputs, skip_special_tokens=True)
+    return [d.removeprefix(prompt).strip() for d in captions]
+
+
 def save_captions(
     model: PreTrainedModel,
     processor: AutoProcessor,
     img_dir: str,
     prompt: str,
     save_to: str,
+    batch_size: int = 16,
 ) -> None:
     """
     Compute captions for images in a directory
     and save them to a JSONL file.
 
+    Images are decoded in background threads while the model captions
+    the previous batch. The output file is flushed and synced to disk
+    after every batch, such that a crash loses at most one batch.
+    The processed images are recorded in a sidecar manifest,
+    such that a later run only processes new or changed images.
+
     Parameters
     ----------
     model : PreTrainedModel
@@ -76,6 +177,8 @@ def save_captions(
         Prompt to generate captions.
     save_to : str
         Path to a JSONL file to save the captions.
+    batch_size : int
+        Number of images captioned per `model.generate` call.
     """
 
     output_dir = os.path.dirname(save_to)
@@ -83,30 +186,54 @@ def save_captions(
         os.makedirs(output_dir)
 
     filenames = sorted(os.listdir(img_dir))
-    filenames = filter_filenames(filenames, save_to)
+    filenames = filter_filenames(filenames, img_dir, save_to)
 
     device = "cuda" if torch.cuda.is_available() else "cpu"
     model.to(device)
 
-    for filename in tqdm(filenames):
-        image_path = os.path.join(img_dir, filename)
-        image = try_open(image_path)
-
-        if image is None:
-            caption = None
-        else:
-            inputs = processor(images=image, text=prompt, return_tensors="pt")
-            inputs = inputs.to(device)
-            outputs = model.generate(**inputs, max_new_tokens=30)
-            caption = processor.decode(outputs[0], skip_special_tokens=True)
-            caption = caption.removeprefix(prompt).strip()
-
-        entry = {
-            "filename": filename,
-            "caption": caption,
-        }
-        with open(save_to, "a") as f:
-            f.write(f"{json.dumps(entry)}\n")
+    batches = plan_batches(filenames, img_dir, batch_size)
+    draft_size = get_draft_size(processor)
+
+    start = time.perf_counter()
+    manifest_path = get_manifest_path(save_to)
+    with (
+        open(save_to, "a") as f,
+        open(manifest_path, "a") as mf,
+        tqdm(total=len(filenames), unit="img") as pbar,
+    ):
+        for batch, images in prefetch_batches(batches, img_dir, draft_size):
+            sources = [stat_source(img_dir, d) for d in batch]
+            valid = [i for i, d in enumerate(images) if d is not None]
+            captions: list[str | None] = [None] * len(batch)
+            if len(valid) != 0:
+                generated = caption_batch(
+                    model, processor, [images[i] for i in valid], prompt, device
+                )
+                for i, caption in zip(valid, generated):
+                    captions[i] = caption
+
+            for filename, caption in zip(batch, captions):
+                entry = {
+                    "filename": filename,
+                    "caption": caption,
+                }
+                f.write(f"{json.dumps(entry)}\n")
+            f.flush()
+            os.fsync(f.fileno())
+            for source in sources:
+                if source is not None:
+                    record(mf, source)
+            mf.flush()
+            pbar.update(len(batch))
+
+    elapsed = time.perf_counter() - start
+    if len(filenames) != 0:
+        logger.info(
+            "Captioned %d images in %.1fs (%.2f images/sec)",
+            len(filenames),
+            elapsed,
+            len(filenames) / elapsed,
+        )
 
 
 def get_blip() -> tuple[PreTrainedModel, AutoProcessor]:
@@ -135,10 +262,46 @@ class Setup(NamedTuple):
     getter: Callable[[], tuple[PreTrainedModel, AutoProcessor]]
 
 
+SETUP = Setup("blip2", get_blip2)
+PROMPT = "Question: what is the type of the visualization? Answer:"
+
+
+@cache
+def load_model() -> tuple[PreTrainedModel, AutoProcessor, str]:
+    """Load the model of SETUP once per process, on the GPU if any."""
+
+    model, processor = SETUP.getter()
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model.to(device)
+    return model, processor, device
+
+
+def caption_files(paths: list[str]) -> list[str | None]:
+    """
+    Generate the captions of image files, None for the images that cannot be opened.
+    Used as the captioner of the ingestion endpoint of the server
+    (INGEST_CAPTIONER=cache_captions:caption_files).
+    """
+
+    model, processor, device = load_model()
+    draft_size = get_draft_size(processor)
+    images = [load_rgb(d, draft_size) for d in paths]
+    valid = [i for i, d in enumerate(images) if d is not None]
+    captions: list[str | None] = [None] * len(paths)
+    if len(valid) != 0:
+        generated = caption_batch(
+            model, processor, [images[i] for i in valid], PROMPT, device
+        )
+        for i, caption in zip(valid, generated):
+            captions[i] = caption
+    return captions
+
+
 if __name__ == "__main__":
-    setup = Setup("blip2", get_blip2)
+    logging.basicConfig(level=logging.INFO)
+    setup = SETUP
     img_dir = "../server/static/images/"
-    prompt = "Question: what is the type of the visualization? Answer:"
+    prompt = PROMPT
     # caption_path = f"../notebooks/output/captioning/{setup.directory}/prompt={encode_filename(prompt)}.jsonl"
     caption_path = f"../server/static/captions.jsonl"
     save_captions(*setup.getter(), img_dir, prompt, caption_path)
@@ -4,15 +4,17 @@ Compute embeddings for images in `img_dir` and save them to a JSONL file.
 
 import json
 import os
+from functools import cache
 from pathlib import Path
 from typing import TypedDict
 
 import torch
-from libquery.utils.jsonl import load_jl
 from PIL import Image
 from tqdm import tqdm
 from transformers import AutoProcessor, CLIPVisionModelWithProjection
 
+from manifest import filter_filenames, get_manifest_path, record, stat_source
+
 
 # Suppress PIL.Image.DecompressionBombError for large images.
 Image.MAX_IMAGE_PIXELS = 5e8
@@ -23,18 +25,6 @@ class EmbeddingObject(TypedDict):
     embedding: list[float]
 
 
-def filter_filenames(filenames: list[str], embedding_path: str) -> list[str]:
-    """
-    Discards the images whose embeddings are readily computed.
-    """
-
-    stored: list[EmbeddingObject] = (
-        load_jl(embedding_path) if os.path.exists(embedding_path) else []
-    )
-    stored_filenames = set([d["filename"] for d in stored])
-    return [d for d in filenames if d not in stored_filenames]
-
-
 def try_open(path: str) -> Image.Image | None:
     try:
         return Image.open(path)
@@ -43,11 +33,64 @@ def try_open(path: str) -> Image.Image | None:
 
 
 @torch.no_grad()
+def embed_batch(
+    model: CLIPVisionModelWithProjection,
+    processor: AutoProcessor,
+    images: list[Image.Image],
+    device: str,
+) -> list[list[list[float]]]:
+    """
+    Compute the embeddings of a batch of images with one forward pass.
+    Each embedding keeps the shape (1, dim) of a single-image forward pass.
+    """
+
+    inputs = processor(images=images, return_tensors="pt")
+    inputs = inputs.to(device)
+    outputs = model(**inputs)
+    image_embeds = outputs.image_embeds
+    return [image_embeds[i : i + 1].tolist() for i in range(len(images))]
+
+
+MODEL_NAME = "openai/clip-vit-base-patch32"
+
+
+@cache
+def load_model() -> tuple[CLIPVisionModelWithProjection, AutoProcessor, str]:
+    """Load the model once per process, on the GPU if any."""
+
+    model = CLIPVisionModelWithProjection.from_pretrained(MODEL_NAME)
+    processor = AutoProcessor.from_pretrained(MODEL_NAME)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model.to(device)
+    return model, processor, device
+
+
+def embed_files(paths: list[str]) -> list[list[list[float]] | None]:
+    """
+    Compute the embeddings of image files, None for the images that cannot be opened.
+    Used as the embedder of the ingestion endpoint of the server
+    (INGEST_EMBEDDER=cache_embeddings:embed_files).
+    """
+
+    model, processor, device = load_model()
+    images = [try_open(d) for d in paths]
+    valid = [i for i, d in enumerate(images) if d is not None]
+    embeddings: list[list[list[float]] | None] = [None] * len(paths)
+    if len(valid) != 0:
+        batch = embed_batch(model, processor, [images[i] for i in valid], device)
+        for i, embedding in zip(valid, batch):
+            embeddings[i] = embedding
+    return embeddings
+
+
 def save_embeddings(img_dir: str, save_to: str) -> None:
     """
     Compute embeddings for images in a directory
     and save them to a JSONL file.
 
+    The processed images are recorded in a sidecar manifest,
+    such that a later run only processes new or changed images.
+
     Parameters
     ----------
     img_dir : str
@@ -61,34 +104,31 @@ def save_embeddings(img_dir: str, save_to: str) -> None:
         os.makedirs(output_dir)
 
     filenames = sorted(os.listdir(img_dir))
-    filenames = filter_filenames(filenames, save_to)
-
-    model_name = "openai/clip-vit-base-patch32"
-    model = CLIPVisionModelWithProjection.from_pretrained(model_name)
-    processor = AutoProcessor.from_pretrained(model_name)
-
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    model.to(device)
-
-    for filename in tqdm(filenames):
-        image_path = os.path.join(img_dir, filename)
-        image = try_open(image_path)
-
-        if image is None:
-            embedding = None
-        else:
-            inputs = processor(images=image, return_tensors="pt")
-            inputs = inputs.to(device)
-            outputs = model(**inputs)
-            image_embeds = outputs.image_embeds
-            embedding = image_embeds.tolist()
-
-        entry: EmbeddingObject = {
-            "filename": filename,
-            "embedding": embedding,
-        }
-        with open(save_to, "a") as f:
+    filenames = filter_filenames(filenames, img_dir, save_to)
+
+    model, processor, device = load_model()
+
+    manifest_path = get_manifest_path(save_to)
+    with open(save_to, "a") as f, open(manifest_path, "a") as mf:
+        for filename in tqdm(filenames):
+            source = stat_source(img_dir, filename)
+            image_path = os.path.join(img_dir, filename)
+            image = try_open(image_path)
+
+            if image is None:
+                embedding = None
+            else:
+                embedding = embed_batch(model, processor, [image], device)[0]
+
+            entry: EmbeddingObject = {
+                "filename": filename,
+                "embedding": embedding,
+            }
             f.write(f"{json.dumps(entry)}\n")
+            f.flush()
+            if source is not None:
+                record(mf, source)
+                mf.flush()
 
 
 if __name__ == "__main__":
@@ -1,25 +1,119 @@
 """
-Compute the thumbnail version for images in `img_dir` and save them to `thumbnail_dir`.
+Compute the thumbnail versions for images in `img_dir` at one or more sizes,
+and optionally the perceptual hashes of the images from the same decode.
 """
 
+import json
+import logging
 import math
 import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
 from pathlib import Path
+from typing import NamedTuple
 
+import numpy as np
 from PIL import Image
 from tqdm import tqdm
 
+import manifest
+
+logger = logging.getLogger(__name__)
+
 # Suppress PIL.Image.DecompressionBombError for large images.
 Image.MAX_IMAGE_PIXELS = 5e8
 
+# Side of the grayscale image the perceptual hash is computed from.
+PHASH_INPUT_SIZE = 32
+
+# Side of the block of lowest DCT frequencies making up the 64 bits of the hash.
+PHASH_FREQUENCIES = 8
+
+# The orthogonal DCT-II basis, such that DCT(X) = B @ X @ B.T.
+_DCT_BASIS = np.cos(
+    np.pi
+    * np.arange(PHASH_INPUT_SIZE)[:, None]
+    * (2 * np.arange(PHASH_INPUT_SIZE)[None, :] + 1)
+    / (2 * PHASH_INPUT_SIZE)
+)
+
+
+class ThumbnailSpec(NamedTuple):
+    directory: str
+    w_limit: int
+    h_limit: int
+    # Format to save the thumbnail in, e.g., "WEBP" or "AVIF".
+    # If None, the thumbnail keeps the filename and format of the image.
+    format: str | None = None
+
+
+def get_thumbnail_path(spec: ThumbnailSpec, filename: str) -> str:
+    if spec.format is None:
+        return os.path.join(spec.directory, filename)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(spec.directory, f"{stem}.{spec.format.lower()}")
+
+
+def is_outdated(image_path: str, thumbnail_paths: list[str]) -> bool:
+    """
+    Check whether any thumbnail is missing or older than the image.
+    """
+
+    image_mtime = os.stat(image_path).st_mtime_ns
+    for path in thumbnail_paths:
+        try:
+            if os.stat(path).st_mtime_ns < image_mtime:
+                return True
+        except FileNotFoundError:
+            return True
+    return False
+
+
+def load_thumbnail_manifest(
+    img_dir: str, specs: list[ThumbnailSpec], manifest_path: str
+) -> dict[str, manifest.ManifestEntry]:
+    """
+    Load the mapping from filename to manifest entry of the thumbnails.
+    Without a manifest, the thumbnails not older than their images are adopted
+    and recorded in a new manifest.
+    """
+
+    if not os.path.exists(manifest_path):
+        tmp_path = f"{manifest_path}.partial"
+        with open(tmp_path, "w") as mf:
+            for filename in sorted(os.listdir(img_dir)):
+                paths = [get_thumbnail_path(s, filename) for s in specs]
+                if is_outdated(os.path.join(img_dir, filename), paths):
+                    continue
+                source = manifest.stat_source(img_dir, filename)
+                if source is not None:
+                    manifest.record(mf, source)
+        os.replace(tmp_path, manifest_path)
+    return manifest.read_manifest(manifest_path)
 
-def filter_filenames(filenames: list[str], thumbnail_dir: str) -> list[str]:
+
+def filter_filenames(
+    filenames: list[str], img_dir: str, specs: list[ThumbnailSpec], manifest_path: str
+) -> list[str]:
     """
-    Discards the images whose thumbnails are readily computed.
+    Discards the images whose thumbnails are readily computed
+    and whose source files are unchanged since, as recorded in the manifest.
+    Unlike comparing mtimes, this detects images replaced by older files.
     """
 
-    stored_filenames = set(os.listdir(thumbnail_dir))
-    return [d for d in filenames if d not in stored_filenames]
+    done = load_thumbnail_manifest(img_dir, specs, manifest_path)
+    pending = []
+    for d in filenames:
+        source = manifest.stat_source(img_dir, d)
+        if (
+            d not in done
+            or source is None
+            or not manifest.is_same_stat(done[d], source)
+            # E.g., a spec added since, or thumbnails deleted by hand.
+            or not all(os.path.exists(get_thumbnail_path(s, d)) for s in specs)
+        ):
+            pending.append(d)
+    return pending
 
 
 def get_resize_dims(
@@ -53,53 +147,222 @@ def get_resize_dims(
     return math.floor(w * (h_limit / h)), h_limit
 
 
+def render_thumbnails(
+    image: Image.Image,
+    filename: str,
+    size: tuple[int, int],
+    specs: list[ThumbnailSpec],
+) -> None:
+    """
+    Resize an opened image to every thumbnail spec and save the thumbnails.
+
+    Parameters
+    ----------
+    image : Image.Image
+        The opened image, possibly decoded at a reduced scale.
+    filename : str
+        Filename of the image.
+    size : tuple[int, int]
+        Full-resolution size of the image, used to compute the thumbnail dimensions.
+    specs : list[ThumbnailSpec]
+        The thumbnails to create.
+    """
+
+    w, h = size
+    for spec in specs:
+        new_w, new_h = get_resize_dims(
+            w=w,
+            h=h,
+            w_limit=spec.w_limit,
+            h_limit=spec.h_limit,
+        )
+        # `reducing_gap` shrinks large images with the cheap `Image.reduce`
+        # before the LANCZOS pass.
+        thumbnail = image.resize(
+            (new_w, new_h), Image.Resampling.LANCZOS, reducing_gap=3.0
+        )
+        if spec.format is not None and thumbnail.mode not in ("RGB", "RGBA"):
+            has_alpha = "A" in thumbnail.getbands() or "transparency" in image.info
+            thumbnail = thumbnail.convert("RGBA" if has_alpha else "RGB")
+
+        # Write to a temporary file first such that an interrupted run
+        # does not leave a truncated thumbnail newer than the image.
+        path = get_thumbnail_path(spec, filename)
+        tmp_path = f"{path}.partial"
+        thumbnail.save(tmp_path, format=spec.format or image.format)
+        os.replace(tmp_path, path)
+
+
+def compute_phash(image: Image.Image) -> str:
+    """
+    Compute the 64-bit perceptual hash (pHash) of an image.
+
+    The image is shrunk to 32x32 grayscale and transformed by a 2D DCT.
+    Each bit tells whether one of the 8x8 lowest frequencies is above
+    their median (excluding the DC term), such that rescans and re-encodings
+    of an image differ in few bits.
+
+    Returns
+    -------
+    str
+        The hash as 16 hexadecimal digits.
+    """
+
+    pixels = np.asarray(
+        image.convert("L").resize(
+            (PHASH_INPUT_SIZE, PHASH_INPUT_SIZE), Image.Resampling.LANCZOS
+        ),
+        dtype=float,
+    )
+    coefficients = (_DCT_BASIS @ pixels @ _DCT_BASIS.T)[
+        :PHASH_FREQUENCIES, :PHASH_FREQUENCIES
+    ].flatten()
+    bits = coefficients > np.median(coefficients[1:])
+    return f"{int(''.join('1' if d else '0' for d in bits), 2):016x}"
+
+
+class ThumbnailResult(NamedTuple):
+    # The error message if the image cannot be processed, otherwise None.
+    error: str | None
+    # The perceptual hash, if requested and computed.
+    phash: str | None = None
+
+
+def create_thumbnail(
+    filename: str,
+    img_dir: str,
+    specs: list[ThumbnailSpec],
+    with_phash: bool = False,
+) -> ThumbnailResult:
+    """
+    Create the thumbnails (and optionally the perceptual hash) of one image
+    from a single decode.
+    JPEG images are decoded at the smallest scale covering the largest output.
+    """
+
+    image_path = os.path.join(img_dir, filename)
+    try:
+        with Image.open(image_path) as image:
+            w, h = image.size
+            largest = max(
+                [get_resize_dims(w, h, s.w_limit, s.h_limit) for s in specs]
+                + ([(PHASH_INPUT_SIZE, PHASH_INPUT_SIZE)] if with_phash else []),
+                key=lambda d: d[0] * d[1],
+            )
+            image.draft(None, largest)
+            render_thumbnails(image, filename, (w, h), specs)
+            phash = compute_phash(image) if with_phash else None
+    except Exception as e:
+        return ThumbnailResult(str(e))
+    return ThumbnailResult(None, phash)
+
+
+def _create_thumbnail(
+    args: tuple[str, str, list[ThumbnailSpec], bool],
+) -> ThumbnailResult:
+    return create_thumbnail(*args)
+
+
 def create_thumbnails(
     img_dir: str,
-    thumbnail_dir: str,
-    w_limit: int,
-    h_limit: int,
+    specs: list[ThumbnailSpec],
+    manifest_path: str,
+    n_workers: int | None = None,
+    phash_path: str | None = None,
 ) -> None:
     """
-    For each image in `img_dir`, compute the thumbnail version and save it to `thumbnail_dir`.
+    For each image in `img_dir`, compute the thumbnail versions and save them.
+    The images are processed in parallel by a process pool.
+    The thumbnails are only recomputed if any is missing
+    or the image changed since they were recorded in the manifest.
 
     Parameters
     ----------
     img_dir : str
         Directory containing the images.
-    thumbnail_dir : str
-        Directory to save the thumbnails.
-    w_limit : int
-        Maximum width of the thumbnail.
-    h_limit : int
-        Maximum height of the thumbnail.
+    specs : list[ThumbnailSpec]
+        The thumbnails to create for each image.
+    manifest_path : str
+        Path to the manifest recording the images whose thumbnails are created,
+        e.g., the `thumbnails.manifest.jsonl` shared with setup_cache.py.
+    n_workers : int | None
+        Number of worker processes. Defaults to the number of CPUs.
+    phash_path : str | None
+        Path to the JSONL file to append the perceptual hashes to.
+        The images recorded in its manifest and unchanged since are skipped.
+        If None, no hashes are computed.
     """
 
-    if not os.path.exists(thumbnail_dir):
-        os.makedirs(thumbnail_dir)
+    Image.init()
+    for spec in specs:
+        if spec.format is not None and spec.format.upper() not in Image.SAVE:
+            raise ValueError(f"Pillow cannot save images in {spec.format} format")
+        if not os.path.exists(spec.directory):
+            os.makedirs(spec.directory)
 
     filenames = os.listdir(img_dir)
-    filenames = filter_filenames(filenames, thumbnail_dir)
-    for filename in tqdm(filenames):
-        image_path = os.path.join(img_dir, filename)
-        image = Image.open(image_path)
-        w, h = image.size
-        new_w, new_h = get_resize_dims(
-            w=w,
-            h=h,
-            w_limit=w_limit,
-            h_limit=h_limit,
-        )
-        image = image.resize((new_w, new_h), Image.Resampling.LANCZOS)
-        image.save(os.path.join(thumbnail_dir, filename))
+    thumbnail_pending = set(filter_filenames(filenames, img_dir, specs, manifest_path))
+    phash_pending = (
+        set(manifest.filter_filenames(filenames, img_dir, phash_path))
+        if phash_path is not None
+        else set()
+    )
+    work = [d for d in filenames if d in thumbnail_pending or d in phash_pending]
+    tasks = [
+        (d, img_dir, specs if d in thumbnail_pending else [], d in phash_pending)
+        for d in work
+    ]
+
+    with ExitStack() as stack:
+        thumbnail_mf = stack.enter_context(open(manifest_path, "a"))
+        if len(phash_pending) > 0:
+            phash_manifest_path = manifest.get_manifest_path(phash_path)
+            f = stack.enter_context(open(phash_path, "a"))
+            mf = stack.enter_context(open(phash_manifest_path, "a"))
+        executor = stack.enter_context(ProcessPoolExecutor(max_workers=n_workers))
+        results = executor.map(_create_thumbnail, tasks, chunksize=16)
+        # Each result is recorded as it arrives,
+        # such that an interrupted run keeps the thumbnails and hashes so far.
+        for filename, result in zip(
+            work, tqdm(results, total=len(tasks), unit="img")
+        ):
+            if result.error is not None:
+                logger.warning(
+                    "Failed to create thumbnails for %s: %s",
+                    os.path.join(img_dir, filename),
+                    result.error,
+                )
+            source = manifest.stat_source(img_dir, filename)
+            if (
+                filename in thumbnail_pending
+                and result.error is None
+                and source is not None
+            ):
+                manifest.record(thumbnail_mf, source)
+                thumbnail_mf.flush()
+            if filename not in phash_pending:
+                continue
+            entry = {"filename": filename, "phash": result.phash}
+            f.write(f"{json.dumps(entry)}\n")
+            f.flush()
+            if source is not None:
+                manifest.record(mf, source)
+                mf.flush()
 
 
 if __name__ == "__main__":
-    server_dir = Path(__file__).parent.parent / "server"
-    img_dir = server_dir / "static" / "images"
-    thumbnail_dir = server_dir / "static" / "thumbnails"
+    logging.basicConfig(level=logging.INFO)
+    static_dir = Path(__file__).parent.parent / "server" / "static"
+    img_dir = static_dir / "images"
+    specs = [
+        ThumbnailSpec(str(static_dir / "thumbnails"), 100, 100),
+        # Larger thumbnails can be created from the same decode, e.g.,
+        # ThumbnailSpec(str(static_dir / "256x256"), 256, 256, "WEBP"),
+        # ThumbnailSpec(str(static_dir / "512x512"), 512, 512, "WEBP"),
+    ]
     create_thumbnails(
         img_dir=str(img_dir),
-        thumbnail_dir=str(thumbnail_dir),
-        w_limit=100,
-        h_limit=100,
+        specs=specs,
+        manifest_path=str(static_dir / "thumbnails.manifest.jsonl"),
+        phash_path=str(static_dir / "phashes.jsonl"),
     )
@@ -0,0 +1,137 @@
+"""
+Sidecar manifests recording which images an output JSONL file already covers.
+
+The manifest of `captions.jsonl` is `captions.manifest.jsonl`.
+It holds one small entry per processed image with the mtime and size
+(and optionally the content hash) of the source image, such that resuming
+a run does not need to parse the output file (for embeddings, mostly the
+vectors themselves), and images changed since they were processed are detected.
+The server writes the same entries on ingestion (see server/utils/manifest.py).
+"""
+
+import hashlib
+import json
+import os
+from typing import TextIO, TypedDict
+
+
+class ManifestEntry(TypedDict):
+    filename: str
+    mtime_ns: int
+    size: int
+    # SHA-256 of the image content, if computed.
+    sha256: str | None
+
+
+def get_manifest_path(output_path: str) -> str:
+    root, ext = os.path.splitext(output_path)
+    return f"{root}.manifest{ext}"
+
+
+def stat_source(img_dir: str, filename: str) -> ManifestEntry | None:
+    """
+    Get the manifest entry describing the current state of a source image.
+    Returns None if the image does not exist.
+    """
+
+    try:
+        stat = os.stat(os.path.join(img_dir, filename))
+    except FileNotFoundError:
+        return None
+    return {
+        "filename": filename,
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "sha256": None,
+    }
+
+
+def hash_source(img_dir: str, filename: str) -> str:
+    """Compute the SHA-256 of the content of a source image."""
+
+    digest = hashlib.sha256()
+    with open(os.path.join(img_dir, filename), "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_same_stat(a: ManifestEntry, b: ManifestEntry) -> bool:
+    return a["mtime_ns"] == b["mtime_ns"] and a["size"] == b["size"]
+
+
+def record(manifest_file: TextIO, entry: ManifestEntry) -> None:
+    manifest_file.write(f"{json.dumps(entry)}\n")
+
+
+def rebuild_manifest(output_path: str, img_dir: str) -> None:
+    """
+    Rebuild the manifest of an output JSONL file.
+
+    The output is streamed line by line and only the filenames are kept.
+    The source images are assumed unchanged since they were processed.
+    """
+
+    manifest_path = get_manifest_path(output_path)
+    tmp_path = f"{manifest_path}.partial"
+    with open(output_path) as f, open(tmp_path, "w") as mf:
+        for line in f:
+            try:
+                filename = json.loads(line)["filename"]
+            except (json.JSONDecodeError, KeyError):
+                continue
+            entry = stat_source(img_dir, filename)
+            if entry is not None:
+                record(mf, entry)
+    os.replace(tmp_path, manifest_path)
+
+
+def read_manifest(manifest_path: str) -> dict[str, ManifestEntry]:
+    """
+    Read the mapping from filename to manifest entry.
+    The last entry of a filename takes precedence.
+    """
+
+    if not os.path.exists(manifest_path):
+        return {}
+
+    entries: dict[str, ManifestEntry] = {}
+    with open(manifest_path) as f:
+        for line in f:
+            try:
+                entry: ManifestEntry = json.loads(line)
+            except json.JSONDecodeError:
+                # The last line may be truncated by a crash.
+                continue
+            entries[entry["filename"]] = entry
+    return entries
+
+
+def load_manifest(output_path: str, img_dir: str) -> dict[str, ManifestEntry]:
+    """
+    Load the mapping from filename to manifest entry of an output JSONL file.
+    The manifest is rebuilt from the output file only if it is missing.
+    """
+
+    if not os.path.exists(output_path):
+        return {}
+
+    manifest_path = get_manifest_path(output_path)
+    if not os.path.exists(manifest_path):
+        rebuild_manifest(output_path, img_dir)
+    return read_manifest(manifest_path)
+
+
+def filter_filenames(filenames: list[str], img_dir: str, output_path: str) -> list[str]:
+    """
+    Discards the images whose outputs are readily computed
+    and whose source files are unchanged since.
+    """
+
+    done = load_manifest(output_path, img_dir)
+    pending = []
+    for d in filenames:
+        source = stat_source(img_dir, d)
+        if d not in done or source is None or not is_same_stat(done[d], source):
+            pending.append(d)
+    return pending
@@ -1,4 +1,517 @@
+"""
+Set up all the cache to be used by the server in a single pass over the images.
+
+Each new or changed image is read and decoded once and fanned out to the
+thumbnail, perceptual hash, embedding, and caption stages. The stages run concurrently in
+their own threads and receive the decoded images through bounded queues.
+Each stage records the images it processed in a manifest together with the
+content hash of the image, such that an image touched without changing its
+content is not processed again.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import ExitStack
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Iterator, NamedTuple, TextIO, TypedDict
+
+import torch
+from PIL import Image
+from tqdm import tqdm
+from transformers import AutoProcessor, CLIPVisionModelWithProjection, PreTrainedModel
+
+from cache_captions import caption_batch, get_blip2
+from cache_embeddings import embed_batch
+from cache_thumbnails import (
+    PHASH_INPUT_SIZE,
+    ThumbnailSpec,
+    compute_phash,
+    get_resize_dims,
+    load_thumbnail_manifest,
+    render_thumbnails,
+)
+from manifest import (
+    ManifestEntry,
+    get_manifest_path,
+    hash_source,
+    is_same_stat,
+    load_manifest,
+    record,
+    stat_source,
+)
+
+# Suppress PIL.Image.DecompressionBombError for large images.
+Image.MAX_IMAGE_PIXELS = 5e8
+
+# Resolution covering the inputs of the embedding and captioning models.
+MODEL_INPUT_SIZE = (384, 384)
+
+
+class DecodedImage(NamedTuple):
+    filename: str
+    # None if the image cannot be decoded.
+    image: Image.Image | None
+    # Full-resolution size of the image.
+    size: tuple[int, int]
+    # State of the source image when it was read, including its content hash.
+    source: ManifestEntry
+
+
+class Stage(NamedTuple):
+    name: str
+    manifest_path: str
+    # Manifest entries of the images readily processed by the stage.
+    done: dict[str, ManifestEntry]
+    # Smallest decode size the stage needs given the full-resolution size.
+    input_size: Callable[[tuple[int, int]], tuple[int, int]]
+    # Process a batch and return the images to record as processed.
+    process: Callable[[list[DecodedImage]], list[DecodedImage]]
+    batch_size: int
+
+
+class StageStats(TypedDict):
+    images: int
+    seconds: float
+
+
+def make_thumbnail_stage(
+    img_dir: str, specs: list[ThumbnailSpec], manifest_path: str
+) -> Stage:
+    """
+    Create the stage rendering the thumbnails of every spec.
+    Without a manifest, the thumbnails not older than their images are adopted
+    and recorded in a new manifest.
+    """
+
+    for spec in specs:
+        if not os.path.exists(spec.directory):
+            os.makedirs(spec.directory)
+
+    done = load_thumbnail_manifest(img_dir, specs, manifest_path)
+
+    def input_size(size: tuple[int, int]) -> tuple[int, int]:
+        w, h = size
+        return max(
+            (get_resize_dims(w, h, s.w_limit, s.h_limit) for s in specs),
+            key=lambda d: d[0] * d[1],
+        )
+
+    def process(batch: list[DecodedImage]) -> list[DecodedImage]:
+        processed = []
+        for d in batch:
+            if d.image is None:
+                continue
+            try:
+                render_thumbnails(d.image, d.filename, d.size, specs)
+            except Exception as e:
+                print(f"Failed to create thumbnails for {d.filename}: {e}")
+                continue
+            processed.append(d)
+        return processed
+
+    return Stage("thumbnails", manifest_path, done, input_size, process, 1)
+
+
+def make_phash_stage(img_dir: str, save_to: str, stack: ExitStack) -> Stage:
+    """
+    Create the stage computing the perceptual hashes, appended to `save_to`.
+    """
+
+    done = load_manifest(save_to, img_dir)
+    f = stack.enter_context(open(save_to, "a"))
+
+    def process(batch: list[DecodedImage]) -> list[DecodedImage]:
+        for d in batch:
+            phash = None
+            if d.image is not None:
+                try:
+                    phash = compute_phash(d.image)
+                except Exception as e:
+                    print(f"Failed to hash {d.filename}: {e}")
+            entry = {"filename": d.filename, "phash": phash}
+            f.write(f"{json.dumps(entry)}\n")
+        f.flush()
+        return batch
+
+    return Stage(
+        "phashes",
+        get_manifest_path(save_to),
+        done,
+        lambda size: (PHASH_INPUT_SIZE, PHASH_INPUT_SIZE),
+        process,
+        64,
+    )
+
+
+def make_embedding_stage(
+    img_dir: str, save_to: str, device: str, stack: ExitStack
+) -> Stage:
+    """
+    Create the stage computing the CLIP embeddings, appended to `save_to`.
+    """
+
+    model_name = "openai/clip-vit-base-patch32"
+    model = CLIPVisionModelWithProjection.from_pretrained(model_name)
+    processor = AutoProcessor.from_pretrained(model_name)
+    model.to(device)
+
+    done = load_manifest(save_to, img_dir)
+    f = stack.enter_context(open(save_to, "a"))
+
+    def process(batch: list[DecodedImage]) -> list[DecodedImage]:
+        valid = [d for d in batch if d.image is not None]
+        embeddings = (
+            embed_batch(
+                model, processor, [d.image.convert("RGB") for d in valid], device
+            )
+            if len(valid) != 0
+            else []
+        )
+        filename2embedding = {d.filename: e for d, e in zip(valid, embeddings)}
+        for d in batch:
+            entry = {
+                "filename": d.filename,
+                "embedding": filename2embedding.get(d.filename),
+            }
+            f.write(f"{json.dumps(entry)}\n")
+        f.flush()
+        os.fsync(f.fileno())
+        return batch
+
+    return Stage(
+        "embeddings",
+        get_manifest_path(save_to),
+        done,
+        lambda size: MODEL_INPUT_SIZE,
+        process,
+        32,
+    )
+
+
+def make_caption_stage(
+    img_dir: str,
+    save_to: str,
+    getter: Callable[[], tuple[PreTrainedModel, AutoProcessor]],
+    prompt: str,
+    device: str,
+    stack: ExitStack,
+) -> Stage:
+    """
+    Create the stage generating the captions, appended to `save_to`.
+    """
+
+    model, processor = getter()
+    model.to(device)
+
+    done = load_manifest(save_to, img_dir)
+    f = stack.enter_context(open(save_to, "a"))
+
+    def process(batch: list[DecodedImage]) -> list[DecodedImage]:
+        valid = [d for d in batch if d.image is not None]
+        captions = (
+            caption_batch(
+                model,
+                processor,
+                [d.image.convert("RGB") for d in valid],
+                prompt,
+                device,
+            )
+            if len(valid) != 0
+            else []
+        )
+        filename2caption = {d.filename: c for d, c in zip(valid, captions)}
+        for d in batch:
+            entry = {
+                "filename": d.filename,
+                "caption": filename2caption.get(d.filename),
+            }
+            f.write(f"{json.dumps(entry)}\n")
+        f.flush()
+        os.fsync(f.fileno())
+        return batch
+
+    return Stage(
+        "captions",
+        get_manifest_path(save_to),
+        done,
+        lambda size: MODEL_INPUT_SIZE,
+        process,
+        16,
+    )
+
+
+def is_pending(
+    done: ManifestEntry | None,
+    source: ManifestEntry,
+    img_dir: str,
+    hashes: dict[str, str],
+) -> bool:
+    """
+    Check whether an image is new or changed since a stage processed it.
+    The content is hashed only if the mtime or size changed.
+    """
+
+    if done is None:
+        return True
+    if is_same_stat(done, source):
+        return False
+    if done.get("sha256") is None:
+        return True
+    filename = source["filename"]
+    if filename not in hashes:
+        hashes[filename] = hash_source(img_dir, filename)
+    return hashes[filename] != done["sha256"]
+
+
+def decode(filename: str, img_dir: str, stages: list[Stage]) -> DecodedImage | None:
+    """
+    Hash and decode an image.
+    JPEG images are decoded at the smallest scale that covers the inputs of all stages.
+    Returns None if the image was removed since it was listed.
+    """
+
+    source = stat_source(img_dir, filename)
+    if source is None:
+        return None
+    try:
+        source["sha256"] = hash_source(img_dir, filename)
+    except FileNotFoundError:
+        return None
+    try:
+        with Image.open(os.path.join(img_dir, filename)) as image:
+            size = image.size
+            input_sizes = [s.input_size(size) for s in stages]
+            image.draft(
+                None,
+                (max(d[0] for d in input_sizes), max(d[1] for d in input_sizes)),
+            )
+            image.load()
+            return DecodedImage(filename, image, size, source)
+    except Exception as e:
+        print(f"Failed to open image {filename}: {e}")
+        return DecodedImage(filename, None, (0, 0), source)
+
+
+def decode_all(
+    filenames: list[str],
+    img_dir: str,
+    stages: dict[str, list[Stage]],
+    stats: StageStats,
+    n_workers: int,
+) -> Iterator[DecodedImage | None]:
+    """
+    Decode the images in background threads, keeping at most
+    `2 * n_workers` decoded images ahead of the consumer.
+    Yields None for the images removed since they were listed.
+    """
+
+    lock = threading.Lock()
+
+    def timed_decode(filename: str) -> DecodedImage | None:
+        start = time.perf_counter()
+        decoded = decode(filename, img_dir, stages[filename])
+        with lock:
+            stats["seconds"] += time.perf_counter() - start
+            stats["images"] += 1
+        return decoded
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        remaining = iter(filenames)
+        pending: deque[Future] = deque(
+            executor.submit(timed_decode, d) for d in islice(remaining, 2 * n_workers)
+        )
+        while pending:
+            future = pending.popleft()
+            upcoming = next(remaining, None)
+            if upcoming is not None:
+                pending.append(executor.submit(timed_decode, upcoming))
+            yield future.result()
+
+
+def run_stage(
+    stage: Stage,
+    inbox: queue.Queue,
+    manifest_file: TextIO,
+    stats: StageStats,
+    errors: list[BaseException],
+) -> None:
+    """
+    Consume the decoded images of a stage until the None sentinel.
+    After a failure, the inbox is still drained such that the producer never blocks.
+    """
+
+    batch: list[DecodedImage] = []
+
+    def flush() -> None:
+        start = time.perf_counter()
+        processed = stage.process(batch)
+        stats["seconds"] += time.perf_counter() - start
+        stats["images"] += len(batch)
+        for d in processed:
+            record(manifest_file, d.source)
+        manifest_file.flush()
+        batch.clear()
+
+    failed = False
+    while True:
+        item: DecodedImage | None = inbox.get()
+        if item is None:
+            break
+        if failed:
+            continue
+        batch.append(item)
+        if len(batch) < stage.batch_size:
+            continue
+        try:
+            flush()
+        except BaseException as e:
+            errors.append(e)
+            failed = True
+    if not failed and len(batch) != 0:
+        try:
+            flush()
+        except BaseException as e:
+            errors.append(e)
+
+
+def run_pipeline(
+    img_dir: str,
+    stages: list[Stage],
+    n_decoders: int = 4,
+    queue_size: int = 64,
+) -> dict[str, StageStats]:
+    """
+    Process the new or changed images in `img_dir` with the stages.
+
+    Parameters
+    ----------
+    img_dir : str
+        Path to the directory containing images.
+    stages : list[Stage]
+        The stages to fan the decoded images out to.
+    n_decoders : int
+        Number of threads reading, hashing, and decoding images.
+    queue_size : int
+        Maximum number of decoded images waiting for each stage.
+
+    Returns
+    -------
+    dict[str, StageStats]
+        Number of images processed and busy seconds of the decode step and each stage.
+    """
+
+    filenames = sorted(
+        d for d in os.listdir(img_dir) if os.path.isfile(os.path.join(img_dir, d))
+    )
+    stats: dict[str, StageStats] = {"decode": {"images": 0, "seconds": 0.0}}
+    stats.update({s.name: {"images": 0, "seconds": 0.0} for s in stages})
+
+    with ExitStack() as stack:
+        manifest_files = {
+            s.name: stack.enter_context(open(s.manifest_path, "a")) for s in stages
+        }
+
+        # Plan which stages each image goes through.
+        hashes: dict[str, str] = {}
+        filename2stages: dict[str, list[Stage]] = {}
+        for filename in filenames:
+            source = stat_source(img_dir, filename)
+            if source is None:
+                # Removed since it was listed.
+                continue
+            for stage in stages:
+                done = stage.done.get(filename)
+                if is_pending(done, source, img_dir, hashes):
+                    filename2stages.setdefault(filename, []).append(stage)
+                elif not is_same_stat(done, source):
+                    # Unchanged content; record the new stat to skip hashing next time.
+                    record(
+                        manifest_files[stage.name],
+                        {**source, "sha256": done["sha256"]},
+                    )
+                    manifest_files[stage.name].flush()
+
+        inboxes = {s.name: queue.Queue(maxsize=queue_size) for s in stages}
+        errors: list[BaseException] = []
+        threads = [
+            threading.Thread(
+                target=run_stage,
+                args=(
+                    stage,
+                    inboxes[stage.name],
+                    manifest_files[stage.name],
+                    stats[stage.name],
+                    errors,
+                ),
+            )
+            for stage in stages
+        ]
+        for thread in threads:
+            thread.start()
+
+        work = [d for d in filenames if d in filename2stages]
+        try:
+            decoded_images = decode_all(
+                work, img_dir, filename2stages, stats["decode"], n_decoders
+            )
+            for decoded in tqdm(decoded_images, total=len(work), unit="img"):
+                if decoded is None:
+                    continue
+                for stage in filename2stages[decoded.filename]:
+                    inboxes[stage.name].put(decoded)
+        finally:
+            for inbox in inboxes.values():
+                inbox.put(None)
+            for thread in threads:
+                thread.join()
+
+    if len(errors) != 0:
+        raise errors[0]
+    return stats
+
+
+def print_summary(stats: dict[str, StageStats], elapsed: float) -> None:
+    print(f"Finished in {elapsed:.1f}s")
+    for name, d in stats.items():
+        throughput = d["images"] / d["seconds"] if d["seconds"] > 0 else 0.0
+        print(
+            f"{name:<12}{d['images']:>8} images"
+            f"{d['seconds']:>10.1f}s busy"
+            f"{throughput:>10.2f} images/sec"
+        )
+
+
 if __name__ == "__main__":
-    exec(open("cache_captions.py").read())
-    exec(open("cache_embeddings.py").read())
-    exec(open("cache_thumbnails.py").read())
+    static_dir = Path(__file__).parent.parent / "server" / "static"
+    img_dir = str(static_dir / "images")
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    prompt = "Question: what is the type of the visualization? Answer:"
+    specs = [ThumbnailSpec(str(static_dir / "thumbnails"), 100, 100)]
+
+    start = time.perf_counter()
+    with ExitStack() as stack:
+        stages = [
+            make_thumbnail_stage(
+                img_dir, specs, str(static_dir / "thumbnails.manifest.jsonl")
+            ),
+            make_phash_stage(img_dir, str(static_dir / "phashes.jsonl"), stack),
+            make_embedding_stage(
+                img_dir, str(static_dir / "embeddings.jsonl"), device, stack
+            ),
+            make_caption_stage(
+                img_dir,
+                str(static_dir / "captions.jsonl"),
+                get_blip2,
+                prompt,
+                device,
+                stack,
+            ),
+        ]
+        stats = run_pipeline(img_dir, stages)
+    print_summary(stats, time.perf_counter() - start)
@@ -0,0 +1,5 @@
+"""
+Benchmarks of the server utilities and endpoints on synthetic corpora.
+
+Run `uv run python -m benchmarks` from `server/`.
+"""
@@ -0,0 +1,72 @@
+"""
+Run the benchmarks and store the results under the current commit.
+
+Examples
+--------
+uv run python -m benchmarks
+uv run python -m benchmarks --sizes 1000 200000 --cases clustering
+uv run python -m benchmarks --compare 1a2b3c4
+"""
+
+import argparse
+import os
+from pathlib import Path
+
+from utils.profiling import SLOW_REQUEST_ENV
+
+from .corpus import make_corpus
+from .harness import (
+    compare_results,
+    get_commit,
+    load_results,
+    run_benchmarks,
+    save_results,
+)
+
+BENCHMARK_DIR = Path(__file__).parent
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 50_000])
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument(
+        "--cases", default=None, help="Only run the cases containing this string."
+    )
+    parser.add_argument("--data-dir", type=Path, default=BENCHMARK_DIR / "data")
+    parser.add_argument("--results-dir", type=Path, default=BENCHMARK_DIR / "results")
+    parser.add_argument(
+        "--compare",
+        default=None,
+        help="Commit (or path of a results file) to compare the results with.",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    # Every large grid is slow; do not log each of them.
+    os.environ.setdefault(SLOW_REQUEST_ENV, "0")
+
+    baseline = None
+    if args.compare is not None:
+        baseline_path = Path(args.compare)
+        if not baseline_path.is_file():
+            baseline_path = args.results_dir / f"{args.compare}.json"
+        # Loaded first, as the results of the same commit overwrite it.
+        baseline = load_results(baseline_path)
+
+    corpora = [make_corpus(args.data_dir, n, args.dim) for n in args.sizes]
+    results = run_benchmarks(corpora, args.dim, args.repeats, args.cases)
+    path = save_results(results, args.results_dir, get_commit())
+    print(f"Saved the results to {path}")
+
+    if baseline is not None:
+        print(f"Compared with {baseline_path}:")
+        for line in compare_results(baseline, results):
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
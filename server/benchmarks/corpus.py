@@ -0,0 +1,106 @@
+"""
+This module provides synthetic corpora shaped like the real resources:
+CLIP-like embeddings (unit-norm, clustered) and visualization captions.
+"""
+
+import json
+import uuid
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+
+CHART_TYPES = [
+    "bar chart",
+    "line chart",
+    "scatter plot",
+    "pie chart",
+    "map",
+    "diagram",
+    "table",
+    "area chart",
+    "histogram",
+    "network graph",
+]
+
+SUBJECTS = [
+    "population",
+    "trade",
+    "temperature",
+    "mortality",
+    "rainfall",
+    "imports and exports",
+    "railway traffic",
+    "election results",
+]
+
+PREFIXES = [
+    "the type of the visualization is",
+    "it is",
+    "this is",
+    "",
+]
+
+
+class Corpus(NamedTuple):
+    uuids: list[str]
+    # Laid out like the server directory, with the files under static/.
+    base_dir: Path
+    embedding_path: Path
+    caption_path: Path
+
+
+def make_caption(rng: np.random.Generator) -> str:
+    prefix = PREFIXES[rng.integers(len(PREFIXES))]
+    chart = CHART_TYPES[rng.integers(len(CHART_TYPES))]
+    subject = SUBJECTS[rng.integers(len(SUBJECTS))]
+    year = rng.integers(1750, 1950)
+    return f"{prefix} a {chart} of the {subject} in {year}".strip()
+
+
+def make_embeddings(
+    n: int, dim: int, rng: np.random.Generator, n_clusters: int = 50
+) -> np.ndarray:
+    """Unit-norm vectors scattered around random cluster centers."""
+
+    centers = rng.normal(size=(n_clusters, dim))
+    embeddings = centers[rng.integers(n_clusters, size=n)]
+    embeddings += rng.normal(scale=0.5, size=(n, dim))
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings.astype(np.float32)
+
+
+def make_corpus(data_dir: Path, n: int, dim: int = 512, seed: int = 0) -> Corpus:
+    """
+    Write the embedding and caption JSONL files of n synthetic images.
+    The files are reused if they exist.
+    """
+
+    base_dir = data_dir / f"{n}-{dim}-{seed}"
+    static_dir = base_dir / "static"
+    static_dir.mkdir(parents=True, exist_ok=True)
+    embedding_path = static_dir / "embeddings.jsonl"
+    caption_path = static_dir / "captions.jsonl"
+    rng = np.random.default_rng([seed, 0])
+    uuids = [str(uuid.UUID(bytes=rng.bytes(16), version=4)) for _ in range(n)]
+
+    if not embedding_path.exists():
+        embeddings = make_embeddings(n, dim, np.random.default_rng([seed, 1]))
+        tmp_path = embedding_path.with_suffix(".partial")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for d, embedding in zip(uuids, embeddings):
+                # Nested like the output of the CLIP image encoder.
+                obj = {"filename": f"{d}.jpg", "embedding": [embedding.tolist()]}
+                f.write(f"{json.dumps(obj)}\n")
+        tmp_path.replace(embedding_path)
+
+    if not caption_path.exists():
+        rng = np.random.default_rng([seed, 2])
+        tmp_path = caption_path.with_suffix(".partial")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for d in uuids:
+                obj = {"filename": f"{d}.jpg", "caption": make_caption(rng)}
+                f.write(f"{json.dumps(obj)}\n")
+        tmp_path.replace(caption_path)
+
+    return Corpus(uuids, base_dir, embedding_path, caption_path)
@@ -0,0 +1,320 @@
+"""
+This module provides the benchmark cases and the functions to run them,
+record their time and peak memory, and compare the results between commits.
+"""
+
+import json
+import math
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import NamedTuple, TypedDict
+
+import numpy as np
+
+from utils.assign_grid import assign_grid
+from utils.captioning import process_caption
+from utils.clustering import clustering, find_center_uuid
+from utils.loaders import (
+    build_embedding_store,
+    load_embedding_store,
+    load_embeddings,
+    load_uuid2caption,
+)
+from utils.near_duplicates import find_near_duplicates, load_store_simhashes, simhash
+
+from .corpus import Corpus
+
+# Results slower than the baseline by this factor are reported as regressions.
+REGRESSION_RATIO = 1.25
+
+
+class Result(TypedDict):
+    case: str
+    n: int
+    dim: int
+    best_seconds: float
+    median_seconds: float
+    peak_bytes: int
+
+
+class Case(NamedTuple):
+    name: str
+    # Largest corpus the case runs on,
+    # e.g., t-SNE and the assignment do not scale to 200k images.
+    max_n: int
+    # Prepare the function to measure given the corpus (and a test client).
+    setup: Callable[[Corpus, "ClientFactory"], Callable[[], object]]
+
+
+ClientFactory = Callable[[], object]
+
+
+def get_grid_shape(n: int, aspect_ratio: float = 2) -> tuple[int, int]:
+    """The grid shape of the label app, see `computeDenseGridShape`."""
+
+    n_cols = math.ceil(math.sqrt(n * aspect_ratio))
+    return math.ceil(n / n_cols), n_cols
+
+
+def _store_matrix(corpus: Corpus) -> np.ndarray:
+    store = load_embedding_store(str(corpus.embedding_path), 20)
+    return np.asarray(store.matrix, dtype=float)
+
+
+def _setup_build_store(corpus: Corpus, _) -> Callable[[], object]:
+    return lambda: build_embedding_store(str(corpus.embedding_path), 20)
+
+
+def _setup_load_embeddings(corpus: Corpus, _) -> Callable[[], object]:
+    load_embedding_store(str(corpus.embedding_path), 20)
+    return lambda: load_embeddings(corpus.uuids, str(corpus.embedding_path))
+
+
+def _setup_clustering(corpus: Corpus, _) -> Callable[[], object]:
+    embeddings = _store_matrix(corpus)
+    n_clusters = math.isqrt(len(corpus.uuids))
+    return lambda: clustering(embeddings, n_clusters)
+
+
+def _setup_find_center(corpus: Corpus, _) -> Callable[[], object]:
+    embeddings = _store_matrix(corpus)
+    return lambda: find_center_uuid(embeddings, corpus.uuids)
+
+
+def _setup_assign_grid(corpus: Corpus, _) -> Callable[[], object]:
+    embeddings = _store_matrix(corpus)
+    n_rows, n_cols = get_grid_shape(len(corpus.uuids))
+    return lambda: assign_grid(embeddings, n_rows, n_cols)
+
+
+def _setup_near_duplicates(corpus: Corpus, _) -> Callable[[], object]:
+    embeddings = _store_matrix(corpus)
+    simhashes = simhash(embeddings)
+    return lambda: find_near_duplicates(embeddings, simhashes)
+
+
+def _setup_process_caption(corpus: Corpus, _) -> Callable[[], object]:
+    captions = list(load_uuid2caption(str(corpus.caption_path)).values())
+    return lambda: [process_caption(d) for d in captions]
+
+
+def _setup_post(path: str, make_body: Callable[[Corpus], object]):
+    def setup(corpus: Corpus, make_client: ClientFactory) -> Callable[[], object]:
+        client = make_client()
+        body = make_body(corpus)
+
+        def post() -> object:
+            response = client.post(path, json=body)
+            response.raise_for_status()
+            return response
+
+        # Warm up the loaders such that the endpoint is measured warm.
+        post()
+        return post
+
+    return setup
+
+
+def _grid_body(corpus: Corpus) -> dict:
+    n_rows, n_cols = get_grid_shape(len(corpus.uuids))
+    return {"uuids": corpus.uuids, "nRows": n_rows, "nCols": n_cols}
+
+
+CASES = [
+    Case("build_embedding_store", 200_000, _setup_build_store),
+    Case("load_embeddings", 200_000, _setup_load_embeddings),
+    Case("clustering", 200_000, _setup_clustering),
+    Case("find_center_uuid", 200_000, _setup_find_center),
+    Case("assign_grid", 2_000, _setup_assign_grid),
+    Case("process_caption", 200_000, _setup_process_caption),
+    Case("find_near_duplicates", 200_000, _setup_near_duplicates),
+    Case(
+        "POST /clustering",
+        200_000,
+        _setup_post(
+            "/clustering",
+            lambda c: {"uuids": c.uuids, "nClusters": math.isqrt(len(c.uuids))},
+        ),
+    ),
+    Case("POST /findCenter", 200_000, _setup_post("/findCenter", lambda c: c.uuids)),
+    Case("POST /assignGrid", 2_000, _setup_post("/assignGrid", _grid_body)),
+    Case("POST /captioning", 200_000, _setup_post("/captioning", lambda c: c.uuids)),
+    Case(
+        "POST /nearDuplicates",
+        200_000,
+        _setup_post("/nearDuplicates", lambda c: {"uuids": c.uuids}),
+    ),
+]
+
+
+def measure(func: Callable[[], object], repeats: int) -> tuple[float, float, int]:
+    """
+    Measure the best and median time of the repeated calls,
+    and the peak memory allocated by one more call traced by tracemalloc.
+    The time is measured untraced, as tracing slows down allocations.
+    """
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(times), statistics.median(times), peak
+
+
+@contextmanager
+def serve_corpus(corpus: Corpus) -> Iterator[ClientFactory]:
+    """
+    Point the server app at the corpus, the way the test fixture does,
+    and yield a factory of test clients.
+    """
+
+    from fastapi.testclient import TestClient
+
+    import server as server_module
+    from utils.selections import SelectionRegistry
+
+    patched = {
+        "BASE_DIR": corpus.base_dir,
+        "UUID2FILENAME": {d: f"{d}.jpg" for d in corpus.uuids},
+        "SELECTIONS": SelectionRegistry(),
+    }
+    original = {k: getattr(server_module, k) for k in patched}
+    for k, v in patched.items():
+        setattr(server_module, k, v)
+    client = None
+    try:
+
+        def make_client() -> TestClient:
+            nonlocal client
+            if client is None:
+                client = TestClient(server_module.app)
+            return client
+
+        yield make_client
+    finally:
+        if client is not None:
+            client.close()
+        for k, v in original.items():
+            setattr(server_module, k, v)
+
+
+def run_benchmarks(
+    corpora: list[Corpus],
+    dim: int,
+    repeats: int = 3,
+    case_filter: str | None = None,
+    log: Callable[[str], None] = print,
+) -> list[Result]:
+    results: list[Result] = []
+    for corpus in corpora:
+        n = len(corpus.uuids)
+        load_embedding_store.cache_clear()
+        load_uuid2caption.cache_clear()
+        load_store_simhashes.cache_clear()
+        with serve_corpus(corpus) as make_client:
+            for case in CASES:
+                if case_filter is not None and case_filter not in case.name:
+                    continue
+                if n > case.max_n:
+                    continue
+                func = case.setup(corpus, make_client)
+                best, median, peak = measure(func, repeats)
+                results.append(
+                    {
+                        "case": case.name,
+                        "n": n,
+                        "dim": dim,
+                        "best_seconds": best,
+                        "median_seconds": median,
+                        "peak_bytes": peak,
+                    }
+                )
+                log(format_result(results[-1]))
+    load_embedding_store.cache_clear()
+    load_uuid2caption.cache_clear()
+    load_store_simhashes.cache_clear()
+    return results
+
+
+def format_result(result: Result) -> str:
+    return (
+        f"{result['case']:<24} n={result['n']:<7} "
+        f"best={result['best_seconds']:9.4f}s "
+        f"median={result['median_seconds']:9.4f}s "
+        f"peak={result['peak_bytes'] / 2**20:9.1f}MiB"
+    )
+
+
+def _git(*args: str) -> str:
+    return subprocess.run(
+        ["git", *args], capture_output=True, text=True, check=True
+    ).stdout.strip()
+
+
+def get_commit() -> str:
+    """The short hash of HEAD, suffixed with `-dirty` if the server has changes."""
+
+    try:
+        commit = _git("rev-parse", "--short", "HEAD")
+        dirty = _git("status", "--porcelain", "--", ".")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{commit}-dirty" if dirty else commit
+
+
+def save_results(results: list[Result], results_dir: Path, commit: str) -> Path:
+    results_dir.mkdir(parents=True, exist_ok=True)
+    path = results_dir / f"{commit}.json"
+    report = {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "machine": platform.platform(),
+        "processor": platform.processor(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "results": results,
+    }
+    path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    return path
+
+
+def load_results(path: Path) -> list[Result]:
+    return json.loads(path.read_text(encoding="utf-8"))["results"]
+
+
+def compare_results(baseline: list[Result], results: list[Result]) -> list[str]:
+    """
+    Compare the results with a baseline by the best time and the peak memory.
+    Returns the lines of the comparison table.
+    """
+
+    base = {(d["case"], d["n"]): d for d in baseline}
+    lines = []
+    for result in results:
+        before = base.get((result["case"], result["n"]))
+        if before is None:
+            continue
+        time_ratio = result["best_seconds"] / max(before["best_seconds"], 1e-9)
+        memory_ratio = result["peak_bytes"] / max(before["peak_bytes"], 1)
+        flag = (
+            "  REGRESSION" if max(time_ratio, memory_ratio) > REGRESSION_RATIO else ""
+        )
+        lines.append(
+            f"{result['case']:<24} n={result['n']:<7} "
+            f"time x{time_ratio:5.2f} memory x{memory_ratio:5.2f}{flag}"
+        )
+    return lines
@@ -0,0 +1,96 @@
+"""
+This module provides a load test of the event loop's responsiveness:
+heavy compute requests run concurrently with a stream of image GETs,
+while a monitor measures how late the event loop wakes up.
+A call blocking the event loop shows up in both the GET latencies and the lag.
+"""
+
+import asyncio
+import time
+from typing import NamedTuple, TypedDict
+
+import httpx
+import numpy as np
+
+
+class HeavyRequest(NamedTuple):
+    method: str
+    path: str
+    json: object
+
+
+class Responsiveness(TypedDict):
+    # Number of GETs completed while the heavy requests ran.
+    get_count: int
+    get_p50: float
+    get_p99: float
+    get_max: float
+    # How late the event loop resumed a sleeping task, in seconds.
+    loop_lag_p99: float
+    loop_lag_max: float
+
+
+async def measure_responsiveness(
+    app,
+    heavy_requests: list[HeavyRequest],
+    get_paths: list[str],
+    get_interval: float = 0.01,
+    lag_interval: float = 0.005,
+) -> Responsiveness:
+    """
+    Send the heavy requests concurrently to the ASGI app and,
+    until all have completed, GET the paths one after another in a loop.
+
+    Raises
+    ------
+    httpx.HTTPStatusError
+        If a request fails.
+    """
+
+    loop = asyncio.get_running_loop()
+    done = asyncio.Event()
+    lags: list[float] = []
+    latencies: list[float] = []
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+
+        async def monitor_lag() -> None:
+            while not done.is_set():
+                start = loop.time()
+                await asyncio.sleep(lag_interval)
+                lags.append(max(0.0, loop.time() - start - lag_interval))
+
+        async def stream_gets() -> None:
+            i = 0
+            while not done.is_set():
+                start = time.perf_counter()
+                response = await client.get(get_paths[i % len(get_paths)])
+                latencies.append(time.perf_counter() - start)
+                response.raise_for_status()
+                i += 1
+                await asyncio.sleep(get_interval)
+
+        async def send_heavy() -> None:
+            try:
+                responses = await asyncio.gather(
+                    *(
+                        client.request(d.method, d.path, json=d.json)
+                        for d in heavy_requests
+                    )
+                )
+            finally:
+                done.set()
+            for response in responses:
+                response.raise_for_status()
+
+        await asyncio.gather(monitor_lag(), stream_gets(), send_heavy())
+
+    return {
+        "get_count": len(latencies),
+        "get_p50": float(np.percentile(latencies, 50)),
+        "get_p99": float(np.percentile(latencies, 99)),
+        "get_max": max(latencies),
+        "loop_lag_p99": float(np.percentile(lags, 99)),
+        "loop_lag_max": max(lags),
+    }
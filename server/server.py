@@ -1,25 +1,128 @@
 """FastAPI app for image taxonomy labeling.
 
 Serves images, thumbnails, and captions, and exposes clustering and grid
-assignment endpoints. CPU-heavy sklearn work runs via asyncio.to_thread so
-the event loop can still serve image GETs during /clustering, /findCenter(s),
-and /assignGrid.
+assignment endpoints. CPU-heavy sklearn work and the (first) loads of the
+embeddings and captions run via asyncio.to_thread so the event loop can still
+serve image GETs during /clustering, /findCenter(s), /assignGrid, and
+/captioning (see tests/test_responsiveness.py). Latencies, stage timings,
+and cache statistics are exposed in the Prometheus format at /metrics.
 """
 
 import asyncio
 import os
+import re
+from collections.abc import AsyncIterator
 from pathlib import Path
+from typing import Literal
 
-from fastapi import FastAPI, HTTPException
+from fastapi import (
+    Depends,
+    FastAPI,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    UploadFile,
+)
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
+from fastapi.responses import (
+    FileResponse,
+    ORJSONResponse,
+    PlainTextResponse,
+    StreamingResponse,
+)
+import numpy as np
+from pydantic import BaseModel, Field
 import uvicorn
 
-from utils.assign_grid import assign_grid
-from utils.captioning import captioning
-from utils.clustering import clustering, find_center_uuid
-from utils.loaders import build_uuid2filename, load_embeddings
+from utils.assign_grid import assign_grid, assign_grid_progressive
+from utils.caption_index import get_caption_index
+from utils.catalog import CATALOG_PATH_ENV, Catalog
+from utils.captioning import process_caption
+from utils.clustering import (
+    AUTO_TIME_BUDGET,
+    MAX_AUTO_CLUSTERS,
+    MIN_AUTO_CLUSTERS,
+    auto_clustering,
+    check_auto_params,
+    clustering,
+    find_center_uuid,
+)
+from utils.collection import COLLECTIONS_DIR_ENV, Collection, CollectionRegistry
+from utils.compute import (
+    COMPUTE_WORKERS_ENV,
+    WorkerError,
+    WorkerPool,
+    WorkersUnavailable,
+)
+from utils.derivatives import FORMATS, MAX_DIMENSION, DerivativeCache
+from utils.export import (
+    EXPORT_FORMATS,
+    NEXT_CURSOR_HEADER,
+    encode_arrow,
+    encode_ndjson,
+    encode_parquet,
+    iter_chunks,
+    require_pyarrow,
+    select_rows,
+)
+from utils.ingest import (
+    MAX_UPLOAD_BYTES,
+    IngestQueue,
+    is_image,
+    is_ingest_authorized,
+)
+from utils.loaders import (
+    EMBEDDING_STORE_ENV,
+    Uuid2Caption,
+    build_uuid2filename,
+    export_embedding_store,
+    filename2uuid,
+    load_embedding_store,
+    load_uuid2caption,
+)
+from utils.http_cache import (
+    REVALIDATE,
+    REVALIDATE_DAILY,
+    cached_file_response,
+    get_file_validators,
+    get_version_validators,
+    is_not_modified,
+    make_etag,
+    not_modified_response,
+)
+from utils.metrics import (
+    CONTENT_TYPE,
+    INPUT_SIZE,
+    REGISTRY,
+    THREAD_TASKS,
+    Collected,
+    MetricsMiddleware,
+    register_cache,
+    timed,
+)
+from utils.near_duplicates import (
+    extend_simhashes,
+    find_near_duplicates,
+    load_store_simhashes,
+    load_uuid2phash,
+)
+from utils.profiling import (
+    PROFILE_HEADER,
+    PROFILES,
+    ProfilingMiddleware,
+    call_traced,
+    is_authorized,
+    record_input,
+)
+from utils.responses import (
+    EVENT_STREAM_MEDIA_TYPE,
+    SHAPE_HEADER,
+    array_response,
+    json_text_response,
+    sse_event,
+)
+from utils.selections import SELECTIONS_DIR_ENV, Selection, SelectionRegistry
 
 app = FastAPI()
 app.add_middleware(
@@ -28,7 +131,16 @@ app.add_middleware(
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[SHAPE_HEADER, PROFILE_HEADER, NEXT_CURSOR_HEADER],
 )
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(ProfilingMiddleware)
+register_cache("embedding_store", load_embedding_store)
+register_cache("uuid2caption", load_uuid2caption)
+register_cache("caption_index", get_caption_index)
+register_cache("uuid2phash", load_uuid2phash)
+register_cache("store_simhashes", load_store_simhashes)
+register_cache("file_validators", get_version_validators)
 
 BASE_DIR = Path(__file__).parent
 IMAGE_DIR = BASE_DIR / "static" / "images"
@@ -39,115 +151,590 @@ except FileNotFoundError as exc:
 
 _MISSING_RESOURCE = "Server resource missing; run setup_samples.py / check static/"
 
+# Shared through files by the SERVER_WORKERS processes (see the main block).
+SELECTIONS = SelectionRegistry.from_env(os.environ.get(SELECTIONS_DIR_ENV))
+
+DERIVATIVES = DerivativeCache(BASE_DIR / "static" / ".derivatives")
+
+# The index of the catalog built by packages/shared/assets/download.py,
+# next to the catalog it indexes.
+CATALOG_PATH = (
+    BASE_DIR.parent / "packages" / "shared" / "assets" / "visualizations.sqlite"
+)
+CATALOG = Catalog(os.environ.get(CATALOG_PATH_ENV, str(CATALOG_PATH)))
+
+
+class _DefaultCollection(Collection):
+    """
+    The tree of BASE_DIR, served by the routes without a collection prefix.
+    Its resources are held by the caches shared by the paths,
+    hence are never unloaded.
+    """
+
+    def __init__(self):
+        super().__init__("default", BASE_DIR / "static")
+
+    @property
+    def static_dir(self) -> Path:
+        return BASE_DIR / "static"
+
+    @property
+    def image_dir(self) -> Path:
+        return IMAGE_DIR
+
+    def is_loaded(self, key: str) -> bool:
+        return key == "uuid2filename"
+
+    def uuid2filename(self) -> dict[str, str]:
+        return UUID2FILENAME
+
+    def embedding_store(self):
+        store = load_embedding_store(self.embedding_path, 20)
+        if not store.refresh():
+            # The file was replaced: the projection is refitted.
+            load_embedding_store.cache_clear()
+            load_store_simhashes.cache_clear()
+            store = load_embedding_store(self.embedding_path, 20)
+        return store
+
+    def uuid2caption(self) -> dict[str, str]:
+        return load_uuid2caption(self.caption_path)
+
+    def caption_index(self):
+        return get_caption_index(self.caption_path)
+
+    def uuid2phash(self) -> dict[str, int]:
+        return load_uuid2phash(self.phash_path)
+
+    def simhashes(self) -> np.ndarray:
+        return load_store_simhashes(self.embedding_path)
+
+
+DEFAULT_COLLECTION = _DefaultCollection()
+
+# The collections served under /collections/{name}, one per subdirectory
+# laid out like static/ (images/, thumbnails/, embeddings.jsonl, ...).
+COLLECTIONS = CollectionRegistry(
+    Path(os.environ.get(COLLECTIONS_DIR_ENV, BASE_DIR / "collections"))
+)
+
+REGISTRY.register(
+    Collected(
+        "collection_memory_bytes",
+        "Estimated memory of the resources loaded by each collection.",
+        "gauge",
+        ("collection",),
+        lambda: [((d["name"],), d["memoryBytes"]) for d in COLLECTIONS.usage()],
+    )
+)
+
+
+# The compute workers running /clustering and /assignGrid, if any (see worker.py).
+COMPUTE = WorkerPool.from_env(os.environ.get(COMPUTE_WORKERS_ENV))
+
+
+def get_collection(request: Request) -> Collection:
+    """The collection named in the path, or the default one for unprefixed routes."""
+
+    name = request.path_params.get("name")
+    if name is None:
+        return DEFAULT_COLLECTION
+    collection = COLLECTIONS.get(name)
+    if collection is None:
+        raise HTTPException(status_code=404, detail=f"Unknown collection: {name}")
+    return collection
+
+
+async def _lookup_filename(collection: Collection, uuid: str) -> str | None:
+    """
+    Get the filename of an image, listing the images off the event loop once.
+    On a miss, the images are listed again if the directory changed,
+    e.g., as another server worker ingested images.
+    """
+
+    try:
+        if collection.is_loaded("uuid2filename"):
+            uuid2filename = collection.uuid2filename()
+        else:
+            uuid2filename = await _run_in_thread(collection.uuid2filename)
+        if uuid not in uuid2filename:
+            await _run_in_thread(uuid2filename.refresh)
+        return uuid2filename.get(uuid)
+    except FileNotFoundError as exc:
+        raise HTTPException(status_code=503, detail=_MISSING_RESOURCE) from exc
+
+
+class SelectionRef(BaseModel):
+    """Reference to a selection registered via /selections."""
+
+    selection: str
+
+
+async def _resolve_selection(
+    uuids: list[str] | None, handle: str | None
+) -> tuple[list[str], Selection | None]:
+    """Get the UUIDs of a request given either explicitly or by a handle."""
+
+    if handle is None:
+        if uuids is None:
+            raise HTTPException(
+                status_code=400, detail="Either uuids or selection is required"
+            )
+        return uuids, None
+    # Run off the event loop, as the registry may read the shared selections.
+    selection = await _run_in_thread(SELECTIONS.get, handle)
+    if selection is None:
+        raise HTTPException(
+            status_code=404, detail=f"Unknown or expired selection: {handle}"
+        )
+    return selection.uuids, selection
+
+
+async def _run_in_thread(func, /, *args):
+    """Run a function in a worker thread, counting it as in flight."""
+
+    THREAD_TASKS.inc()
+    try:
+        return await asyncio.to_thread(call_traced, func, *args)
+    finally:
+        THREAD_TASKS.dec()
+
+
+def _record_input_size(size: int, route: str) -> None:
+    INPUT_SIZE.observe(size, route)
+    record_input("uuids", size)
+
+
+def _load_embeddings(
+    collection: Collection, uuids: list[str], selection: Selection | None
+) -> np.ndarray:
+    """Load the embeddings, reusing the row indices cached with the selection."""
+
+    store = collection.embedding_store()
+    with timed("load_embeddings"):
+        if selection is not None:
+            indices = selection.get_indices(store)
+        else:
+            indices = [store.uuid2index[uuid] for uuid in uuids]
+        return store.take(indices)
+
+
+def _uuid2caption(collection: Collection) -> Uuid2Caption:
+    uuid2caption = collection.uuid2caption()
+    # Follow the captions appended since, e.g., of ingested images,
+    # or reload them if the file was replaced.
+    uuid2caption.refresh()
+    return uuid2caption
+
+
+async def _compute_remotely(
+    function: str, collection: Collection, uuids: list[str], params: dict
+) -> np.ndarray:
+    """
+    Run a job on the compute workers.
+    Jobs are routed by the embedding store and its version,
+    such that each store is kept warm by one worker.
+    """
+
+    try:
+        # Identified by the file rather than its size, which grows with appends.
+        stat = os.stat(collection.embedding_path)
+    except FileNotFoundError as exc:
+        raise HTTPException(status_code=503, detail=_MISSING_RESOURCE) from exc
+    version = f"{stat.st_dev:x}-{stat.st_ino:x}"
+    payload = {
+        "collection": None if collection is DEFAULT_COLLECTION else collection.name,
+        "uuids": uuids,
+        **params,
+    }
+    key = f"{collection.embedding_path}@{version}"
+    try:
+        return await COMPUTE.run(function, key, payload)
+    except WorkerError as exc:
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail) from exc
+    except WorkersUnavailable as exc:
+        raise HTTPException(status_code=503, detail=str(exc)) from exc
+
 
 @app.get("/uuids/{uuid}/image")
-async def get_image(uuid: str):
-    if uuid not in UUID2FILENAME:
-        raise HTTPException(status_code=404, detail="Image not found")
-    path = IMAGE_DIR / UUID2FILENAME[uuid]
-    if not path.is_file():
+@app.get("/collections/{name}/uuids/{uuid}/image")
+async def get_image(
+    uuid: str,
+    request: Request,
+    w: int | None = Query(None, ge=1, le=MAX_DIMENSION),
+    h: int | None = Query(None, ge=1, le=MAX_DIMENSION),
+    format: str | None = None,
+    collection: Collection = Depends(get_collection),
+):
+    """
+    Get the image, or a derivative resized to fit within w * h
+    and/or converted to the format (jpeg, png, or webp) if any is given.
+    """
+
+    filename = await _lookup_filename(collection, uuid)
+    if filename is None:
         raise HTTPException(status_code=404, detail="Image not found")
-    return FileResponse(path)
+    path = collection.image_dir / filename
+    try:
+        validators = get_file_validators(str(path))
+    except FileNotFoundError as exc:
+        raise HTTPException(status_code=404, detail="Image not found") from exc
+    if w is None and h is None and format is None:
+        return cached_file_response(request, path, validators, REVALIDATE)
+
+    fmt = FORMATS.get(format or "jpeg")
+    if fmt is None:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported format: {format} (expected one of {list(FORMATS)})",
+        )
+    # The derivative is identified by the source, its version, and the parameters.
+    etag = make_etag(path, validators.etag, w, h, fmt.pil_format)
+    headers = {"ETag": etag, "Cache-Control": REVALIDATE}
+    if is_not_modified(request, etag):
+        return not_modified_response(headers)
+    name = etag.strip('"') + fmt.suffix
+    try:
+        derivative = await DERIVATIVES.get(path, name, w, h, fmt)
+    except OSError as exc:
+        raise HTTPException(status_code=422, detail="Image cannot be resized") from exc
+    return FileResponse(derivative, media_type=fmt.media_type, headers=headers)
 
 
 @app.get("/uuids/{uuid}/thumbnail")
-async def get_thumbnail(uuid: str):
-    thumbnail_dir = BASE_DIR / "static" / "thumbnails"
-    if uuid not in UUID2FILENAME:
+@app.get("/collections/{name}/uuids/{uuid}/thumbnail")
+async def get_thumbnail(
+    uuid: str, request: Request, collection: Collection = Depends(get_collection)
+):
+    filename = await _lookup_filename(collection, uuid)
+    if filename is None:
         raise HTTPException(status_code=404, detail="Thumbnail not found")
-    path = thumbnail_dir / UUID2FILENAME[uuid]
-    if not path.is_file():
-        raise HTTPException(status_code=404, detail="Thumbnail not found")
-    return FileResponse(path)
+    path = collection.thumbnail_dir / filename
+    try:
+        validators = get_file_validators(str(path))
+    except FileNotFoundError as exc:
+        raise HTTPException(status_code=404, detail="Thumbnail not found") from exc
+    return cached_file_response(request, path, validators, REVALIDATE_DAILY)
 
 
 @app.get("/uuids/{uuid}/caption")
-async def get_caption(uuid: str):
-    if uuid not in UUID2FILENAME:
+@app.get("/collections/{name}/uuids/{uuid}/caption")
+async def get_caption(
+    uuid: str, request: Request, collection: Collection = Depends(get_collection)
+):
+    if await _lookup_filename(collection, uuid) is None:
         raise HTTPException(status_code=404, detail="Caption not found")
-    caption_path = BASE_DIR / "static" / "captions.jsonl"
     try:
-        return captioning(uuid, str(caption_path))
+        # The first call loads the captions, hence run off the event loop.
+        uuid2caption = await _run_in_thread(_uuid2caption, collection)
+        # The ETag changes with the version of the caption store.
+        etag = make_etag(uuid2caption.version, uuid)
+        headers = {"ETag": etag, "Cache-Control": REVALIDATE}
+        if is_not_modified(request, etag):
+            return not_modified_response(headers)
+        caption = process_caption(uuid2caption[uuid])
     except FileNotFoundError as exc:
         raise HTTPException(status_code=503, detail=_MISSING_RESOURCE) from exc
     except KeyError as exc:
         raise HTTPException(status_code=404, detail=f"Unknown uuid: {exc}") from exc
+    return ORJSONResponse(caption, headers=headers)
 
 
-@app.post("/captioning")
-async def calc_captions(uuids: list[str | None]):
-    caption_path = BASE_DIR / "static" / "captions.jsonl"
+@app.post("/selections")
+async def register_selection(uuids: list[str]):
+    """
+    Register a UUID list and return its handle,
+    which the compute endpoints accept in place of the list.
+    """
+
+    if not uuids:
+        raise HTTPException(status_code=400, detail="uuids must be non-empty")
     try:
+        # Run off the event loop, as the registry may write the shared selections.
+        selection = await _run_in_thread(SELECTIONS.register, uuids)
+    except ValueError as exc:
+        raise HTTPException(status_code=413, detail=str(exc)) from exc
+    return {"handle": selection.handle, "size": len(selection.uuids)}
+
+
+@app.post("/captioning")
+@app.post("/collections/{name}/captioning")
+async def calc_captions(
+    body: list[str | None] | SelectionRef,
+    collection: Collection = Depends(get_collection),
+):
+    if isinstance(body, SelectionRef):
+        uuids, _ = await _resolve_selection(None, body.selection)
+    else:
+        uuids = body
+    _record_input_size(len(uuids), "/captioning")
+
+    def _captions() -> list[str | None]:
+        uuid2caption = _uuid2caption(collection)
         return [
-            captioning(uuid, str(caption_path)) if uuid is not None else None
+            process_caption(uuid2caption[uuid]) if uuid is not None else None
             for uuid in uuids
         ]
+
+    try:
+        return await _run_in_thread(_captions)
     except FileNotFoundError as exc:
         raise HTTPException(status_code=503, detail=_MISSING_RESOURCE) from exc
     except KeyError as exc:
         raise HTTPException(status_code=404, detail=f"Unknown uuid: {exc}") from exc
 
 
-class ClusteringRequest(BaseModel):
-    uuids: list[str]
-    nClusters: int
+@app.post("/metadata")
+async def get_metadata(body: list[str] | SelectionRef, request: Request):
+    """
+    Get the catalog records of the UUIDs, in their order (null for unknown UUIDs),
+    such that the apps fetch the records of the visible images only.
+    """
+
+    if isinstance(body, SelectionRef):
+        uuids, _ = await _resolve_selection(None, body.selection)
+    else:
+        uuids = body
+    _record_input_size(len(uuids), "/metadata")
+    try:
+        records = await _run_in_thread(CATALOG.lookup, uuids)
+    except FileNotFoundError as exc:
+        raise HTTPException(status_code=503, detail=_MISSING_RESOURCE) from exc
+    return json_text_response(records, request)
+
+
+class CaptionSearchRequest(BaseModel):
+    query: str
+    uuids: list[str] | None = None
+    selection: str | None = None
+    offset: int = 0
+    limit: int = 100
 
 
-@app.post("/clustering")
-async def calc_cluster_labels(req: ClusteringRequest):
+@app.post("/captions/search")
+@app.post("/collections/{name}/captions/search")
+async def search_captions(
+    req: CaptionSearchRequest, collection: Collection = Depends(get_collection)
+):
+    """
+    Find the UUIDs whose captions contain all the query terms
+    (a term ending with * matches as a prefix),
+    optionally among the given UUIDs or selection, one page at a time.
+    """
+
     uuids = req.uuids
+    if req.selection is not None:
+        uuids, _ = await _resolve_selection(None, req.selection)
+    if uuids is not None:
+        _record_input_size(len(uuids), "/captions/search")
+    if req.offset < 0 or not 1 <= req.limit <= 1000:
+        raise HTTPException(
+            status_code=400,
+            detail="offset must be non-negative and limit between 1 and 1000",
+        )
+
+    def _search() -> tuple[int, list[str]]:
+        index = collection.caption_index()
+        # Index the captions appended since the last search, if any.
+        index.update()
+        return index.search(req.query, uuids, req.offset, req.limit)
+
+    try:
+        total, found = await _run_in_thread(_search)
+    except FileNotFoundError as exc:
+        raise HTTPException(status_code=503, detail=_MISSING_RESOURCE) from exc
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    return {"total": total, "offset": req.offset, "uuids": found}
+
+
+class NearDuplicatesRequest(BaseModel):
+    uuids: list[str] | None = None
+    selection: str | None = None
+    minSimilarity: float = 0.95
+    maxDistance: int = 10
+
+
+def _near_duplicate_groups(
+    collection: Collection,
+    uuids: list[str],
+    selection: Selection | None,
+    min_similarity: float,
+    max_distance: int,
+) -> list[list[str]]:
+    store = collection.embedding_store()
+    unique = list(dict.fromkeys(uuids))
+    if selection is not None and len(unique) == len(uuids):
+        indices = selection.get_indices(store)
+    else:
+        indices = np.array([store.uuid2index[d] for d in unique], dtype=np.intp)
+    try:
+        uuid2phash = collection.uuid2phash()
+        phashes = [uuid2phash.get(d) for d in unique]
+    except FileNotFoundError:
+        # Without the hashes of scripts/cache_thumbnails.py, embeddings only.
+        phashes = None
+    groups = find_near_duplicates(
+        store.take(indices),
+        extend_simhashes(collection.simhashes(), store)[indices],
+        phashes,
+        min_similarity,
+        max_distance,
+    )
+    return [[unique[i] for i in group] for group in groups]
+
+
+@app.post("/nearDuplicates")
+@app.post("/collections/{name}/nearDuplicates")
+async def calc_near_duplicates(
+    req: NearDuplicatesRequest, collection: Collection = Depends(get_collection)
+):
+    """
+    Group the near-duplicate images (e.g., rescans of the same plate)
+    among the given UUIDs or selection by locality-sensitive hashing.
+    minSimilarity applies to the embeddings of the store, i.e., mean-centered
+    and reduced to 20 dimensions by PCA, not to the raw embeddings.
+    """
+
+    uuids, selection = await _resolve_selection(req.uuids, req.selection)
+    _record_input_size(len(uuids), "/nearDuplicates")
+    if not uuids:
+        raise HTTPException(status_code=400, detail="uuids must be non-empty")
+    if not -1 <= req.minSimilarity <= 1 or not 0 <= req.maxDistance <= 64:
+        raise HTTPException(
+            status_code=400,
+            detail="minSimilarity must be in [-1, 1] and maxDistance in [0, 64]",
+        )
+    try:
+        groups = await _run_in_thread(
+            _near_duplicate_groups,
+            collection,
+            uuids,
+            selection,
+            req.minSimilarity,
+            req.maxDistance,
+        )
+    except FileNotFoundError as exc:
+        raise HTTPException(status_code=503, detail=_MISSING_RESOURCE) from exc
+    except KeyError as exc:
+        raise HTTPException(status_code=404, detail=f"Unknown uuid: {exc}") from exc
+    return {"groups": groups}
+
+
+class ClusteringRequest(BaseModel):
+    uuids: list[str] | None = None
+    selection: str | None = None
+    # "auto" picks the number in [minClusters, maxClusters]
+    # with the best silhouette score, within timeBudget seconds.
+    nClusters: int | Literal["auto"]
+    minClusters: int = MIN_AUTO_CLUSTERS
+    maxClusters: int = MAX_AUTO_CLUSTERS
+    timeBudget: float = AUTO_TIME_BUDGET
+
+
+@app.post("/clustering", response_class=ORJSONResponse)
+@app.post("/collections/{name}/clustering", response_class=ORJSONResponse)
+async def calc_cluster_labels(
+    req: ClusteringRequest,
+    request: Request,
+    collection: Collection = Depends(get_collection),
+):
+    uuids, selection = await _resolve_selection(req.uuids, req.selection)
+    _record_input_size(len(uuids), "/clustering")
     n_clusters = req.nClusters
     if not uuids:
         raise HTTPException(status_code=400, detail="uuids must be non-empty")
-    if n_clusters < 1 or n_clusters > len(uuids):
+    if n_clusters == "auto":
+        try:
+            check_auto_params(req.minClusters, req.maxClusters, req.timeBudget)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc)) from exc
+    elif n_clusters < 1 or n_clusters > len(uuids):
         raise HTTPException(
             status_code=400,
             detail="nClusters must be between 1 and len(uuids)",
         )
-    embedding_path = BASE_DIR / "static" / "embeddings.jsonl"
+    if COMPUTE is not None:
+        params = req.model_dump(
+            include={"nClusters", "minClusters", "maxClusters", "timeBudget"}
+        )
+        labels = await _compute_remotely("clustering", collection, uuids, params)
+        return array_response(labels, request)
     try:
-        embeddings = load_embeddings(uuids, str(embedding_path))
+        embeddings = await _run_in_thread(
+            _load_embeddings, collection, uuids, selection
+        )
     except FileNotFoundError as exc:
         raise HTTPException(status_code=503, detail=_MISSING_RESOURCE) from exc
     except KeyError as exc:
         raise HTTPException(status_code=404, detail=f"Unknown uuid: {exc}") from exc
     except ValueError as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
-    labels = await asyncio.to_thread(clustering, embeddings, n_clusters)
-    return labels.tolist()
+    if n_clusters == "auto":
+        labels = await _run_in_thread(
+            auto_clustering,
+            embeddings,
+            req.minClusters,
+            req.maxClusters,
+            req.timeBudget,
+        )
+    else:
+        labels = await _run_in_thread(clustering, embeddings, n_clusters)
+    return array_response(labels, request)
 
 
 @app.post("/findCenter")
-async def calc_center_uuid(uuids: list[str]):
+@app.post("/collections/{name}/findCenter")
+async def calc_center_uuid(
+    body: list[str] | SelectionRef, collection: Collection = Depends(get_collection)
+):
+    if isinstance(body, SelectionRef):
+        uuids, selection = await _resolve_selection(None, body.selection)
+    else:
+        uuids, selection = body, None
+    _record_input_size(len(uuids), "/findCenter")
     if not uuids:
         raise HTTPException(status_code=400, detail="uuids must be non-empty")
-    embedding_path = BASE_DIR / "static" / "embeddings.jsonl"
     try:
-        embeddings = load_embeddings(uuids, str(embedding_path))
+        embeddings = await _run_in_thread(
+            _load_embeddings, collection, uuids, selection
+        )
     except FileNotFoundError as exc:
         raise HTTPException(status_code=503, detail=_MISSING_RESOURCE) from exc
     except KeyError as exc:
         raise HTTPException(status_code=404, detail=f"Unknown uuid: {exc}") from exc
     except ValueError as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
-    return await asyncio.to_thread(find_center_uuid, embeddings, uuids)
+    return await _run_in_thread(find_center_uuid, embeddings, uuids)
 
 
 @app.post("/findCenters")
-async def calc_center_uuids(groups: list[list[str]]):
-    embedding_path = BASE_DIR / "static" / "embeddings.jsonl"
+@app.post("/collections/{name}/findCenters")
+async def calc_center_uuids(
+    groups: list[list[str] | SelectionRef],
+    collection: Collection = Depends(get_collection),
+):
+    resolved = [
+        (
+            await _resolve_selection(None, group.selection)
+            if isinstance(group, SelectionRef)
+            else (group, None)
+        )
+        for group in groups
+    ]
 
     def _centers() -> list[str]:
         return [
-            find_center_uuid(load_embeddings(uuids, str(embedding_path)), uuids)
-            for uuids in groups
+            find_center_uuid(_load_embeddings(collection, uuids, selection), uuids)
+            for uuids, selection in resolved
         ]
 
+    _record_input_size(sum(len(uuids) for uuids, _ in resolved), "/findCenters")
     try:
-        for uuids in groups:
+        for uuids, _ in resolved:
             if not uuids:
                 raise HTTPException(status_code=400, detail="uuids must be non-empty")
-        return await asyncio.to_thread(_centers)
+        return await _run_in_thread(_centers)
     except FileNotFoundError as exc:
         raise HTTPException(status_code=503, detail=_MISSING_RESOURCE) from exc
     except KeyError as exc:
@@ -157,14 +744,19 @@ async def calc_center_uuids(groups: list[list[str]]):
 
 
 class AssignGridRequest(BaseModel):
-    uuids: list[str]
+    uuids: list[str] | None = None
+    selection: str | None = None
     nRows: int
     nCols: int
 
 
-@app.post("/assignGrid")
-async def calc_cell_indices(req: AssignGridRequest):
-    uuids = req.uuids
+async def _resolve_grid_request(
+    req: AssignGridRequest, route: str
+) -> tuple[list[str], Selection | None, int, int]:
+    """Validate a grid request."""
+
+    uuids, selection = await _resolve_selection(req.uuids, req.selection)
+    _record_input_size(len(uuids), route)
     n_rows = req.nRows
     n_cols = req.nCols
     if n_rows < 1 or n_cols < 1:
@@ -179,23 +771,364 @@ async def calc_cell_indices(req: AssignGridRequest):
             status_code=400,
             detail="assignGrid requires at least 2 uuids",
         )
-    embedding_path = BASE_DIR / "static" / "embeddings.jsonl"
+    return uuids, selection, n_rows, n_cols
+
+
+async def _load_grid_embeddings(
+    req: AssignGridRequest, route: str, collection: Collection
+) -> tuple[np.ndarray, int, int]:
+    """Validate a grid request and load the embeddings to assign."""
+
+    uuids, selection, n_rows, n_cols = await _resolve_grid_request(req, route)
     try:
-        embeddings = load_embeddings(uuids, str(embedding_path))
+        embeddings = await _run_in_thread(
+            _load_embeddings, collection, uuids, selection
+        )
     except FileNotFoundError as exc:
         raise HTTPException(status_code=503, detail=_MISSING_RESOURCE) from exc
     except KeyError as exc:
         raise HTTPException(status_code=404, detail=f"Unknown uuid: {exc}") from exc
     except ValueError as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
-    assignment = await asyncio.to_thread(assign_grid, embeddings, n_rows, n_cols)
-    return assignment.tolist()
+    return embeddings, n_rows, n_cols
+
+
+@app.post("/assignGrid", response_class=ORJSONResponse)
+@app.post("/collections/{name}/assignGrid", response_class=ORJSONResponse)
+async def calc_cell_indices(
+    req: AssignGridRequest,
+    request: Request,
+    collection: Collection = Depends(get_collection),
+):
+    if COMPUTE is not None:
+        uuids, _, n_rows, n_cols = await _resolve_grid_request(req, "/assignGrid")
+        assignment = await _compute_remotely(
+            "assignGrid", collection, uuids, {"nRows": n_rows, "nCols": n_cols}
+        )
+        return array_response(assignment, request)
+    embeddings, n_rows, n_cols = await _load_grid_embeddings(
+        req, "/assignGrid", collection
+    )
+    assignment = await _run_in_thread(assign_grid, embeddings, n_rows, n_cols)
+    return array_response(assignment, request)
+
+
+@app.post("/assignGrid/stream")
+@app.post("/collections/{name}/assignGrid/stream")
+async def stream_cell_indices(
+    req: AssignGridRequest, collection: Collection = Depends(get_collection)
+):
+    """
+    Stream the grid assignment in stages of increasing quality
+    as server-sent `layout` events, the last of which has the stage "final"
+    and equals the response of /assignGrid.
+    With compute workers, only the final stage is sent, computed by a worker.
+    """
+
+    if COMPUTE is not None:
+        uuids, _, n_rows, n_cols = await _resolve_grid_request(
+            req, "/assignGrid/stream"
+        )
+        assignment = await _compute_remotely(
+            "assignGrid", collection, uuids, {"nRows": n_rows, "nCols": n_cols}
+        )
+        stages = iter([("final", assignment)])
+    else:
+        embeddings, n_rows, n_cols = await _load_grid_embeddings(
+            req, "/assignGrid/stream", collection
+        )
+        stages = assign_grid_progressive(embeddings, n_rows, n_cols)
+
+    async def events() -> AsyncIterator[bytes]:
+        while True:
+            # Each stage is computed in a worker thread.
+            item = await _run_in_thread(next, stages, None)
+            if item is None:
+                return
+            stage, assignment = item
+            data = {"stage": stage, "assignment": np.ascontiguousarray(assignment)}
+            yield sse_event("layout", data)
+
+    return StreamingResponse(
+        events(),
+        media_type=EVENT_STREAM_MEDIA_TYPE,
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+class ExportRequest(BaseModel):
+    # Either restricts the export; all the rows are exported without both.
+    uuids: list[str] | None = None
+    selection: str | None = None
+    fields: list[Literal["caption", "embedding"]] = ["caption", "embedding"]
+    format: Literal["ndjson", "arrow", "parquet"] = "ndjson"
+    cursor: int = Field(0, ge=0)
+    limit: int | None = Field(None, ge=1)
+
+
+@app.post("/export")
+@app.post("/collections/{name}/export")
+async def export_rows(
+    req: ExportRequest, collection: Collection = Depends(get_collection)
+):
+    """
+    Stream the uuid, caption, and projected embedding of the rows
+    of the embedding store, in store order, from the cursor on.
+    If the limit leaves rows out, the X-Next-Cursor header holds
+    the cursor to resume from.
+    """
+
+    if req.format != "ndjson":
+        try:
+            require_pyarrow()
+        except ImportError as exc:
+            raise HTTPException(
+                status_code=501, detail=f"The {req.format} export requires pyarrow"
+            ) from exc
+    uuids, selection = None, None
+    if req.uuids is not None or req.selection is not None:
+        uuids, selection = await _resolve_selection(req.uuids, req.selection)
+    captions = "caption" in req.fields
+    embeddings = "embedding" in req.fields
+
+    def prepare():
+        store = collection.embedding_store()
+        if selection is not None:
+            indices = selection.get_indices(store)
+        elif uuids is not None:
+            indices = np.fromiter(
+                (store.uuid2index[uuid] for uuid in uuids),
+                dtype=np.intp,
+                count=len(uuids),
+            )
+        else:
+            indices = None
+        uuid2caption = None
+        if captions:
+            uuid2caption = collection.uuid2caption()
+            uuid2caption.refresh()
+        rows, next_cursor = select_rows(store, indices, req.cursor, req.limit)
+        return store, rows, next_cursor, uuid2caption
+
+    try:
+        store, rows, next_cursor, uuid2caption = await _run_in_thread(prepare)
+    except FileNotFoundError as exc:
+        raise HTTPException(status_code=503, detail=_MISSING_RESOURCE) from exc
+    except KeyError as exc:
+        raise HTTPException(status_code=404, detail=f"Unknown uuid: {exc}") from exc
+
+    chunks = iter_chunks(store, rows, uuid2caption, embeddings)
+    dim = store.dim if embeddings else None
+    if req.format == "arrow":
+        encoded = encode_arrow(chunks, captions, dim)
+    elif req.format == "parquet":
+        encoded = encode_parquet(chunks, captions, dim)
+    else:
+        encoded = encode_ndjson(chunks)
+
+    async def content() -> AsyncIterator[bytes]:
+        while True:
+            # Each chunk is read and encoded in a worker thread.
+            data = await _run_in_thread(next, encoded, None)
+            if data is None:
+                return
+            yield data
+
+    headers = {"Cache-Control": "no-store"}
+    if next_cursor is not None:
+        headers[NEXT_CURSOR_HEADER] = str(next_cursor)
+    return StreamingResponse(
+        content(), media_type=EXPORT_FORMATS[req.format], headers=headers
+    )
+
+
+# The images being ingested, processed by a background thread.
+INGEST = IngestQueue.from_env()
+
+# Ingested images are named <uuid>.<extension>.
+_INGEST_NAME = re.compile(r"[A-Za-z0-9_-]+\.[A-Za-z0-9]+")
+
+
+def _copy_upload(file: UploadFile, path: Path) -> None:
+    # Copied in blocks, such that an oversized upload is stopped at the limit.
+    size = 0
+    with path.open("wb") as f:
+        while block := file.file.read(2**20):
+            size += len(block)
+            if size > MAX_UPLOAD_BYTES:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"Images must be at most {MAX_UPLOAD_BYTES} bytes",
+                )
+            f.write(block)
+    if not is_image(path):
+        raise HTTPException(status_code=400, detail=f"Not an image: {file.filename}")
+
+
+def _save_uploads(
+    collection: Collection, files: list[UploadFile], names: list[str]
+) -> None:
+    # Written next to the images and checked, then moved in,
+    # such that the images are complete once listed
+    # and none is added if any upload is rejected.
+    partial_dir = collection.static_dir / ".ingest"
+    partial_dir.mkdir(exist_ok=True)
+    partials = [partial_dir / d for d in names]
+    try:
+        for file, partial in zip(files, partials):
+            _copy_upload(file, partial)
+    except BaseException:
+        for partial in partials:
+            partial.unlink(missing_ok=True)
+        raise
+    for partial, name in zip(partials, names):
+        os.replace(partial, collection.image_dir / name)
+
+
+@app.post("/ingest", status_code=202)
+@app.post("/collections/{name}/ingest", status_code=202)
+async def ingest_images(
+    files: list[UploadFile],
+    collection: Collection = Depends(get_collection),
+    x_ingest_token: str | None = Header(default=None),
+):
+    """
+    Add images named <uuid>.<extension>, served at once,
+    and queue them for thumbnailing, embedding and captioning.
+    """
+
+    if not is_ingest_authorized(x_ingest_token):
+        raise HTTPException(status_code=403, detail="Invalid ingest token")
+    names = [file.filename or "" for file in files]
+    if not all(_INGEST_NAME.fullmatch(d) for d in names):
+        raise HTTPException(
+            status_code=400, detail="Images must be named <uuid>.<extension>"
+        )
+    uuids = [filename2uuid(d) for d in names]
+    if len(set(uuids)) != len(uuids):
+        raise HTTPException(status_code=400, detail="Duplicate uuids")
+    try:
+        uuid2filename = await _run_in_thread(collection.uuid2filename)
+        existing = [d for d in uuids if d in uuid2filename]
+        if existing:
+            raise HTTPException(
+                status_code=409, detail=f"Images already exist: {existing}"
+            )
+        await _run_in_thread(_save_uploads, collection, files, names)
+    except FileNotFoundError as exc:
+        raise HTTPException(status_code=503, detail=_MISSING_RESOURCE) from exc
+    uuid2filename.update(zip(uuids, names))
+    INGEST.submit(collection, uuids)
+    return {"uuids": uuids}
+
+
+@app.post("/ingest/scan", status_code=202)
+@app.post("/collections/{name}/ingest/scan", status_code=202)
+async def ingest_new_images(
+    collection: Collection = Depends(get_collection),
+    x_ingest_token: str | None = Header(default=None),
+):
+    """
+    Queue the images in the images directory without an embedding,
+    e.g., copied there by hand, unless they are being ingested.
+    """
+
+    if not is_ingest_authorized(x_ingest_token):
+        raise HTTPException(status_code=403, detail="Invalid ingest token")
+
+    def _new_uuids() -> list[str]:
+        uuid2filename = collection.uuid2filename()
+        uuid2filename.refresh()
+        try:
+            embedded = collection.embedding_store().uuid2index
+        except FileNotFoundError:
+            embedded = {}
+        return [
+            d
+            for d in uuid2filename
+            if d not in embedded and not INGEST.is_pending(collection, d)
+        ]
+
+    try:
+        uuids = await _run_in_thread(_new_uuids)
+    except FileNotFoundError as exc:
+        raise HTTPException(status_code=503, detail=_MISSING_RESOURCE) from exc
+    if uuids:
+        INGEST.submit(collection, uuids)
+    return {"uuids": uuids}
+
+
+@app.get("/ingest/{uuid}")
+@app.get("/collections/{name}/ingest/{uuid}")
+async def get_ingest_status(
+    uuid: str, collection: Collection = Depends(get_collection)
+):
+    """The status of each stage: queued, done, failed, or skipped."""
+
+    status = INGEST.status(collection, uuid)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Image not being ingested")
+    return {"uuid": uuid, "stages": status}
+
+
+@app.get("/collections")
+async def get_collections():
+    """List the collections with the estimated memory of their loaded resources."""
+
+    usage = COLLECTIONS.usage()
+    return {
+        "maxBytes": COLLECTIONS.max_bytes,
+        "totalBytes": sum(d["memoryBytes"] for d in usage),
+        "collections": usage,
+    }
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+@app.get("/profiles/{profile_id}")
+async def get_profile(
+    profile_id: str, x_profile_token: str | None = Header(default=None)
+):
+    """Get the report of a request profiled with ?profile=1."""
+
+    if not is_authorized(x_profile_token):
+        raise HTTPException(status_code=403, detail="Invalid profile token")
+    report = PROFILES.get(profile_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return report
+
+
+def preload_embedding_store() -> None:
+    """
+    Export the embedding store once for the workers to memory-map,
+    such that they share one read-only copy of the embeddings.
+    """
+
+    embedding_path = BASE_DIR / "static" / "embeddings.jsonl"
+    if not embedding_path.is_file():
+        return
+    store_dir = BASE_DIR / "static" / ".embedding_store"
+    export_embedding_store(str(embedding_path), 20, store_dir)
+    os.environ[EMBEDDING_STORE_ENV] = str(store_dir)
 
 
 if __name__ == "__main__":
+    # Production mode: SERVER_WORKERS processes without reload.
+    workers = os.environ.get("SERVER_WORKERS")
+    if workers is not None:
+        preload_embedding_store()
+        # Such that each worker gets the selections registered by the others.
+        os.environ.setdefault(
+            SELECTIONS_DIR_ENV, str(BASE_DIR / "static" / ".selections")
+        )
     uvicorn.run(
         f"{Path(__file__).stem}:app",
         host=os.environ.get("SERVER_HOST", "127.0.0.1"),
         port=5001,
-        reload=True,
+        reload=workers is None,
+        workers=None if workers is None else max(1, int(workers)),
     )
@@ -5,13 +5,19 @@ Setup the server resources with
 - precomputed thumbnails at `./thumbnails.zip`
 """
 
+import asyncio
+import hashlib
+import json
 import os
-import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import shutil
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import TypedDict
-from zipfile import ZipFile
+from zipfile import ZipFile, ZipInfo
 
+import httpx
 import requests
 from requests.adapters import HTTPAdapter
 from tqdm import tqdm
@@ -19,14 +25,18 @@ from urllib3.util.retry import Retry
 
 MAX_ATTEMPTS = 5
 REQUEST_TIMEOUT = 60
-MAX_WORKERS = max(1, int(os.environ.get("SAMPLE_DOWNLOAD_WORKERS", "8")))
+MAX_CONNECTIONS = max(1, int(os.environ.get("SAMPLE_DOWNLOAD_CONNECTIONS", "8")))
+CHUNK_SIZE = 1 << 16
+EXTRACT_WORKERS = min(8, os.cpu_count() or 1)
 
 
 class FileMetadata(TypedDict):
     download_url: str
+    # Git blob SHA-1 of the file content.
+    sha: str
 
 
-def _session(pool_size: int = MAX_WORKERS) -> requests.Session:
+def _session(pool_size: int = MAX_CONNECTIONS) -> requests.Session:
     session = requests.Session()
     retries = Retry(
         total=3,
@@ -47,9 +57,9 @@ def _session(pool_size: int = MAX_WORKERS) -> requests.Session:
     return session
 
 
-def get_img_urls() -> list[str]:
+def get_img_metadata() -> list[FileMetadata]:
     """
-    Get the download URLs of the sample images.
+    Get the metadata of the sample images.
 
     See https://docs.github.com/en/rest/repos/contents#get-repository-content.
     """
@@ -57,8 +67,13 @@ def get_img_urls() -> list[str]:
     url = "https://api.github.com/repos/oldvis/image-taxonomy/contents/images"
     response = _session().get(url, timeout=REQUEST_TIMEOUT)
     response.raise_for_status()
-    data: list[FileMetadata] = response.json()
-    return [file["download_url"] for file in data]
+    return response.json()
+
+
+def get_img_urls() -> list[str]:
+    """Get the download URLs of the sample images."""
+
+    return [file["download_url"] for file in get_img_metadata()]
 
 
 def url2filename(url: str) -> str:
@@ -88,9 +103,73 @@ def filter_queries(urls: list[str], img_dir: str) -> list[str]:
     return [d for d in urls if url2filename(d) not in filenames]
 
 
-def _download_one(session: requests.Session, url: str, dest: Path) -> None:
+def git_blob_sha1(path: Path) -> str:
+    """
+    Compute the git blob SHA-1 of a file, as listed by the GitHub contents API.
     """
-    Download a single URL to dest, retrying transient network failures.
+
+    digest = hashlib.sha1(f"blob {path.stat().st_size}\0".encode())
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def _stream_to(client: httpx.AsyncClient, url: str, tmp: Path) -> None:
+    """
+    Stream the response body of url into tmp.
+    If tmp holds a partial download, only the remaining bytes are requested.
+
+    Raises
+    ------
+    ValueError
+        If the partial file does not match the remote content.
+    """
+
+    offset = tmp.stat().st_size if tmp.exists() else 0
+    headers = {"Range": f"bytes={offset}-"} if offset > 0 else {}
+    async with client.stream(
+        "GET", url, headers=headers, timeout=REQUEST_TIMEOUT
+    ) as response:
+        content_range = response.headers.get("Content-Range", "")
+        if response.status_code == 416:
+            # Nothing left to fetch if the partial file is already complete.
+            if content_range == f"bytes */{offset}":
+                return
+            tmp.unlink()
+            raise ValueError(f"Partial download of {url} is larger than the file")
+        response.raise_for_status()
+
+        if response.status_code == 206:
+            if not content_range.startswith(f"bytes {offset}-"):
+                tmp.unlink()
+                raise ValueError(f"Unexpected Content-Range for {url}: {content_range}")
+            mode = "ab"
+        else:
+            # The server ignored the Range header and sent the whole file.
+            mode = "wb"
+        with tmp.open(mode) as f:
+            async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                f.write(chunk)
+
+
+async def _download_one(
+    client: httpx.AsyncClient, url: str, dest: Path, sha: str | None = None
+) -> None:
+    """
+    Download a single URL to dest, streaming to a ``.partial`` file.
+    Retries resume the partial file with HTTP Range requests.
+
+    Parameters
+    ----------
+    client : httpx.AsyncClient
+        The client to send the requests with.
+    url : str
+        The URL to download.
+    dest : Path
+        The path to save the downloaded file.
+    sha : str | None
+        The expected git blob SHA-1 of the file. If None, no checksum is verified.
 
     Raises
     ------
@@ -98,30 +177,62 @@ def _download_one(session: requests.Session, url: str, dest: Path) -> None:
         If the download fails after ``MAX_ATTEMPTS`` attempts.
     """
 
+    tmp = dest.with_suffix(dest.suffix + ".partial")
     last_error: Exception | None = None
     for attempt in range(1, MAX_ATTEMPTS + 1):
         try:
-            response = session.get(url, timeout=REQUEST_TIMEOUT)
-            response.raise_for_status()
-            tmp = dest.with_suffix(dest.suffix + ".partial")
-            tmp.write_bytes(response.content)
+            await _stream_to(client, url, tmp)
+            if sha is not None and await asyncio.to_thread(git_blob_sha1, tmp) != sha:
+                tmp.unlink()
+                raise ValueError(f"Checksum mismatch for {url}")
             tmp.replace(dest)
             return
-        except (
-            requests.exceptions.SSLError,
-            requests.exceptions.ConnectionError,
-            requests.exceptions.ChunkedEncodingError,
-            requests.exceptions.Timeout,
-            requests.exceptions.HTTPError,
-        ) as exc:
+        except (httpx.TransportError, httpx.HTTPStatusError, ValueError) as exc:
             last_error = exc
             if attempt < MAX_ATTEMPTS:
-                time.sleep(min(2**attempt, 30))
+                await asyncio.sleep(min(2**attempt, 30))
     raise RuntimeError(
         f"Failed to download {url} after {MAX_ATTEMPTS} attempts"
     ) from last_error
 
 
+async def _fetch_all(
+    urls: list[str],
+    img_dir: Path,
+    checksums: dict[str, str],
+    max_connections: int,
+) -> None:
+    """
+    Download the URLs concurrently with at most max_connections in flight.
+    """
+
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections,
+    )
+    # Queue the downloads here rather than in the connection pool,
+    # where waiting for a free connection counts towards the pool timeout.
+    semaphore = asyncio.Semaphore(max_connections)
+    async with httpx.AsyncClient(limits=limits, follow_redirects=True) as client:
+
+        async def download(url: str) -> None:
+            async with semaphore:
+                dest = img_dir / url2filename(url)
+                await _download_one(client, url, dest, checksums.get(url))
+
+        tasks = [asyncio.create_task(download(url)) for url in urls]
+        try:
+            for task in tqdm(
+                asyncio.as_completed(tasks),
+                total=len(tasks),
+                desc="Fetch Image Progress",
+            ):
+                await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
 def _is_within_directory(directory: Path, target: Path) -> bool:
     try:
         target.resolve().relative_to(directory.resolve())
@@ -130,10 +241,64 @@ def _is_within_directory(directory: Path, target: Path) -> bool:
         return False
 
 
-def safe_extract(zip_path: Path, dest_dir: Path) -> None:
+def _extract_manifest_path(zip_path: Path, dest_dir: Path) -> Path:
+    return dest_dir / f".{zip_path.name}.extracted.json"
+
+
+def _zip_identity(zip_path: Path) -> dict[str, int]:
+    stat = zip_path.stat()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _has_size(target: Path, member: ZipInfo) -> bool:
+    return target.is_file() and target.stat().st_size == member.file_size
+
+
+def _member_is_current(target: Path, member: ZipInfo) -> bool:
+    """Check whether target holds the content of member by size and CRC-32."""
+
+    if not _has_size(target, member):
+        return False
+    crc = 0
+    with target.open("rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc == member.CRC
+
+
+def _extract_member(zf: ZipFile, member: ZipInfo, target: Path) -> bool:
+    """
+    Extract member to target unless target already holds its content.
+    Returns whether the member was extracted.
+    """
+
+    if member.is_dir():
+        target.mkdir(parents=True, exist_ok=True)
+        return False
+    if _member_is_current(target, member):
+        return False
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(target.name + ".partial")
+    with zf.open(member) as src, tmp.open("wb") as dst:
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    tmp.replace(target)
+    return True
+
+
+def safe_extract(zip_path: Path, dest_dir: Path) -> int:
     """
     Extract a zip archive into dest_dir after validating member paths.
 
+    Members already present with a matching size and CRC-32 are skipped,
+    and the others are extracted in parallel threads.
+    Completion is recorded in a manifest in dest_dir, such that extracting
+    the same archive again only checks the sizes of the extracted files.
+
+    Returns
+    -------
+    int
+        The number of extracted members.
+
     Raises
     ------
     RuntimeError
@@ -141,17 +306,52 @@ def safe_extract(zip_path: Path, dest_dir: Path) -> None:
     """
 
     with ZipFile(zip_path, "r") as zf:
-        for member in zf.infolist():
-            target = dest_dir / member.filename
-            if not _is_within_directory(dest_dir, target):
-                raise RuntimeError(f"Illegal zip path: {member.filename}")
-        zf.extractall(dest_dir)
+        members = zf.infolist()
+    targets = [dest_dir / member.filename for member in members]
+    for member, target in zip(members, targets):
+        if not _is_within_directory(dest_dir, target):
+            raise RuntimeError(f"Illegal zip path: {member.filename}")
+
+    manifest_path = _extract_manifest_path(zip_path, dest_dir)
+    identity = _zip_identity(zip_path)
+    if (
+        manifest_path.is_file()
+        and json.loads(manifest_path.read_text(encoding="utf-8")) == identity
+        and all(m.is_dir() or _has_size(t, m) for m, t in zip(members, targets))
+    ):
+        return 0
+
+    # ZipFile objects are not safe to share across threads.
+    local = threading.local()
+    opened: list[ZipFile] = []
+    lock = threading.Lock()
+
+    def extract(member: ZipInfo, target: Path) -> bool:
+        if not hasattr(local, "zf"):
+            local.zf = ZipFile(zip_path, "r")
+            with lock:
+                opened.append(local.zf)
+        return _extract_member(local.zf, member, target)
+
+    try:
+        with ThreadPoolExecutor(max_workers=EXTRACT_WORKERS) as executor:
+            extracted = sum(executor.map(extract, members, targets))
+    finally:
+        for zf in opened:
+            zf.close()
+
+    manifest_path.write_text(json.dumps(identity), encoding="utf-8")
+    return extracted
 
 
 def extract_if_needed(zip_path: Path, dest_dir: Path, marker: Path) -> None:
     """
     Extract zip_path into dest_dir unless marker already exists.
 
+    Use this instead of ``safe_extract`` for files that are appended to
+    after extraction (e.g., ``embeddings.jsonl`` by the cache scripts),
+    which would otherwise be overwritten with the archived version.
+
     Raises
     ------
     RuntimeError
@@ -163,12 +363,12 @@ def extract_if_needed(zip_path: Path, dest_dir: Path, marker: Path) -> None:
     safe_extract(zip_path, dest_dir)
 
 
-def _thumbnails_ready(base_dir: Path) -> bool:
-    thumbnails = base_dir / "thumbnails"
-    return thumbnails.is_dir() and any(thumbnails.iterdir())
-
-
-def fetch_imgs(urls: list[str], img_dir: str) -> None:
+def fetch_imgs(
+    urls: list[str],
+    img_dir: str,
+    checksums: dict[str, str] | None = None,
+    max_connections: int = MAX_CONNECTIONS,
+) -> None:
     """
     Given the URLs of the images, download them to the specified directory.
 
@@ -178,6 +378,11 @@ def fetch_imgs(urls: list[str], img_dir: str) -> None:
         The URLs of the images to be downloaded.
     img_dir : str
         The directory to save the images.
+    checksums : dict[str, str] | None
+        The expected git blob SHA-1 of the images keyed by URL.
+        Images without a checksum are not verified.
+    max_connections : int
+        The maximum number of concurrent connections.
 
     Raises
     ------
@@ -188,37 +393,26 @@ def fetch_imgs(urls: list[str], img_dir: str) -> None:
     if not os.path.exists(img_dir):
         os.makedirs(img_dir)
 
-    session = _session(MAX_WORKERS)
     urls_filtered = filter_queries(urls, img_dir)
     if not urls_filtered:
         return
 
-    workers = min(MAX_WORKERS, len(urls_filtered))
-    with ThreadPoolExecutor(max_workers=workers) as executor:
-        futures = {
-            executor.submit(
-                _download_one,
-                session,
-                url,
-                Path(img_dir) / url2filename(url),
-            ): url
-            for url in urls_filtered
-        }
-        for future in tqdm(
-            as_completed(futures),
-            total=len(futures),
-            desc="Fetch Image Progress",
-        ):
-            future.result()
+    asyncio.run(
+        _fetch_all(urls_filtered, Path(img_dir), checksums or {}, max_connections)
+    )
 
 
 if __name__ == "__main__":
     base_dir = Path(__file__).parent
 
     # Download sample images.
-    img_urls = get_img_urls()
+    img_metadata = get_img_metadata()
     img_dir = base_dir / "images"
-    fetch_imgs(img_urls, str(img_dir))
+    fetch_imgs(
+        [file["download_url"] for file in img_metadata],
+        str(img_dir),
+        checksums={file["download_url"]: file["sha"] for file in img_metadata},
+    )
 
     # Unzip the embeddings (skip if already present).
     extract_if_needed(
@@ -227,7 +421,5 @@ if __name__ == "__main__":
         marker=base_dir / "embeddings.jsonl",
     )
 
-    # Unzip the thumbnails (skip if directory already has files).
-    thumbnails_zip = base_dir / "thumbnails.zip"
-    if not _thumbnails_ready(base_dir):
-        safe_extract(thumbnails_zip, base_dir)
+    # Unzip the thumbnails (skip the ones already extracted).
+    safe_extract(base_dir / "thumbnails.zip", base_dir)
@@ -8,7 +8,19 @@ from pathlib import Path
 import pytest
 from fastapi.testclient import TestClient
 
-from utils.loaders import load_uuid2caption, load_uuid2embedding
+from utils.caption_index import get_caption_index
+from utils.catalog import Catalog
+from utils.collection import CollectionRegistry
+from utils.derivatives import DerivativeCache
+from utils.http_cache import get_version_validators
+from utils.ingest import IngestQueue
+from utils.loaders import (
+    build_uuid2filename,
+    load_embedding_store,
+    load_uuid2caption,
+)
+from utils.near_duplicates import load_store_simhashes, load_uuid2phash
+from utils.selections import SelectionRegistry
 
 
 @pytest.fixture
@@ -37,19 +49,35 @@ def client(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> TestClient:
 
     import server as server_module
 
-    load_uuid2embedding.cache_clear()
+    load_embedding_store.cache_clear()
     load_uuid2caption.cache_clear()
+    get_caption_index.cache_clear()
+    load_uuid2phash.cache_clear()
+    load_store_simhashes.cache_clear()
+    get_version_validators.cache_clear()
 
     monkeypatch.setattr(server_module, "BASE_DIR", tmp_path)
     monkeypatch.setattr(server_module, "IMAGE_DIR", images)
+    monkeypatch.setattr(server_module, "UUID2FILENAME", build_uuid2filename(images))
+    monkeypatch.setattr(server_module, "SELECTIONS", SelectionRegistry())
     monkeypatch.setattr(
-        server_module,
-        "UUID2FILENAME",
-        {"a": "a.jpg", "b": "b.jpg", "c": "c.jpg"},
+        server_module, "DERIVATIVES", DerivativeCache(static / ".derivatives")
+    )
+    monkeypatch.setattr(
+        server_module, "COLLECTIONS", CollectionRegistry(tmp_path / "collections")
+    )
+    monkeypatch.setattr(server_module, "COMPUTE", None)
+    monkeypatch.setattr(server_module, "INGEST", IngestQueue())
+    monkeypatch.setattr(
+        server_module, "CATALOG", Catalog(str(static / "visualizations.sqlite"))
     )
 
     with TestClient(server_module.app) as test_client:
         yield test_client
 
-    load_uuid2embedding.cache_clear()
+    load_embedding_store.cache_clear()
     load_uuid2caption.cache_clear()
+    get_caption_index.cache_clear()
+    load_uuid2phash.cache_clear()
+    load_store_simhashes.cache_clear()
+    get_version_validators.cache_clear()
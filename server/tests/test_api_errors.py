@@ -4,7 +4,7 @@ from pathlib import Path
 
 from fastapi.testclient import TestClient
 
-from utils.loaders import load_uuid2caption, load_uuid2embedding
+from utils.loaders import load_embedding_store, load_uuid2caption
 
 
 def test_clustering_nclusters_too_large(client: TestClient):
@@ -15,6 +15,14 @@ def test_clustering_nclusters_too_large(client: TestClient):
     assert r.status_code == 400
 
 
+def test_clustering_invalid_auto_range(client: TestClient):
+    body = {"uuids": ["a", "b", "c"], "nClusters": "auto"}
+    for params in ({"minClusters": 1}, {"maxClusters": 1}, {"timeBudget": 0}):
+        assert client.post("/clustering", json=body | params).status_code == 400
+    body["nClusters"] = "many"
+    assert client.post("/clustering", json=body).status_code == 422
+
+
 def test_assign_grid_too_few_cells(client: TestClient):
     r = client.post(
         "/assignGrid",
@@ -40,7 +48,7 @@ def test_captioning_missing_file_returns_503(client: TestClient, tmp_path: Path)
 def test_clustering_missing_embeddings_returns_503(client: TestClient, tmp_path: Path):
     emb_path = tmp_path / "static" / "embeddings.jsonl"
     emb_path.unlink()
-    load_uuid2embedding.cache_clear()
+    load_embedding_store.cache_clear()
     r = client.post(
         "/clustering",
         json={"uuids": ["a"], "nClusters": 1},
@@ -1,7 +1,13 @@
 import numpy as np
 import pytest
 
-from utils.assign_grid import assign_grid, fit_to_rect
+from utils.assign_grid import (
+    assign_greedy,
+    assign_grid,
+    assign_grid_progressive,
+    fit_to_rect,
+    get_embeddings_2d_coarse,
+)
 
 
 def test_fit_to_rect_handles_zero_range_axis():
@@ -27,3 +33,37 @@ def test_assign_grid_returns_finite_unique_cells(n):
     # Cells must be unique
     cells = [tuple(map(int, row)) for row in coords]
     assert len(set(cells)) == n
+
+
+@pytest.mark.parametrize("n, n_rows, n_cols", [(2, 1, 2), (7, 2, 4), (12, 3, 4)])
+def test_assign_greedy_returns_unique_cells_in_bounds(n, n_rows, n_cols):
+    points = np.random.default_rng(0).random((n, 2))
+    coords = assign_greedy(points, n_rows, n_cols)
+    assert coords.shape == (n, 2)
+    assert coords[:, 0].max() < n_rows and coords[:, 1].max() < n_cols
+    assert len({tuple(row) for row in coords.tolist()}) == n
+
+
+def test_assign_greedy_keeps_order():
+    # Two rows of points, each increasing in x.
+    points = np.array([[0.0, 0.0], [1.0, 0.1], [0.5, 1.0], [0.0, 0.9]])
+    coords = assign_greedy(points, 2, 2)
+    assert coords.tolist() == [[0, 0], [0, 1], [1, 1], [1, 0]]
+
+
+def test_coarse_embeddings_follow_the_principal_axis():
+    t = np.linspace(0, 1, 10)
+    embeddings = np.outer(t, np.ones(5))
+    projected = get_embeddings_2d_coarse(embeddings)
+    assert projected.shape == (10, 2)
+    order = np.argsort(projected[:, 0])
+    assert order.tolist() in (list(range(10)), list(range(10))[::-1])
+
+
+def test_progressive_stages_end_with_exact_assignment():
+    embeddings = np.random.default_rng(0).normal(size=(10, 20))
+    stages = list(assign_grid_progressive(embeddings, 3, 4))
+    assert [name for name, _ in stages] == ["coarse", "tsne", "final"]
+    for _, coords in stages:
+        assert len({tuple(row) for row in coords.tolist()}) == 10
+    np.testing.assert_array_equal(stages[-1][1], assign_grid(embeddings, 3, 4))
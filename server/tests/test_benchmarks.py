@@ -0,0 +1,34 @@
+"""The benchmark harness should run end to end on a tiny corpus."""
+
+from pathlib import Path
+
+from benchmarks.corpus import make_corpus
+from benchmarks.harness import (
+    CASES,
+    compare_results,
+    load_results,
+    run_benchmarks,
+    save_results,
+)
+
+
+def test_make_corpus_is_deterministic(tmp_path: Path):
+    first = make_corpus(tmp_path / "first", 20, dim=8)
+    second = make_corpus(tmp_path / "second", 20, dim=8)
+    assert first.uuids == second.uuids
+    assert first.embedding_path.read_text() == second.embedding_path.read_text()
+    assert len(first.caption_path.read_text().splitlines()) == 20
+
+
+def test_run_benchmarks_smoke(tmp_path: Path):
+    corpus = make_corpus(tmp_path / "data", 40, dim=32)
+    results = run_benchmarks([corpus], 32, repeats=1, log=lambda _: None)
+    assert [d["case"] for d in results] == [d.name for d in CASES]
+    assert all(d["best_seconds"] > 0 and d["peak_bytes"] > 0 for d in results)
+
+    path = save_results(results, tmp_path / "results", "abc1234")
+    assert load_results(path) == results
+    slower = [{**d, "best_seconds": d["best_seconds"] * 2} for d in results]
+    lines = compare_results(results, slower)
+    assert len(lines) == len(results)
+    assert all(line.endswith("REGRESSION") for line in lines)
@@ -0,0 +1,126 @@
+"""The caption index should answer term and prefix queries and follow appends."""
+
+import json
+import os
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+from utils.caption_index import CaptionIndex, parse_query
+
+CAPTIONS = {
+    "a": "the type of the visualization is bar chart",
+    "b": "it is a map of europe",
+    "c": "stacked bar chart with a map",
+}
+
+
+def _lines(captions: dict[str, str | None]) -> str:
+    return "".join(
+        json.dumps({"filename": f"{k}.jpg", "caption": v}) + "\n"
+        for k, v in captions.items()
+    )
+
+
+@pytest.fixture
+def caption_path(tmp_path: Path) -> Path:
+    path = tmp_path / "static" / "captions.jsonl"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(_lines(CAPTIONS))
+    return path
+
+
+def test_parse_query():
+    assert parse_query("Bar  chart*") == [("bar", False), ("chart", True)]
+    assert parse_query("bar-char* *") == [("bar", False), ("char", True)]
+    assert parse_query(" * ") == []
+
+
+def test_term_and_prefix_queries(caption_path: Path):
+    index = CaptionIndex(str(caption_path))
+    index.update()
+    assert index.search("bar chart") == (2, ["a", "c"])
+    assert index.search("MAP") == (2, ["b", "c"])
+    assert index.search("ma*") == (2, ["b", "c"])
+    assert index.search("bar map") == (1, ["c"])
+    assert index.search("eu") == (0, [])
+    # The processed captions are indexed, without the stripped prefixes.
+    assert index.search("visualization") == (0, [])
+    with pytest.raises(ValueError):
+        index.search("*")
+
+
+def test_restriction_and_paging(caption_path: Path):
+    index = CaptionIndex(str(caption_path))
+    index.update()
+    assert index.search("map", uuids=["c", "unknown"]) == (1, ["c"])
+    assert index.search("ba*", offset=0, limit=1) == (2, ["a"])
+    assert index.search("ba*", offset=1, limit=5) == (2, ["c"])
+    assert index.search("ba*", offset=2) == (2, [])
+
+
+def test_incremental_update(caption_path: Path):
+    index = CaptionIndex(str(caption_path))
+    index.update()
+    with caption_path.open("a") as f:
+        f.write(_lines({"d": "line chart", "a": "scatter plot"}))
+        # A line still being written is indexed once complete.
+        f.write('{"filename": "e.jpg", "capt')
+    index.update()
+    assert len(index) == 4
+    assert index.search("chart") == (2, ["c", "d"])
+    assert index.search("scatter") == (1, ["a"])
+    with caption_path.open("a") as f:
+        f.write('ion": "line map"}\n')
+    index.update()
+    assert index.search("line") == (2, ["d", "e"])
+
+
+def test_null_captions_are_skipped(caption_path: Path, client: TestClient):
+    with caption_path.open("a") as f:
+        f.write(_lines({"d": None, "e": "line chart"}))
+    r = client.post("/captions/search", json={"query": "chart"})
+    assert r.status_code == 200
+    assert r.json()["uuids"] == ["a", "c", "e"]
+
+
+def test_rebuild_after_replacement(caption_path: Path):
+    index = CaptionIndex(str(caption_path))
+    index.update()
+    replacement = caption_path.with_suffix(".tmp")
+    replacement.write_text(_lines({"z": "pie chart"}))
+    os.replace(replacement, caption_path)
+    index.update()
+    assert len(index) == 1
+    assert index.search("chart") == (1, ["z"])
+
+
+def test_search_endpoint(client: TestClient, caption_path: Path):
+    r = client.post("/captions/search", json={"query": "bar chart"})
+    assert r.status_code == 200
+    assert r.json() == {"total": 2, "offset": 0, "uuids": ["a", "c"]}
+
+    handle = client.post("/selections", json=["b", "c"]).json()["handle"]
+    r = client.post("/captions/search", json={"query": "ma*", "selection": handle})
+    assert r.json()["uuids"] == ["b", "c"]
+    r = client.post(
+        "/captions/search", json={"query": "map", "uuids": ["a", "b"], "limit": 1}
+    )
+    assert r.json() == {"total": 1, "offset": 0, "uuids": ["b"]}
+
+    with caption_path.open("a") as f:
+        f.write(_lines({"d": "bar chart"}))
+    r = client.post("/captions/search", json={"query": "bar", "offset": 1})
+    assert r.json() == {"total": 3, "offset": 1, "uuids": ["c", "d"]}
+
+
+def test_search_endpoint_errors(client: TestClient, tmp_path: Path):
+    r = client.post("/captions/search", json={"query": "map"})
+    assert r.status_code == 503
+    (tmp_path / "static" / "captions.jsonl").write_text(_lines(CAPTIONS))
+    assert client.post("/captions/search", json={"query": "*"}).status_code == 400
+    r = client.post("/captions/search", json={"query": "map", "limit": 0})
+    assert r.status_code == 400
+    r = client.post("/captions/search", json={"query": "map", "selection": "x"})
+    assert r.status_code == 404
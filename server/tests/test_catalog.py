@@ -0,0 +1,106 @@
+"""The catalog index should answer batched lookups by uuid."""
+
+import importlib.util
+import json
+import sqlite3
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+from utils.catalog import Catalog
+
+DOWNLOAD_SCRIPT = Path(__file__).parents[2] / "packages/shared/assets/download.py"
+
+
+def _load_download():
+    spec = importlib.util.spec_from_file_location("download", DOWNLOAD_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _record(uuid: str, year: int | None, tags: list[str]) -> dict:
+    return {
+        "uuid": uuid,
+        "authors": None,
+        "displayName": f"Map {uuid}",
+        "publishDate": None if year is None else [{"year": year}, {"year": 1900}],
+        "languages": ["eng"],
+        "tags": tags,
+        "abstract": "Près de Genève",
+        "rights": "public domain",
+        "resolution": [640, 480],
+        "source": {"name": "David Rumsey", "url": "", "accessDate": ""},
+    }
+
+
+RECORDS = [
+    _record("a", 1850, ["maps", "europe"]),
+    _record("b", None, []),
+    _record("c", 1901, ["maps"]),
+]
+
+
+def _build(path: Path, records: list[dict] = RECORDS) -> Path:
+    json_path = path / "visualizations.json"
+    json_path.write_text(json.dumps(records), encoding="utf-8")
+    db_path = path / "visualizations.sqlite"
+    assert _load_download().build_index(json_path, db_path) == len(records)
+    return db_path
+
+
+def test_index_filter_columns(tmp_path: Path):
+    db_path = _build(tmp_path)
+    with sqlite3.connect(db_path) as connection:
+        rows = connection.execute(
+            "SELECT uuid, publish_year, source_name, width, height FROM visualizations"
+            " ORDER BY uuid"
+        ).fetchall()
+        tagged = connection.execute(
+            "SELECT uuid FROM visualization_tags WHERE tag = 'maps' ORDER BY uuid"
+        ).fetchall()
+    assert rows == [
+        ("a", 1850, "David Rumsey", 640, 480),
+        ("b", None, "David Rumsey", 640, 480),
+        ("c", 1901, "David Rumsey", 640, 480),
+    ]
+    assert tagged == [("a",), ("c",)]
+
+
+def test_lookup_follows_replacement(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    db_path = _build(tmp_path)
+    catalog = Catalog(str(db_path))
+    monkeypatch.setattr("utils.catalog._BATCH", 2)
+    records = catalog.lookup(["c", "x", "a", "c"])
+    assert [json.loads(d)["uuid"] if d else None for d in records] == [
+        "c",
+        None,
+        "a",
+        "c",
+    ]
+    assert json.loads(records[2]) == RECORDS[0]
+    _build(tmp_path, [_record("x", 2000, [])])
+    assert catalog.lookup(["a", "x"])[0] is None
+    assert catalog.lookup(["x"])[0] is not None
+
+
+def test_metadata_endpoint(client: TestClient, tmp_path: Path):
+    assert client.post("/metadata", json=["a"]).status_code == 503
+    _build(tmp_path / "static")
+    r = client.post("/metadata", json=["b", "missing", "a"])
+    assert r.status_code == 200
+    assert r.json() == [RECORDS[1], None, RECORDS[0]]
+
+    handle = client.post("/selections", json=["c", "a"]).json()["handle"]
+    r = client.post("/metadata", json={"selection": handle})
+    assert [d["uuid"] for d in r.json()] == ["c", "a"]
+    assert client.post("/metadata", json={"selection": "x"}).status_code == 404
+
+
+def test_default_path_is_where_the_script_writes():
+    import server as server_module
+
+    assert server_module.CATALOG_PATH == DOWNLOAD_SCRIPT.with_name(
+        "visualizations.sqlite"
+    )
@@ -0,0 +1,67 @@
+"""The number of clusters should be chosen on a sample, within the time budget."""
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from utils import clustering as clustering_module
+from utils.clustering import _candidates, auto_clustering
+from utils.metrics import REGISTRY
+
+
+def _blobs(n_blobs: int, n_per_blob: int) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(0)
+    centers = rng.normal(scale=20, size=(n_blobs, 8))
+    truth = np.repeat(np.arange(n_blobs), n_per_blob)
+    return centers[truth] + rng.normal(size=(len(truth), 8)), truth
+
+
+def _same_partition(labels: np.ndarray, truth: np.ndarray) -> bool:
+    pairs = set(zip(labels.tolist(), truth.tolist()))
+    return len(pairs) == len(set(labels.tolist())) == len(set(truth.tolist()))
+
+
+def test_candidates_spread_over_large_ranges():
+    assert _candidates(2, 5) == [2, 3, 4, 5]
+    candidates = _candidates(2, 500)
+    assert candidates[0] == 2 and candidates[-1] == 500
+    assert len(candidates) <= clustering_module.MAX_CANDIDATES
+
+
+def test_auto_clustering_finds_the_blobs():
+    embeddings, truth = _blobs(4, 50)
+    labels = auto_clustering(embeddings, 2, 10)
+    assert _same_partition(labels, truth)
+
+
+def test_auto_clustering_fits_the_sampled_choice(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(clustering_module, "SAMPLE_SIZE", 60)
+    embeddings, truth = _blobs(3, 100)
+    labels = auto_clustering(embeddings, 2, 8)
+    assert len(labels) == 300
+    assert _same_partition(labels, truth)
+
+
+def test_auto_clustering_falls_back_without_budget(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(clustering_module, "SAMPLE_SIZE", 60)
+    embeddings, _ = _blobs(3, 100)
+    labels = auto_clustering(embeddings, 2, 8, time_budget=1e-9)
+    # Whatever was scored in time, the full fit is left to MiniBatchKMeans.
+    assert 'stage_duration_seconds_count{stage="minibatch_kmeans"}' in (
+        REGISTRY.render()
+    )
+    assert len(labels) == 300
+    assert 2 <= len(set(labels.tolist())) <= 8
+
+
+def test_auto_clustering_of_few_points():
+    embeddings, _ = _blobs(1, 2)
+    assert auto_clustering(embeddings, 2, 10).tolist() == [0, 0]
+
+
+def test_auto_clustering_endpoint(client: TestClient):
+    body = {"uuids": ["a", "b", "c"], "nClusters": "auto", "maxClusters": 5}
+    r = client.post("/clustering", json=body)
+    assert r.status_code == 200
+    # Three points leave two clusters as the only candidate.
+    assert len(set(r.json())) == 2
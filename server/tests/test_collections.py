@@ -0,0 +1,130 @@
+"""Collections should load on first use and be unloaded beyond the memory budget."""
+
+import json
+import threading
+from pathlib import Path
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from utils.collection import CollectionRegistry, estimate_size
+
+EMBEDDINGS = {"a": [0.1, 0.2, 0.3], "b": [0.2, 0.3, 0.4], "c": [0.3, 0.4, 0.5]}
+
+
+def _make_collection(root: Path, name: str) -> Path:
+    static = root / name
+    (static / "images").mkdir(parents=True)
+    (static / "thumbnails").mkdir()
+    for stem in EMBEDDINGS:
+        (static / "images" / f"{stem}.jpg").write_bytes(f"{name}-image".encode())
+        (static / "thumbnails" / f"{stem}.jpg").write_bytes(b"thumb")
+    (static / "embeddings.jsonl").write_text(
+        "".join(
+            json.dumps({"filename": f"{k}.jpg", "embedding": v}) + "\n"
+            for k, v in EMBEDDINGS.items()
+        )
+    )
+    return static
+
+
+@pytest.fixture
+def root(tmp_path: Path) -> Path:
+    root = tmp_path / "collections"
+    _make_collection(root, "plates")
+    _make_collection(root, "scans")
+    return root
+
+
+def test_estimate_size():
+    assert estimate_size(np.zeros(1000)) == 8000
+    small = estimate_size({"a": "x"})
+    assert estimate_size({"a": "x", "b": np.zeros(1000)}) > small + 8000
+
+
+def test_lazy_load_and_unknown_collections(root: Path):
+    registry = CollectionRegistry(root, clock=lambda: 1.0)
+    assert registry.get("missing") is None
+    assert registry.get("../plates") is None
+    collection = registry.get("plates")
+    assert registry.get("plates") is collection
+    assert collection.memory() == {}
+    assert sorted(collection.uuid2filename()) == ["a", "b", "c"]
+    assert collection.embedding_store().matrix.shape[0] == 3
+    assert set(collection.memory()) == {"uuid2filename", "embedding_store"}
+    usage = {d["name"]: d for d in registry.usage()}
+    assert usage["plates"]["memoryBytes"] == sum(collection.memory().values())
+    assert usage["plates"]["lastUsed"] == 1.0
+    assert usage["scans"] == {
+        "name": "scans",
+        "memoryBytes": 0,
+        "resources": {},
+        "lastUsed": None,
+    }
+
+
+def test_least_recently_used_are_unloaded(root: Path):
+    _make_collection(root, "maps")
+    registry = CollectionRegistry(root)
+    plates, scans, maps = (registry.get(d) for d in ("plates", "scans", "maps"))
+    for collection in (plates, scans, maps):
+        collection.embedding_store()
+    plates.uuid2filename()
+    scans.uuid2filename()
+    # Room for two collections with both resources loaded.
+    registry.max_bytes = 2 * sum(plates.memory().values())
+    # Using plates makes scans the least recently used.
+    registry.get("plates")
+    registry.get("maps").uuid2filename()
+    assert scans.memory() == {}
+    assert plates.memory() and maps.memory()
+    # The loaded collection is kept, even beyond the budget.
+    registry.max_bytes = 0
+    registry.get("scans").uuid2filename()
+    assert plates.memory() == {} and maps.memory() == {}
+    assert list(scans.memory()) == ["uuid2filename"]
+
+
+def test_simhashes_load_the_store_without_deadlock(root: Path):
+    collection = CollectionRegistry(root).get("plates")
+    result = []
+    # The store is not loaded yet, e.g., evicted by the budget.
+    thread = threading.Thread(
+        target=lambda: result.append(collection.simhashes()), daemon=True
+    )
+    thread.start()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert len(result[0]) == 3
+    assert {"embedding_store", "simhashes"} <= set(collection.memory())
+
+
+def test_collection_routes(client: TestClient, tmp_path: Path):
+    _make_collection(tmp_path / "collections", "plates")
+    r = client.get("/collections/plates/uuids/a/image")
+    assert r.status_code == 200
+    assert r.content == b"plates-image"
+    assert client.get("/uuids/a/image").content == b"fake-image"
+    assert client.get("/collections/plates/uuids/x/image").status_code == 404
+    assert client.get("/collections/missing/uuids/a/image").status_code == 404
+
+    # The collection has the embeddings of the default tree.
+    for route, body in [
+        ("/findCenter", ["a", "b", "c"]),
+        ("/clustering", {"uuids": ["a", "b", "c"], "nClusters": 2}),
+        ("/assignGrid", {"uuids": ["a", "b", "c"], "nRows": 2, "nCols": 2}),
+    ]:
+        expected = client.post(route, json=body)
+        r = client.post(f"/collections/plates{route}", json=body)
+        assert r.status_code == 200
+        assert r.json() == expected.json()
+    r = client.post("/collections/plates/captioning", json=["a"])
+    assert r.status_code == 503
+
+    r = client.get("/collections")
+    assert r.status_code == 200
+    (plates,) = r.json()["collections"]
+    assert plates["name"] == "plates"
+    assert set(plates["resources"]) == {"uuid2filename", "embedding_store"}
+    assert r.json()["totalBytes"] == plates["memoryBytes"] > 0
@@ -0,0 +1,168 @@
+"""Compute jobs should run on the worker of their embedding store."""
+
+import json
+from pathlib import Path
+
+import httpx
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import server as server_module
+import worker as worker_module
+from utils.collection import Collection, CollectionRegistry
+from utils.compute import WorkerPool, decode_array
+
+WORKERS = ["http://worker-1:5002", "http://worker-2:5002", "http://worker-3:5002"]
+
+
+class _Network(httpx.AsyncBaseTransport):
+    """Every worker URL reaches the worker app in process, unless it is down."""
+
+    def __init__(
+        self, down: set[str] = frozenset(), error: type[Exception] = httpx.ConnectError
+    ):
+        self.down = down
+        self.error = error
+        self.hosts: list[str] = []
+        self._asgi = httpx.ASGITransport(app=worker_module.app)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.hosts.append(request.url.host)
+        if request.url.host in self.down:
+            raise self.error("Connection failed", request=request)
+        return await self._asgi.handle_async_request(request)
+
+
+@pytest.fixture
+def worker(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """The worker app reading the trees of the test client."""
+
+    monkeypatch.setattr(
+        worker_module, "DEFAULT_COLLECTION", Collection("default", tmp_path / "static")
+    )
+    monkeypatch.setattr(
+        worker_module, "COLLECTIONS", CollectionRegistry(tmp_path / "collections")
+    )
+    return worker_module
+
+
+def _use_workers(monkeypatch: pytest.MonkeyPatch, network: _Network) -> None:
+    monkeypatch.setattr(
+        server_module, "COMPUTE", WorkerPool(WORKERS, transport=network)
+    )
+
+
+def test_route_is_stable():
+    pool = WorkerPool(WORKERS)
+    keys = [f"store-{i}" for i in range(300)]
+    preferred = {key: pool.route(key)[0] for key in keys}
+    assert set(preferred.values()) == set(WORKERS)
+    assert all(sorted(pool.route(key)) == sorted(WORKERS) for key in keys)
+    # Removing a worker moves only its keys.
+    smaller = WorkerPool(WORKERS[:2])
+    for key in keys:
+        if preferred[key] != WORKERS[2]:
+            assert smaller.route(key)[0] == preferred[key]
+
+
+def test_from_env_and_decode():
+    assert WorkerPool.from_env(None) is None
+    assert WorkerPool.from_env(" , ") is None
+    pool = WorkerPool.from_env("http://a:1/, http://b:2")
+    assert pool.urls == ["http://a:1", "http://b:2"]
+    data = np.arange(6, dtype="<i4").tobytes()
+    assert decode_array(data, "3,2").tolist() == [[0, 1], [2, 3], [4, 5]]
+
+
+def test_jobs_match_local_results(client: TestClient, worker, monkeypatch):
+    uuids = ["a", "b", "c"]
+    jobs = [
+        ("/clustering", {"uuids": uuids, "nClusters": 2}),
+        ("/clustering", {"uuids": uuids, "nClusters": "auto"}),
+        ("/assignGrid", {"uuids": uuids, "nRows": 2, "nCols": 2}),
+    ]
+    expected = [client.post(route, json=body).json() for route, body in jobs]
+    network = _Network()
+    _use_workers(monkeypatch, network)
+    for (route, body), local in zip(jobs, expected):
+        r = client.post(route, json=body)
+        assert r.status_code == 200
+        assert r.json() == local
+    # Both jobs on the default store went to the same worker.
+    assert len(set(network.hosts)) == 1
+    assert worker.DEFAULT_COLLECTION.is_loaded("embedding_store")
+
+
+def test_unreachable_workers_fail_over(client: TestClient, worker, monkeypatch):
+    body = {"uuids": ["a", "b", "c"], "nClusters": 2}
+    network = _Network()
+    _use_workers(monkeypatch, network)
+    client.post("/clustering", json=body)
+    preferred = network.hosts[0]
+
+    network = _Network(down={preferred})
+    _use_workers(monkeypatch, network)
+    assert client.post("/clustering", json=body).status_code == 200
+    assert network.hosts[0] == preferred and len(network.hosts) == 2
+
+    _use_workers(monkeypatch, _Network(down={httpx.URL(d).host for d in WORKERS}))
+    assert client.post("/clustering", json=body).status_code == 503
+
+
+def test_dropped_and_timed_out_jobs(client: TestClient, worker, monkeypatch):
+    body = {"uuids": ["a", "b", "c"], "nClusters": 2}
+    network = _Network()
+    _use_workers(monkeypatch, network)
+    client.post("/clustering", json=body)
+    preferred = network.hosts[0]
+
+    # A dropped connection moves the job to the next worker.
+    network = _Network(down={preferred}, error=httpx.RemoteProtocolError)
+    _use_workers(monkeypatch, network)
+    assert client.post("/clustering", json=body).status_code == 200
+    assert len(network.hosts) == 2
+
+    # A timed-out job is not retried.
+    network = _Network(down={preferred}, error=httpx.ReadTimeout)
+    _use_workers(monkeypatch, network)
+    assert client.post("/clustering", json=body).status_code == 503
+    assert network.hosts == [preferred]
+
+
+def test_stream_runs_on_the_workers(client: TestClient, worker, monkeypatch):
+    body = {"uuids": ["a", "b", "c"], "nRows": 2, "nCols": 2}
+    expected = client.post("/assignGrid", json=body).json()
+    network = _Network()
+    _use_workers(monkeypatch, network)
+    r = client.post("/assignGrid/stream", json=body)
+    assert r.status_code == 200
+    data = [json.loads(d.split("data: ", 1)[1]) for d in r.text.split("\n\n") if d]
+    assert data == [{"stage": "final", "assignment": expected}]
+    assert len(network.hosts) == 1
+
+
+def test_worker_errors_and_collections(
+    client: TestClient, worker, monkeypatch, tmp_path: Path
+):
+    _use_workers(monkeypatch, _Network())
+    r = client.post("/clustering", json={"uuids": ["a", "x"], "nClusters": 1})
+    assert r.status_code == 404
+    body = {"uuids": ["a", "b"], "nRows": 1, "nCols": 2}
+    r = client.post("/collections/plates/assignGrid", json=body)
+    assert r.status_code == 404
+
+    static = tmp_path / "collections" / "plates"
+    static.mkdir(parents=True)
+    (static / "images").mkdir()
+    embeddings = {"a": [0.1, 0.2], "b": [0.2, 0.1]}
+    (static / "embeddings.jsonl").write_text(
+        "".join(
+            json.dumps({"filename": f"{k}.jpg", "embedding": v}) + "\n"
+            for k, v in embeddings.items()
+        )
+    )
+    r = client.post("/collections/plates/assignGrid", json=body)
+    assert r.status_code == 200
+    assert sorted(r.json()) == [[0, 0], [0, 1]]
+    assert worker.COLLECTIONS.get("plates").is_loaded("embedding_store")
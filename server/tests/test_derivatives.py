@@ -0,0 +1,188 @@
+"""Resized image derivatives should be rendered once and cached within a budget."""
+
+import asyncio
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import utils.derivatives as derivatives_module
+from utils.derivatives import FORMATS, DerivativeCache
+
+
+def _write_image(path: Path, size: tuple[int, int] = (400, 200)) -> None:
+    Image.new("RGB", size, (200, 80, 40)).save(path, format="JPEG")
+
+
+def _thread_cache(directory: Path, max_bytes: int = 1 << 30) -> DerivativeCache:
+    return DerivativeCache(directory, max_bytes, lambda: ThreadPoolExecutor(2))
+
+
+@pytest.fixture
+def image_client(
+    client: TestClient, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> TestClient:
+    import server as server_module
+
+    _write_image(tmp_path / "static" / "images" / "a.jpg")
+    monkeypatch.setattr(
+        server_module, "DERIVATIVES", _thread_cache(tmp_path / "derivatives")
+    )
+    return client
+
+
+def test_resize_keeps_aspect_ratio_and_format(image_client: TestClient):
+    r = image_client.get("/uuids/a/image?w=100&format=webp")
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "image/webp"
+    assert r.headers["cache-control"] == "no-cache"
+    with Image.open(io.BytesIO(r.content)) as image:
+        assert image.format == "WEBP"
+        assert image.size == (100, 50)
+
+
+def test_resize_does_not_upscale(image_client: TestClient):
+    r = image_client.get("/uuids/a/image?w=1000&h=1000")
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "image/jpeg"
+    with Image.open(io.BytesIO(r.content)) as image:
+        assert image.size == (400, 200)
+
+
+def test_derivative_etag_and_revalidation(image_client: TestClient):
+    original = image_client.get("/uuids/a/image").headers["etag"]
+    small = image_client.get("/uuids/a/image?h=50").headers["etag"]
+    png = image_client.get("/uuids/a/image?h=50&format=png").headers["etag"]
+    assert len({original, small, png}) == 3
+    r = image_client.get("/uuids/a/image?h=50", headers={"If-None-Match": small})
+    assert r.status_code == 304
+
+
+def test_invalid_parameters(image_client: TestClient):
+    assert image_client.get("/uuids/a/image?format=gif").status_code == 400
+    assert image_client.get("/uuids/a/image?w=0").status_code == 422
+    assert image_client.get("/uuids/a/image?h=100000").status_code == 422
+    assert image_client.get("/uuids/missing/image?w=10").status_code == 404
+    # The fixture's other images are not decodable.
+    assert image_client.get("/uuids/b/image?w=10").status_code == 422
+
+
+def test_lru_eviction_within_budget(tmp_path: Path):
+    sources = []
+    for i in range(3):
+        sources.append(tmp_path / f"{i}.jpg")
+        _write_image(sources[-1])
+    cache = _thread_cache(tmp_path / "derivatives", max_bytes=1)
+    fmt = FORMATS["png"]
+
+    async def run() -> None:
+        for i, source in enumerate(sources):
+            await cache.get(source, f"{i}.png", 20, None, fmt)
+
+    asyncio.run(run())
+    # Only the derivative just rendered is kept over the budget.
+    assert [d.name for d in cache.directory.iterdir()] == ["2.png"]
+    assert cache.total_bytes == (cache.directory / "2.png").stat().st_size
+
+    cache = _thread_cache(tmp_path / "derivatives")
+    assert cache.total_bytes == 0
+    asyncio.run(cache.get(sources[2], "2.png", 20, None, fmt))
+    # Indexed from the directory rather than rendered again.
+    assert cache.total_bytes == (cache.directory / "2.png").stat().st_size
+
+
+def test_concurrent_requests_share_one_render(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    source = tmp_path / "a.jpg"
+    _write_image(source)
+    renders = []
+    release = threading.Event()
+    render = derivatives_module.render_derivative
+
+    def counting_render(*args) -> None:
+        renders.append(args)
+        release.wait(5)
+        render(*args)
+
+    monkeypatch.setattr(derivatives_module, "render_derivative", counting_render)
+    cache = _thread_cache(tmp_path / "derivatives")
+
+    async def run() -> list[Path]:
+        tasks = [
+            asyncio.create_task(cache.get(source, "a.jpg", 50, 50, FORMATS["jpeg"]))
+            for _ in range(8)
+        ]
+        await asyncio.sleep(0.05)
+        release.set()
+        return await asyncio.gather(*tasks)
+
+    paths = asyncio.run(run())
+    assert len(renders) == 1
+    assert len(set(paths)) == 1 and paths[0].is_file()
+
+
+def test_renders_in_process_pool(tmp_path: Path):
+    source = tmp_path / "a.jpg"
+    _write_image(source)
+    cache = DerivativeCache(tmp_path / "derivatives")
+    try:
+        path = asyncio.run(cache.get(source, "a.webp", 40, 40, FORMATS["webp"]))
+    finally:
+        cache.shutdown()
+    with Image.open(path) as image:
+        assert image.size == (40, 20)
+
+
+def test_concurrent_renders_of_one_derivative(tmp_path: Path):
+    source = tmp_path / "a.jpg"
+    _write_image(source)
+    dest = str(tmp_path / "a.png")
+    # As if rendered by several server workers at once.
+    with ThreadPoolExecutor(8) as executor:
+        futures = [
+            executor.submit(
+                derivatives_module.render_derivative, str(source), dest, 20, 20, "PNG"
+            )
+            for _ in range(8)
+        ]
+        for future in futures:
+            future.result()
+    assert [d.name for d in tmp_path.iterdir() if d.suffix != ".jpg"] == ["a.png"]
+
+
+def test_broken_pool_is_replaced(tmp_path: Path):
+    source = tmp_path / "a.jpg"
+    _write_image(source)
+    executors = []
+
+    class BrokenExecutor(ThreadPoolExecutor):
+        def submit(self, *args, **kwargs):
+            raise BrokenProcessPool("A render process was killed")
+
+    def make_executor():
+        executors.append(BrokenExecutor(1) if not executors else ThreadPoolExecutor(1))
+        return executors[-1]
+
+    cache = DerivativeCache(tmp_path / "derivatives", 1 << 30, make_executor)
+    with pytest.raises(BrokenProcessPool):
+        asyncio.run(cache.get(source, "a.png", 20, None, FORMATS["png"]))
+    path = asyncio.run(cache.get(source, "a.png", 20, None, FORMATS["png"]))
+    assert path.is_file()
+    assert len(executors) == 2
+    cache.shutdown()
+
+
+def test_budget_is_split_among_server_workers(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setenv(derivatives_module.CACHE_BYTES_ENV, "1000")
+    monkeypatch.setenv(derivatives_module.SERVER_WORKERS_ENV, "4")
+    assert DerivativeCache(tmp_path).max_bytes == 250
+    monkeypatch.delenv(derivatives_module.SERVER_WORKERS_ENV)
+    assert DerivativeCache(tmp_path).max_bytes == 1000
@@ -0,0 +1,101 @@
+"""Exported embedding stores should be memory-mapped read-only by the workers."""
+
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from utils.loaders import (
+    EMBEDDING_STORE_ENV,
+    attach_embedding_store,
+    build_embedding_store,
+    export_embedding_store,
+    load_embedding_store,
+    load_embeddings,
+)
+
+
+@pytest.fixture
+def embedding_path(tmp_path: Path) -> str:
+    rng = np.random.default_rng(0)
+    path = tmp_path / "embeddings.jsonl"
+    with path.open("w", encoding="utf-8") as f:
+        for i in range(30):
+            obj = {"filename": f"{i}.jpg", "embedding": [rng.normal(size=8).tolist()]}
+            f.write(json.dumps(obj) + "\n")
+    return str(path)
+
+
+def test_build_embedding_store_keeps_last_entry(tmp_path: Path):
+    path = tmp_path / "embeddings.jsonl"
+    lines = [
+        {"filename": "a.jpg", "embedding": [0.0, 1.0]},
+        {"filename": "b.jpg", "embedding": None},
+        {"filename": "a.jpg", "embedding": [2.0, 3.0]},
+    ]
+    path.write_text("".join(json.dumps(d) + "\n" for d in lines), encoding="utf-8")
+    store = build_embedding_store(str(path))
+    assert store.uuids == ["a"]
+    assert store.matrix.tolist() == [[2.0, 3.0]]
+
+
+def test_attached_store_matches_built_store(embedding_path: str, tmp_path: Path):
+    store_dir = tmp_path / "store"
+    export_embedding_store(embedding_path, 4, store_dir)
+    attached = attach_embedding_store(embedding_path, 4, store_dir)
+    built = build_embedding_store(embedding_path, 4)
+    assert attached is not None
+    assert attached.uuids == built.uuids
+    assert isinstance(attached.matrix, np.memmap)
+    assert not attached.matrix.flags.writeable
+    np.testing.assert_allclose(attached.matrix, built.matrix)
+
+
+def test_attach_follows_appends_with_exported_projection(
+    embedding_path: str, tmp_path: Path
+):
+    store_dir = tmp_path / "store"
+    export_embedding_store(embedding_path, 4, store_dir)
+    exported = (store_dir / "meta-d4.json").read_text()
+    built = build_embedding_store(embedding_path, 4)
+    with open(embedding_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"filename": "new.jpg", "embedding": [[0.5] * 8]}) + "\n")
+
+    # Exporting again, e.g., on a restart, keeps the exported projection.
+    export_embedding_store(embedding_path, 4, store_dir)
+    assert (store_dir / "meta-d4.json").read_text() == exported
+    attached = attach_embedding_store(embedding_path, 4, store_dir)
+    assert attached is not None
+    assert attached.uuids == built.uuids + ["new"]
+    np.testing.assert_allclose(
+        attached.take([len(built.uuids)]), built.projection.apply(np.full((1, 8), 0.5))
+    )
+
+
+def test_attach_ignores_store_of_replaced_file(embedding_path: str, tmp_path: Path):
+    store_dir = tmp_path / "store"
+    export_embedding_store(embedding_path, 4, store_dir)
+    replacement = tmp_path / "replacement.jsonl"
+    replacement.write_text(Path(embedding_path).read_text())
+    os.replace(replacement, embedding_path)
+    assert attach_embedding_store(embedding_path, 4, store_dir) is None
+
+
+def test_load_embeddings_uses_exported_store(
+    embedding_path: str, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    store_dir = tmp_path / "store"
+    export_embedding_store(embedding_path, 4, store_dir)
+    monkeypatch.setenv(EMBEDDING_STORE_ENV, str(store_dir))
+    load_embedding_store.cache_clear()
+    try:
+        assert isinstance(load_embedding_store(embedding_path, 4).matrix, np.memmap)
+        embeddings = load_embeddings(["3", "1"], embedding_path, 4)
+        expected = build_embedding_store(embedding_path, 4).matrix[[3, 1]]
+        np.testing.assert_allclose(embeddings, expected)
+        with pytest.raises(KeyError):
+            load_embeddings(["missing"], embedding_path, 4)
+    finally:
+        load_embedding_store.cache_clear()
@@ -0,0 +1,99 @@
+"""Exports should stream the rows in chunks and resume from a cursor."""
+
+import io
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from utils import export as export_module
+from utils.export import NEXT_CURSOR_HEADER
+
+
+@pytest.fixture
+def captions(tmp_path: Path) -> None:
+    captions = [
+        {"filename": "a.jpg", "caption": "a bar chart"},
+        {"filename": "c.jpg", "caption": "a map"},
+    ]
+    with (tmp_path / "static" / "captions.jsonl").open("w") as f:
+        f.write("".join(json.dumps(d) + "\n" for d in captions))
+
+
+def _ndjson(content: bytes) -> list[dict]:
+    return [json.loads(d) for d in content.splitlines()]
+
+
+def test_ndjson_export(client: TestClient, captions, monkeypatch):
+    monkeypatch.setattr(export_module, "CHUNK_ROWS", 2)
+    r = client.post("/export", json={})
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "application/x-ndjson"
+    assert NEXT_CURSOR_HEADER not in r.headers
+    records = _ndjson(r.content)
+    assert [(d["row"], d["uuid"], d["caption"]) for d in records] == [
+        (0, "a", "bar chart"),
+        (1, "b", None),
+        (2, "c", "map"),
+    ]
+    assert all(len(d["embedding"]) == 3 for d in records)
+
+
+def test_export_resumes_from_the_cursor(client: TestClient, captions):
+    body = {"fields": [], "limit": 2}
+    r = client.post("/export", json=body)
+    assert [d["uuid"] for d in _ndjson(r.content)] == ["a", "b"]
+    assert r.headers[NEXT_CURSOR_HEADER] == "2"
+    r = client.post("/export", json=body | {"cursor": 2})
+    assert _ndjson(r.content) == [{"row": 2, "uuid": "c"}]
+    assert NEXT_CURSOR_HEADER not in r.headers
+
+
+def test_export_filters(client: TestClient, captions):
+    body = {"uuids": ["c", "a", "c"], "fields": ["caption"]}
+    r = client.post("/export", json=body)
+    assert [d["uuid"] for d in _ndjson(r.content)] == ["a", "c"]
+    handle = client.post("/selections", json=["b", "c"]).json()["handle"]
+    r = client.post("/export", json={"selection": handle, "cursor": 2})
+    assert [d["uuid"] for d in _ndjson(r.content)] == ["c"]
+
+
+def test_export_errors(client: TestClient, tmp_path: Path):
+    assert client.post("/export", json={"uuids": ["x"]}).status_code == 404
+    assert client.post("/export", json={"selection": "x"}).status_code == 404
+    assert client.post("/export", json={"format": "csv"}).status_code == 422
+    assert client.post("/export", json={"cursor": -1}).status_code == 422
+    # Without captions, only their export is unavailable.
+    assert client.post("/export", json={"fields": ["embedding"]}).status_code == 200
+    assert client.post("/export", json={}).status_code == 503
+
+
+def test_arrow_export_without_pyarrow(client: TestClient, monkeypatch):
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+    r = client.post("/export", json={"format": "arrow"})
+    assert r.status_code == 501
+
+
+def test_arrow_and_parquet_exports(client: TestClient, captions, monkeypatch):
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    monkeypatch.setattr(export_module, "CHUNK_ROWS", 2)
+    expected = _ndjson(client.post("/export", json={}).content)
+
+    r = client.post("/export", json={"format": "arrow"})
+    assert r.headers["content-type"] == "application/vnd.apache.arrow.stream"
+    table = pa.ipc.open_stream(r.content).read_all()
+    assert table.num_rows == 3
+    np.testing.assert_allclose(
+        table.column("embedding").to_pylist(), [d["embedding"] for d in expected]
+    )
+
+    r = client.post("/export", json={"format": "parquet", "fields": ["caption"]})
+    parquet = pq.ParquetFile(io.BytesIO(r.content))
+    assert parquet.num_row_groups == 2
+    assert parquet.read().to_pylist() == [
+        {"row": d["row"], "uuid": d["uuid"], "caption": d["caption"]} for d in expected
+    ]
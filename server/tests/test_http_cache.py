@@ -0,0 +1,95 @@
+"""Images, thumbnails, and captions should support conditional requests."""
+
+import json
+import os
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+
+
+def _write_captions(tmp_path: Path, caption: str) -> Path:
+    path = tmp_path / "static" / "captions.jsonl"
+    lines = [{"filename": f"{d}.jpg", "caption": caption} for d in "abc"]
+    path.write_text("".join(json.dumps(d) + "\n" for d in lines))
+    return path
+
+
+def test_image_has_validators_and_revalidating_policy(client: TestClient):
+    r = client.get("/uuids/a/image")
+    assert r.status_code == 200
+    assert r.content == b"fake-image"
+    assert r.headers["etag"].startswith('"')
+    assert "last-modified" in r.headers
+    assert r.headers["cache-control"] == "no-cache"
+
+
+def test_if_none_match_returns_304(client: TestClient):
+    etag = client.get("/uuids/a/thumbnail").headers["etag"]
+    r = client.get("/uuids/a/thumbnail", headers={"If-None-Match": etag})
+    assert r.status_code == 304
+    assert r.headers["etag"] == etag
+    assert r.content == b""
+
+
+def test_file_rewritten_in_place_is_served_whole(client: TestClient, tmp_path: Path):
+    path = tmp_path / "static" / "thumbnails" / "a.jpg"
+    etag = client.get("/uuids/a/thumbnail").headers["etag"]
+    # E.g., a thumbnail regenerated at another size.
+    path.write_bytes(b"a larger regenerated thumbnail")
+    os.utime(path, ns=(0, 10**18))
+    r = client.get("/uuids/a/thumbnail", headers={"If-None-Match": etag})
+    assert r.status_code == 200
+    assert r.content == b"a larger regenerated thumbnail"
+    assert r.headers["etag"] != etag
+    path.unlink()
+    assert client.get("/uuids/a/thumbnail").status_code == 404
+
+
+def test_if_none_match_mismatch_returns_200(client: TestClient):
+    r = client.get("/uuids/a/image", headers={"If-None-Match": '"other", W/"x"'})
+    assert r.status_code == 200
+
+
+def test_if_modified_since(client: TestClient, tmp_path: Path):
+    path = tmp_path / "static" / "images" / "b.jpg"
+    os.utime(path, (1_600_000_000, 1_600_000_000))
+    last_modified = client.get("/uuids/b/image").headers["last-modified"]
+    r = client.get("/uuids/b/image", headers={"If-Modified-Since": last_modified})
+    assert r.status_code == 304
+    earlier = "Sat, 01 Jan 2000 00:00:00 GMT"
+    r = client.get("/uuids/b/image", headers={"If-Modified-Since": earlier})
+    assert r.status_code == 200
+
+
+def test_missing_thumbnail_404(client: TestClient, tmp_path: Path):
+    (tmp_path / "static" / "thumbnails" / "c.jpg").unlink()
+    assert client.get("/uuids/c/thumbnail").status_code == 404
+
+
+def test_caption_etag_follows_store_version(client: TestClient, tmp_path: Path):
+    path = _write_captions(tmp_path, "a bar chart")
+    r = client.get("/uuids/a/caption")
+    assert r.status_code == 200
+    assert r.json() == "bar chart"
+    etag = r.headers["etag"]
+    assert client.get("/uuids/b/caption").headers["etag"] != etag
+
+    r = client.get("/uuids/a/caption", headers={"If-None-Match": etag})
+    assert r.status_code == 304
+
+    # An appended caption invalidates the ETags.
+    with path.open("a") as f:
+        f.write(json.dumps({"filename": "a.jpg", "caption": "a map"}) + "\n")
+    r = client.get("/uuids/a/caption", headers={"If-None-Match": etag})
+    assert r.status_code == 200
+    assert r.json() == "map"
+    etag = r.headers["etag"]
+
+    # So does a regenerated store.
+    replacement = tmp_path / "captions.jsonl"
+    replacement.write_text(json.dumps({"filename": "a.jpg", "caption": "a plate"}))
+    os.replace(replacement, path)
+    r = client.get("/uuids/a/caption", headers={"If-None-Match": etag})
+    assert r.status_code == 200
+    assert r.json() == "plate"
+    assert client.post("/captioning", json=["a"]).json() == ["plate"]
@@ -0,0 +1,45 @@
+"""Importing the server should not import the heavy compute dependencies."""
+
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+SERVER_DIR = Path(__file__).parents[1]
+
+# Seconds the import of the server may take; generous for slow CI machines.
+IMPORT_BUDGET = 2.0
+
+HEAVY_MODULES = ["sklearn", "scipy", "libquery"]
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import server
+seconds = time.perf_counter() - start
+print(json.dumps({"seconds": seconds, "modules": sorted(sys.modules)}))
+"""
+
+
+def _import_server() -> dict:
+    # A fresh interpreter, as the test session has imported everything.
+    out = subprocess.run(
+        [sys.executable, "-c", _PROBE],
+        cwd=SERVER_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(out.splitlines()[-1])
+
+
+def test_server_import_defers_heavy_modules():
+    probe = _import_server()
+    loaded = [d for d in probe["modules"] if d.split(".")[0] in HEAVY_MODULES]
+    assert loaded == []
+
+
+def test_server_import_within_budget():
+    # The best of a few runs, to not fail on a single hiccup.
+    seconds = min(_import_server()["seconds"] for _ in range(3))
+    assert seconds < IMPORT_BUDGET
@@ -0,0 +1,323 @@
+"""Ingested images should be served and indexed without a restart."""
+
+import importlib.util
+import io
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import server as server_module
+from utils import manifest
+from utils.collection import estimate_size
+from utils.ingest import INGEST_TOKEN_ENV, INGEST_TOKEN_HEADER, IngestQueue
+from utils.loaders import (
+    JsonlTail,
+    attach_embedding_store,
+    build_embedding_store,
+    build_uuid2filename,
+    export_embedding_store,
+)
+from utils.profiling import PROFILE_TOKEN_ENV, TOKEN_HEADER
+
+MANIFEST_SCRIPT = Path(__file__).parents[2] / "scripts" / "manifest.py"
+
+
+def _write_lines(path: Path, records: list[dict], mode: str = "a") -> None:
+    with path.open(mode, encoding="utf-8") as f:
+        f.write("".join(json.dumps(d) + "\n" for d in records))
+
+
+def test_jsonl_tail_follows_appends(tmp_path: Path):
+    path = tmp_path / "records.jsonl"
+    _write_lines(path, [{"i": 0}, {"i": 1}])
+    tail = JsonlTail(str(path))
+    reset, records = tail.follow()
+    assert reset and [d["i"] for d in records] == [0, 1]
+    with path.open("a") as f:
+        f.write('{"i": 2}\n{"i": ')
+    reset, records = tail.follow()
+    assert not reset and [d["i"] for d in records] == [2]
+    with path.open("a") as f:
+        f.write("3}")
+    # A complete last line is consumed without its newline.
+    assert [d["i"] for d in tail.follow()[1]] == [3]
+    replacement = tmp_path / "replacement.jsonl"
+    _write_lines(replacement, [{"i": 9}], "w")
+    os.replace(replacement, path)
+    reset, records = tail.follow()
+    assert reset and [d["i"] for d in records] == [9]
+
+
+@pytest.fixture
+def embedding_path(tmp_path: Path) -> Path:
+    rng = np.random.default_rng(0)
+    path = tmp_path / "embeddings.jsonl"
+    _write_lines(
+        path,
+        [
+            {"filename": f"{i}.jpg", "embedding": [rng.normal(size=8).tolist()]}
+            for i in range(30)
+        ],
+        "w",
+    )
+    return path
+
+
+def test_store_projects_appended_embeddings(embedding_path: Path):
+    store = build_embedding_store(str(embedding_path), 4)
+    first = store.matrix
+    raw = np.random.default_rng(1).normal(size=(2, 8))
+    _write_lines(
+        embedding_path,
+        [
+            {"filename": "new.jpg", "embedding": [raw[0].tolist()]},
+            {"filename": "3.jpg", "embedding": [raw[1].tolist()]},
+        ],
+    )
+    assert store.refresh()
+    assert len(store.uuids) == 31 and store.uuid2index["new"] == 30
+    expected = build_embedding_store(str(embedding_path), 4)
+    # The appended embeddings are projected with the stored PCA, not refitted.
+    np.testing.assert_allclose(store.matrix[:30], expected.matrix[:30], atol=0.5)
+    np.testing.assert_allclose(store.matrix[30], store.projection.apply(raw[0]))
+    np.testing.assert_allclose(store.matrix[3], store.projection.apply(raw[1]))
+    assert first.shape == (30, 4)
+
+    _write_lines(
+        embedding_path, [{"filename": "x.jpg", "embedding": [raw[0].tolist()]}], "w"
+    )
+    assert not store.refresh()
+
+
+def test_attached_store_follows_appends(embedding_path: Path, tmp_path: Path):
+    export_embedding_store(str(embedding_path), 4, tmp_path / "store")
+    store = attach_embedding_store(str(embedding_path), 4, tmp_path / "store")
+    built = build_embedding_store(str(embedding_path), 4)
+    np.testing.assert_allclose(store.projection.components, built.projection.components)
+    shared = store.matrix
+    assert isinstance(shared, np.memmap)
+    ones = [[1.0] * 8]
+    _write_lines(
+        embedding_path,
+        [
+            {"filename": "new.jpg", "embedding": [[0.0] * 8]},
+            {"filename": "3.jpg", "embedding": ones},
+        ],
+    )
+    assert store.refresh()
+    assert store.uuids[-1] == "new"
+    zeros = built.projection.apply(np.zeros(8))
+    np.testing.assert_allclose(
+        store.take([30, 3]), [zeros, built.projection.apply(ones[0])]
+    )
+    np.testing.assert_allclose(store.matrix[30], zeros)
+    # The shared pages are neither copied nor written: only the appended
+    # and replaced rows are private.
+    assert estimate_size(store) < estimate_size(built)
+    np.testing.assert_allclose(shared[3], built.matrix[3])
+
+
+def test_uuid2filename_rescans_changed_directory(tmp_path: Path):
+    (tmp_path / "a.jpg").write_bytes(b"x")
+    uuid2filename = build_uuid2filename(tmp_path)
+    assert not uuid2filename.refresh()
+    (tmp_path / "b.png").write_bytes(b"y")
+    (tmp_path / "a.jpg").unlink()
+    assert uuid2filename.refresh()
+    assert uuid2filename == {"b": "b.png"}
+
+
+def _png() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (300, 200), (200, 30, 30)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _embed(paths: list[str]) -> list:
+    return [None if "bad" in d else [[0.25, 0.35, 0.45]] for d in paths]
+
+
+def _caption(paths: list[str]) -> list:
+    return ["a red bar chart" for _ in paths]
+
+
+@pytest.fixture
+def ingest(client: TestClient, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    queue = IngestQueue(_embed, _caption)
+    monkeypatch.setattr(server_module, "INGEST", queue)
+    monkeypatch.setenv(INGEST_TOKEN_ENV, "x")
+    client.headers[INGEST_TOKEN_HEADER] = "x"
+    captions = [{"filename": f"{d}.jpg", "caption": f"a map {d}"} for d in "abc"]
+    _write_lines(tmp_path / "static" / "captions.jsonl", captions, "w")
+    return queue
+
+
+def test_ingested_images_are_served_and_indexed(
+    client: TestClient, ingest: IngestQueue, tmp_path: Path
+):
+    # Load the indexes before the ingestion, which then updates them in place.
+    assert client.post("/findCenter", json=["a", "b"]).status_code == 200
+    assert client.post("/captioning", json=["a"]).status_code == 200
+    client.post("/captions/search", json={"query": "map"})
+
+    files = [("files", ("d.png", _png(), "image/png"))]
+    r = client.post("/ingest", files=files)
+    assert r.status_code == 202
+    assert r.json() == {"uuids": ["d"]}
+    assert client.get("/uuids/d/image").content == _png()
+
+    ingest.join()
+    r = client.get("/ingest/d")
+    assert r.json()["stages"] == {
+        "thumbnail": "done",
+        "embedding": "done",
+        "caption": "done",
+    }
+    with Image.open(tmp_path / "static" / "thumbnails" / "d.png") as thumbnail:
+        assert thumbnail.size == (100, 67)
+    assert client.get("/uuids/d/thumbnail").status_code == 200
+    assert client.post("/findCenter", json=["c", "d"]).status_code == 200
+    assert client.post("/captioning", json=["d"]).json() == ["red bar chart"]
+    r = client.post("/captions/search", json={"query": "red"})
+    assert r.json()["uuids"] == ["d"]
+
+
+def test_ingestion_records_the_manifests_of_the_scripts(
+    client: TestClient, ingest: IngestQueue, tmp_path: Path
+):
+    static = tmp_path / "static"
+    manifest_path = static / "embeddings.manifest.jsonl"
+    manifest_path.write_text("")
+    client.post("/ingest", files=[("files", ("d.png", _png(), "image/png"))])
+    ingest.join()
+    entries = [json.loads(d) for d in manifest_path.read_text().splitlines()]
+    stat = (static / "images" / "d.png").stat()
+    assert entries == [
+        {
+            "filename": "d.png",
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha256": None,
+        }
+    ]
+    # The scripts rebuild the missing manifests from the outputs.
+    assert not (static / "captions.manifest.jsonl").exists()
+    assert not (static / "thumbnails.manifest.jsonl").exists()
+
+
+def test_manifest_entries_match_the_scripts(tmp_path: Path):
+    spec = importlib.util.spec_from_file_location("manifest", MANIFEST_SCRIPT)
+    scripts_manifest = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(scripts_manifest)
+    (tmp_path / "a.png").write_bytes(_png())
+    path = str(tmp_path / "embeddings.jsonl")
+    assert manifest.get_manifest_path(path) == scripts_manifest.get_manifest_path(path)
+    entry = manifest.stat_source(str(tmp_path), "a.png")
+    assert entry == scripts_manifest.stat_source(str(tmp_path), "a.png")
+    assert manifest.stat_source(str(tmp_path), "b.png") is None
+    manifest_path = scripts_manifest.get_manifest_path(path)
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        manifest.record(f, entry)
+    assert scripts_manifest.read_manifest(manifest_path) == {"a.png": entry}
+
+
+def test_scan_queues_images_without_embeddings(
+    client: TestClient, ingest: IngestQueue, tmp_path: Path
+):
+    images = tmp_path / "static" / "images"
+    (images / "e.png").write_bytes(_png())
+    (images / "bad.png").write_bytes(b"not an image")
+    r = client.post("/ingest/scan")
+    assert r.status_code == 202
+    assert sorted(r.json()["uuids"]) == ["bad", "e"]
+    ingest.join()
+    assert client.get("/ingest/bad").json()["stages"] == {
+        "thumbnail": "failed",
+        "embedding": "failed",
+        "caption": "done",
+    }
+    assert client.post("/findCenter", json=["a", "e"]).status_code == 200
+    # The failed image is left out, as its embedding is still missing.
+    assert client.post("/ingest/scan").json() == {"uuids": ["bad"]}
+
+
+def test_ingest_errors(client: TestClient, ingest: IngestQueue):
+    r = client.post("/ingest", files=[("files", ("../x.png", _png(), "image/png"))])
+    assert r.status_code == 400
+    r = client.post("/ingest", files=[("files", ("a.png", _png(), "image/png"))])
+    assert r.status_code == 409
+    assert client.get("/ingest/a").status_code == 404
+    r = client.post("/collections/missing/ingest", files=[("files", ("z.png", b"x"))])
+    assert r.status_code == 404
+
+
+def test_ingest_requires_the_token(client: TestClient, ingest: IngestQueue):
+    files = [("files", ("d.png", _png(), "image/png"))]
+    headers = {INGEST_TOKEN_HEADER: "y"}
+    assert client.post("/ingest", files=files, headers=headers).status_code == 403
+    assert client.post("/ingest/scan", headers=headers).status_code == 403
+    assert client.get("/uuids/d/image").status_code == 404
+
+
+def test_ingest_rejects_the_profile_token(
+    client: TestClient, ingest: IngestQueue, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setenv(PROFILE_TOKEN_ENV, "x")
+    del client.headers[INGEST_TOKEN_HEADER]
+    files = [("files", ("d.png", _png(), "image/png"))]
+    headers = {TOKEN_HEADER: "x"}
+    assert client.post("/ingest", files=files, headers=headers).status_code == 403
+    # Ingestion is disabled without a configured token.
+    monkeypatch.delenv(INGEST_TOKEN_ENV)
+    headers = {INGEST_TOKEN_HEADER: ""}
+    assert client.post("/ingest/scan", headers=headers).status_code == 403
+
+
+def test_failed_ingestion_is_logged(
+    client: TestClient,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    caplog: pytest.LogCaptureFixture,
+):
+    def _raise(paths: list[str]) -> list:
+        raise RuntimeError("model crashed")
+
+    queue = IngestQueue(_raise, _caption)
+    monkeypatch.setattr(server_module, "INGEST", queue)
+    monkeypatch.setenv(INGEST_TOKEN_ENV, "x")
+    client.headers[INGEST_TOKEN_HEADER] = "x"
+    with caplog.at_level(logging.ERROR, logger="utils.ingest"):
+        client.post("/ingest", files=[("files", ("d.png", _png(), "image/png"))])
+        queue.join()
+    assert client.get("/ingest/d").json()["stages"]["embedding"] == "failed"
+    (record,) = caplog.records
+    assert "model crashed" in record.exc_text
+
+
+def test_ingest_rejects_invalid_uploads(
+    client: TestClient,
+    ingest: IngestQueue,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    static = tmp_path / "static"
+    files = [
+        ("files", ("d.png", _png(), "image/png")),
+        ("files", ("e.png", b"not an image", "image/png")),
+    ]
+    r = client.post("/ingest", files=files)
+    assert r.status_code == 400
+    # None of the images of the request is added.
+    assert not (static / "images" / "d.png").exists()
+    assert not list((static / ".ingest").iterdir())
+
+    monkeypatch.setattr(server_module, "MAX_UPLOAD_BYTES", len(_png()) - 1)
+    r = client.post("/ingest", files=[("files", ("d.png", _png(), "image/png"))])
+    assert r.status_code == 413
+    assert client.get("/uuids/d/image").status_code == 404
@@ -0,0 +1,59 @@
+"""The /metrics endpoint should expose latencies, stage timings, and cache stats."""
+
+from fastapi.testclient import TestClient
+
+from utils.metrics import Histogram, timed
+
+
+def _sample(text: str, prefix: str) -> float:
+    lines = [line for line in text.splitlines() if line.startswith(prefix)]
+    assert lines, prefix
+    return float(lines[0].rsplit(" ", 1)[1])
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("x_seconds", "Test.", ("stage",), (0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value, "a")
+    text = "\n".join(histogram.render())
+    assert 'x_seconds_bucket{stage="a",le="0.1"} 1' in text
+    assert 'x_seconds_bucket{stage="a",le="1.0"} 3' in text
+    assert 'x_seconds_bucket{stage="a",le="+Inf"} 4' in text
+    assert 'x_seconds_count{stage="a"} 4' in text
+    assert _sample(text, 'x_seconds_sum{stage="a"}') == 6.05
+
+
+def test_label_values_are_escaped():
+    histogram = Histogram("y_seconds", "Test.", ("route",), (1.0,))
+    histogram.observe(0.5, 'a"b\\c')
+    assert 'route="a\\"b\\\\c"' in "\n".join(histogram.render())
+
+
+def test_metrics_endpoint(client: TestClient):
+    with timed("test_stage"):
+        pass
+    body = {"uuids": ["a", "b", "c"], "nRows": 2, "nCols": 2}
+    assert client.post("/assignGrid", json=body).status_code == 200
+    assert client.post("/assignGrid", json=body).status_code == 200
+
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/plain")
+    text = r.text
+    route = 'method="POST",route="/assignGrid",status="200"'
+    assert _sample(text, f"http_request_duration_seconds_count{{{route}}}") >= 2
+    assert 'stage_duration_seconds_count{stage="test_stage"}' in text
+    assert 'stage_duration_seconds_count{stage="tsne"}' in text
+    assert 'stage_duration_seconds_count{stage="linear_sum_assignment"}' in text
+    assert 'request_input_size_bucket{route="/assignGrid",le="10"}' in text
+    # The store is loaded by the first request and cached for the second.
+    assert _sample(text, 'cache_requests_total{cache="embedding_store",result="hit"}')
+    assert "thread_tasks_in_flight 0" in text
+    assert "thread_pool_queue_depth" in text
+
+
+def test_unmatched_paths_share_one_label(client: TestClient):
+    client.get("/no/such/path")
+    text = client.get("/metrics").text
+    assert 'route="<unmatched>",status="404"' in text
+    assert "/no/such/path" not in text
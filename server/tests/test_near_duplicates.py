@@ -0,0 +1,134 @@
+"""Near duplicates should be found by banded LSH and verified exactly."""
+
+import json
+from itertools import combinations
+from pathlib import Path
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+from utils.near_duplicates import (
+    candidate_pairs,
+    find_near_duplicates,
+    hamming_distances,
+    phash_bytes,
+    simhash,
+)
+
+
+def test_candidate_pairs_match_brute_force():
+    rng = np.random.default_rng(0)
+    bands = rng.integers(0, 4, size=(60, 3))
+    expected = {
+        (i, j)
+        for i, j in combinations(range(len(bands)), 2)
+        if (bands[i] == bands[j]).any()
+    }
+    assert {tuple(d) for d in candidate_pairs(bands).tolist()} == expected
+    assert candidate_pairs(np.arange(5)[:, None]).shape == (0, 2)
+
+
+def test_hamming_distances():
+    a = phash_bytes([0, 0xFFFF_FFFF_FFFF_FFFF, 0b1011])
+    b = phash_bytes([0, 0, 0b0110])
+    assert hamming_distances(a, b).tolist() == [0, 64, 3]
+
+
+def test_simhash_estimates_angles():
+    rng = np.random.default_rng(1)
+    x = rng.standard_normal((1, 20))
+    rows = np.concatenate([x, 2 * x, -x, x + 0.01 * rng.standard_normal((1, 20))])
+    signatures = simhash(rows)
+    assert signatures.shape == (4, 24)
+    distances = hamming_distances(signatures[:1], signatures)
+    assert distances[1] == 0
+    assert distances[2] == 192
+    assert distances[3] < 8
+
+
+def _corpus(n: int = 500, dim: int = 20) -> tuple[np.ndarray, list[int]]:
+    rng = np.random.default_rng(2)
+    embeddings = rng.standard_normal((n, dim))
+    # Rows 1 and 2 rescan row 0, row 11 rescans row 10.
+    embeddings[1] = embeddings[0] + 0.01 * rng.standard_normal(dim)
+    embeddings[2] = embeddings[0] + 0.01 * rng.standard_normal(dim)
+    embeddings[11] = embeddings[10] + 0.01 * rng.standard_normal(dim)
+    phashes = [int(d) for d in rng.integers(0, 2**63, size=n)]
+    phashes[1] = phashes[0] ^ 0b101
+    phashes[2] = phashes[0] ^ (0b11 << 40)
+    phashes[11] = phashes[10] ^ 1
+    return embeddings, phashes
+
+
+def test_find_near_duplicates():
+    embeddings, phashes = _corpus()
+    simhashes = simhash(embeddings)
+    assert find_near_duplicates(embeddings, simhashes, phashes) == [
+        [0, 1, 2],
+        [10, 11],
+    ]
+    # Without perceptual hashes, the embeddings alone decide.
+    assert find_near_duplicates(embeddings, simhashes) == [[0, 1, 2], [10, 11]]
+    # Differing perceptual hashes veto similar embeddings.
+    phashes[11] = ~phashes[10] & (2**64 - 1)
+    assert find_near_duplicates(embeddings, simhashes, phashes) == [[0, 1, 2]]
+    phashes[10] = None
+    assert find_near_duplicates(embeddings, simhashes, phashes) == [
+        [0, 1, 2],
+        [10, 11],
+    ]
+
+
+def test_near_duplicates_endpoint(client: TestClient, tmp_path: Path):
+    # The fixture's embeddings are all similar (cosine similarity above 0.98),
+    # the perceptual hash of c differs from those of a and b.
+    lines = [
+        {"filename": "a.jpg", "phash": "00000000000000ff"},
+        {"filename": "b.jpg", "phash": "00000000000000fe"},
+        {"filename": "c.jpg", "phash": "ffffffffffffff00"},
+    ]
+    (tmp_path / "static" / "phashes.jsonl").write_text(
+        "".join(json.dumps(d) + "\n" for d in lines)
+    )
+    r = client.post("/nearDuplicates", json={"uuids": ["c", "b", "a", "b"]})
+    assert r.status_code == 200
+    assert r.json() == {"groups": [["b", "a"]]}
+
+    handle = client.post("/selections", json=["a", "b", "c"]).json()["handle"]
+    r = client.post("/nearDuplicates", json={"selection": handle})
+    assert r.json() == {"groups": [["a", "b"]]}
+    r = client.post(
+        "/nearDuplicates", json={"selection": handle, "minSimilarity": 0.995}
+    )
+    assert r.json() == {"groups": []}
+
+
+def test_min_similarity_applies_to_the_projections(client: TestClient, tmp_path: Path):
+    # Raw embeddings sharing a large offset, as CLIP embeddings do,
+    # with row 1 rescanning row 0.
+    rng = np.random.default_rng(3)
+    raw = 10 + rng.standard_normal((40, 32))
+    raw[1] = raw[0] + 0.01 * rng.standard_normal(32)
+    normalized = raw / np.linalg.norm(raw, axis=1)[:, None]
+    assert (normalized @ normalized.T).min() > 0.95
+
+    static = tmp_path / "collections" / "plates"
+    (static / "images").mkdir(parents=True)
+    (static / "embeddings.jsonl").write_text(
+        "".join(
+            json.dumps({"filename": f"{i}.jpg", "embedding": d.tolist()}) + "\n"
+            for i, d in enumerate(raw)
+        )
+    )
+    uuids = [str(i) for i in range(40)]
+    r = client.post("/collections/plates/nearDuplicates", json={"uuids": uuids})
+    assert r.json() == {"groups": [["0", "1"]]}
+
+
+def test_near_duplicates_endpoint_errors(client: TestClient):
+    assert client.post("/nearDuplicates", json={"uuids": []}).status_code == 400
+    r = client.post("/nearDuplicates", json={"uuids": ["a"], "maxDistance": 65})
+    assert r.status_code == 400
+    r = client.post("/nearDuplicates", json={"uuids": ["a", "missing"]})
+    assert r.status_code == 404
+    assert client.post("/nearDuplicates", json={"selection": "x"}).status_code == 404
@@ -0,0 +1,104 @@
+"""Requests should be profiled on demand and logged when slow."""
+
+import json
+import threading
+import time
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+from utils.profiling import (
+    PROFILE_HEADER,
+    PROFILE_TOKEN_ENV,
+    SLOW_REQUEST_ENV,
+    SLOW_REQUEST_LOG_ENV,
+    TOKEN_HEADER,
+    RequestTrace,
+    SlowRequestWatchdog,
+)
+
+GRID = {"uuids": ["a", "b", "c"], "nRows": 2, "nCols": 2}
+
+
+def test_profile_requires_token(client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.delenv(PROFILE_TOKEN_ENV, raising=False)
+    r = client.post("/assignGrid?profile=1", json=GRID, headers={TOKEN_HEADER: "x"})
+    assert r.status_code == 403
+    monkeypatch.setenv(PROFILE_TOKEN_ENV, "secret")
+    r = client.post("/assignGrid?profile=1", json=GRID, headers={TOKEN_HEADER: "x"})
+    assert r.status_code == 403
+    assert client.get("/profiles/any", headers={TOKEN_HEADER: "x"}).status_code == 403
+
+
+def test_profiled_request_stores_report(
+    client: TestClient, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setenv(PROFILE_TOKEN_ENV, "secret")
+    headers = {TOKEN_HEADER: "secret"}
+    r = client.post("/assignGrid?profile=1", json=GRID, headers=headers)
+    assert r.status_code == 200
+    assert len(r.json()) == 3
+    profile_id = r.headers[PROFILE_HEADER]
+
+    report = client.get(f"/profiles/{profile_id}", headers=headers).json()
+    assert report["path"] == "/assignGrid"
+    assert report["inputs"] == {"uuids": 3}
+    assert "tsne" in [name for name, _ in report["stages"]]
+    assert isinstance(report["samples"], str)
+    # Only the worker threads of the request are sampled, not the event loop.
+    samples = [d for d in report["samples"].splitlines() if d]
+    assert all("call_traced (profiling.py" in d for d in samples)
+    assert client.get("/profiles/missing", headers=headers).status_code == 404
+
+
+def test_unprofiled_request_has_no_profile_id(client: TestClient):
+    r = client.post("/assignGrid", json=GRID)
+    assert PROFILE_HEADER not in r.headers
+
+
+def test_slow_request_is_logged(
+    client: TestClient, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    log_path = tmp_path / "slow.jsonl"
+    monkeypatch.setenv(SLOW_REQUEST_ENV, "0.000001")
+    monkeypatch.setenv(SLOW_REQUEST_LOG_ENV, str(log_path))
+    client.post("/clustering", json={"uuids": ["a", "b", "c"], "nClusters": 2})
+    record = json.loads(log_path.read_text().splitlines()[-1])
+    assert record["path"] == "/clustering"
+    assert record["inputs"] == {"uuids": 3}
+    assert "kmeans" in [name for name, _ in record["stages"]]
+
+
+def test_streamed_responses_are_not_logged(
+    client: TestClient, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    log_path = tmp_path / "slow.jsonl"
+    monkeypatch.setenv(SLOW_REQUEST_ENV, "0.000001")
+    monkeypatch.setenv(SLOW_REQUEST_LOG_ENV, str(log_path))
+    assert client.post("/assignGrid/stream", json=GRID).status_code == 200
+    assert client.post("/export", json={"fields": ["embedding"]}).status_code == 200
+    assert not log_path.exists()
+
+
+def test_fast_request_is_not_logged(
+    client: TestClient, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    log_path = tmp_path / "slow.jsonl"
+    monkeypatch.setenv(SLOW_REQUEST_ENV, "60")
+    monkeypatch.setenv(SLOW_REQUEST_LOG_ENV, str(log_path))
+    client.get("/uuids/a/image")
+    assert not log_path.exists()
+
+
+def test_watchdog_samples_overdue_request():
+    watchdog = SlowRequestWatchdog(interval=0.01)
+    trace = RequestTrace("POST", "/x", slow_threshold=0.02)
+    trace.threads.add(threading.get_ident())
+    watchdog.add(trace)
+    deadline = time.monotonic() + 2
+    while trace.slow_stacks is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    watchdog.remove(trace)
+    stack = trace.slow_stacks[threading.get_ident()]
+    assert any("test_watchdog_samples_overdue_request" in d for d in stack)
@@ -0,0 +1,77 @@
+"""Compute endpoints should negotiate JSON, binary, and gzip encodings."""
+
+import gzip
+import json
+
+import numpy as np
+from fastapi import Request
+from fastapi.testclient import TestClient
+
+from utils.responses import BINARY_MEDIA_TYPE, SHAPE_HEADER, array_response
+
+
+def _request(headers: dict[str, str]) -> Request:
+    raw = [(k.lower().encode(), v.encode()) for k, v in headers.items()]
+    return Request({"type": "http", "headers": raw})
+
+
+def test_assign_grid_defaults_to_json(client: TestClient):
+    r = client.post(
+        "/assignGrid", json={"uuids": ["a", "b", "c"], "nRows": 2, "nCols": 2}
+    )
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "application/json"
+    cells = [tuple(d) for d in r.json()]
+    assert len(cells) == 3 and len(set(cells)) == 3
+
+
+def test_assign_grid_binary_matches_json(client: TestClient):
+    body = {"uuids": ["a", "b", "c"], "nRows": 2, "nCols": 2}
+    expected = client.post("/assignGrid", json=body).json()
+    r = client.post("/assignGrid", json=body, headers={"Accept": BINARY_MEDIA_TYPE})
+    assert r.status_code == 200
+    assert r.headers[SHAPE_HEADER] == "3,2"
+    decoded = np.frombuffer(r.content, dtype="<i4").reshape(3, 2)
+    assert decoded.tolist() == expected
+
+
+def test_clustering_binary(client: TestClient):
+    r = client.post(
+        "/clustering",
+        json={"uuids": ["a", "b", "c"], "nClusters": 1},
+        headers={"Accept": BINARY_MEDIA_TYPE},
+    )
+    assert r.status_code == 200
+    assert r.headers[SHAPE_HEADER] == "3"
+    assert np.frombuffer(r.content, dtype="<i4").tolist() == [0, 0, 0]
+
+
+def test_array_response_gzips_large_bodies():
+    array = np.arange(20_000).reshape(-1, 2)
+    response = array_response(array, _request({"Accept-Encoding": "gzip, br"}))
+    assert response.headers["content-encoding"] == "gzip"
+    assert gzip.decompress(response.body).startswith(b"[[0,1],[2,3],")
+
+
+def test_array_response_skips_gzip_for_small_bodies():
+    response = array_response(np.arange(4), _request({"Accept-Encoding": "gzip"}))
+    assert "content-encoding" not in response.headers
+    assert response.body == b"[0,1,2,3]"
+
+
+def test_assign_grid_stream_emits_stages(client: TestClient):
+    body = {"uuids": ["a", "b", "c"], "nRows": 2, "nCols": 2}
+    expected = client.post("/assignGrid", json=body).json()
+    r = client.post("/assignGrid/stream", json=body)
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/event-stream")
+    events = [d for d in r.text.split("\n\n") if d]
+    assert all(d.startswith("event: layout\ndata: ") for d in events)
+    data = [json.loads(d.split("data: ", 1)[1]) for d in events]
+    assert [d["stage"] for d in data] == ["coarse", "tsne", "final"]
+    assert data[-1]["assignment"] == expected
+
+
+def test_assign_grid_stream_validates_before_streaming(client: TestClient):
+    body = {"uuids": ["a", "b", "c"], "nRows": 1, "nCols": 1}
+    assert client.post("/assignGrid/stream", json=body).status_code == 400
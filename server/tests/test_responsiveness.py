@@ -0,0 +1,59 @@
+"""Image GETs should stay responsive while compute requests run."""
+
+import asyncio
+import json
+import time
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server as server_module
+from benchmarks.responsiveness import HeavyRequest, measure_responsiveness
+
+# Seconds each stand-in blocks its thread, as a heavy computation would.
+BLOCK = 0.4
+
+# A blocking call on the event loop delays the GETs and the loop by ~BLOCK.
+BOUND = BLOCK / 3
+
+
+def _blocking(func):
+    def wrapper(*args, **kwargs):
+        time.sleep(BLOCK)
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+@pytest.fixture
+def blocking_server(client: TestClient, tmp_path: Path, monkeypatch):
+    """The app with the loaders and the computations blocking for BLOCK seconds."""
+
+    captions = [{"filename": f"{d}.jpg", "caption": f"a chart {d}"} for d in "abc"]
+    caption_path = tmp_path / "static" / "captions.jsonl"
+    caption_path.write_text("".join(json.dumps(d) + "\n" for d in captions))
+    for name in ("_load_embeddings", "_uuid2caption", "clustering", "assign_grid"):
+        monkeypatch.setattr(
+            server_module, name, _blocking(getattr(server_module, name))
+        )
+    return client.app
+
+
+def test_gets_stay_responsive_during_compute(blocking_server):
+    uuids = ["a", "b", "c"]
+    heavy = [
+        HeavyRequest("POST", "/clustering", {"uuids": uuids, "nClusters": 2}),
+        HeavyRequest("POST", "/assignGrid", {"uuids": uuids, "nRows": 2, "nCols": 2}),
+        HeavyRequest("POST", "/findCenter", uuids),
+        HeavyRequest("POST", "/findCenters", [uuids, ["a"]]),
+        HeavyRequest("POST", "/captioning", uuids),
+        HeavyRequest("GET", "/uuids/a/caption", None),
+    ]
+    gets = [f"/uuids/{d}/thumbnail" for d in uuids] + ["/uuids/a/image"]
+    stats = asyncio.run(measure_responsiveness(blocking_server, heavy, gets))
+
+    assert stats["get_p99"] < BOUND, stats
+    assert stats["loop_lag_max"] < BOUND, stats
+    # The heavy requests take at least 2 * BLOCK (load, then compute).
+    assert stats["get_count"] >= 10, stats
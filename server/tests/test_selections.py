@@ -0,0 +1,139 @@
+"""Compute endpoints should accept a registered selection handle for the uuids."""
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import server as server_module
+from utils.loaders import EmbeddingStore
+from utils.selections import SelectionRegistry, get_selection_handle
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _store(uuids: list[str]) -> EmbeddingStore:
+    matrix = np.arange(len(uuids) * 2, dtype=float).reshape(-1, 2)
+    return EmbeddingStore(uuids, {d: i for i, d in enumerate(uuids)}, matrix)
+
+
+def test_handle_is_content_addressed():
+    registry = SelectionRegistry()
+    first = registry.register(["a", "b"])
+    assert registry.register(["a", "b"]) is first
+    assert first.handle == get_selection_handle(["a", "b"])
+    assert get_selection_handle(["b", "a"]) != first.handle
+    assert get_selection_handle(["a\0", "b"]) != get_selection_handle(["a", "\0b"])
+
+
+def test_registry_expires_and_evicts():
+    clock = _Clock()
+    registry = SelectionRegistry(max_size=2, ttl=10, clock=clock)
+    a = registry.register(["a"])
+    b = registry.register(["b"])
+    clock.now = 5
+    assert registry.get(a.handle) is a
+    registry.register(["c"])
+    # b is the least recently used.
+    assert registry.get(b.handle) is None
+    assert registry.get(a.handle) is a
+    clock.now = 100
+    assert registry.get(a.handle) is None
+    assert len(registry) == 0
+
+
+def test_registry_caps_bytes(tmp_path: Path):
+    clock = _Clock()
+    uuids = [f"{i:04d}" for i in range(10)]
+    registry = SelectionRegistry(clock=clock, directory=tmp_path, max_bytes=200)
+    # 80 bytes each.
+    a = registry.register(uuids)
+    clock.now = 1
+    registry.register(uuids[::-1])
+    clock.now = 2
+    registry.register(uuids[1:] + uuids[:1])
+    assert registry.get(a.handle) is None
+    assert len(list(tmp_path.glob("*.json"))) == 2
+    with pytest.raises(ValueError):
+        registry.register([f"{i:04d}" for i in range(30)])
+
+
+def test_oversized_selection_413(client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(server_module.SELECTIONS, "max_bytes", 10)
+    assert client.post("/selections", json=["a", "b", "c"]).status_code == 413
+
+
+def test_processes_share_selections(tmp_path: Path):
+    clock = _Clock()
+    # Registries of two processes sharing the directory.
+    first = SelectionRegistry(ttl=10, clock=clock, directory=tmp_path)
+    second = SelectionRegistry(ttl=10, clock=clock, directory=tmp_path)
+    handle = first.register(["b", "a"]).handle
+    selection = second.get(handle)
+    assert selection.uuids == ["b", "a"]
+    assert second.get(handle) is selection
+    assert second.get("../x") is None
+    # Using the selection in one process keeps it for the others.
+    clock.now = 8
+    assert second.get(handle) is selection
+    clock.now = 16
+    assert first.get(handle).uuids == ["b", "a"]
+    clock.now = 30
+    assert (
+        SelectionRegistry(ttl=10, clock=clock, directory=tmp_path).get(handle) is None
+    )
+    first.register(["c"])
+    assert [d.name for d in tmp_path.iterdir()] == [
+        f"{get_selection_handle(['c'])}.json"
+    ]
+
+
+def test_indices_are_cached_per_store():
+    selection = SelectionRegistry().register(["c", "a"])
+    store = _store(["a", "b", "c"])
+    indices = selection.get_indices(store)
+    assert indices.tolist() == [2, 0]
+    assert selection.get_indices(store) is indices
+    reloaded = _store(["c", "a"])
+    assert selection.get_indices(reloaded).tolist() == [0, 1]
+
+
+def test_compute_endpoints_accept_handle(client: TestClient):
+    r = client.post("/selections", json=["a", "b", "c"])
+    assert r.status_code == 200
+    handle = r.json()["handle"]
+    assert r.json()["size"] == 3
+
+    body = {"nRows": 2, "nCols": 2}
+    by_list = client.post("/assignGrid", json={"uuids": ["a", "b", "c"], **body})
+    by_handle = client.post("/assignGrid", json={"selection": handle, **body})
+    assert by_handle.status_code == 200
+    assert by_handle.json() == by_list.json()
+
+    r = client.post("/clustering", json={"selection": handle, "nClusters": 1})
+    assert r.json() == [0, 0, 0]
+    r = client.post("/findCenter", json={"selection": handle})
+    assert r.json() == "b"
+    r = client.post("/findCenters", json=[{"selection": handle}, ["a"]])
+    assert r.json() == ["b", "a"]
+
+
+def test_unknown_handle_404(client: TestClient):
+    r = client.post("/clustering", json={"selection": "missing", "nClusters": 1})
+    assert r.status_code == 404
+    r = client.post("/captioning", json={"selection": "missing"})
+    assert r.status_code == 404
+
+
+def test_missing_uuids_and_selection_400(client: TestClient):
+    r = client.post("/clustering", json={"nClusters": 1})
+    assert r.status_code == 400
+    r = client.post("/selections", json=[])
+    assert r.status_code == 400
@@ -0,0 +1,159 @@
+"""Downloads should stream, resume with Range requests, and verify checksums."""
+
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import httpx
+import pytest
+
+import static.setup_samples as setup_samples
+from static.setup_samples import _download_one, fetch_imgs, git_blob_sha1
+
+
+class _StandInServer:
+    """Local HTTP server serving in-memory files with Range support."""
+
+    def __init__(self, files: dict[str, bytes], delay: float = 0.0):
+        self.files = files
+        self.delay = delay
+        self.ranges: list[str | None] = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    def url(self, name: str) -> str:
+        host, port = self._httpd.server_address
+        return f"http://{host}:{port}/{name}"
+
+    def __enter__(self) -> "_StandInServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                with server._lock:
+                    server.active += 1
+                    server.max_active = max(server.max_active, server.active)
+                    server.ranges.append(self.headers.get("Range"))
+                try:
+                    time.sleep(server.delay)
+                    self._respond()
+                finally:
+                    with server._lock:
+                        server.active -= 1
+
+            def _respond(self) -> None:
+                data = server.files.get(self.path.lstrip("/"))
+                if data is None:
+                    self.send_error(404)
+                    return
+                range_header = self.headers.get("Range")
+                if range_header is None:
+                    self.send_response(200)
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                    return
+                start = int(range_header.removeprefix("bytes=").rstrip("-"))
+                if start >= len(data):
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{len(data)}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header(
+                    "Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}"
+                )
+                self.send_header("Content-Length", str(len(data) - start))
+                self.end_headers()
+                self.wfile.write(data[start:])
+
+        return Handler
+
+
+def _download(url: str, dest: Path, sha: str | None = None) -> None:
+    async def run() -> None:
+        async with httpx.AsyncClient() as client:
+            await _download_one(client, url, dest, sha)
+
+    asyncio.run(run())
+
+
+def test_git_blob_sha1_matches_git(tmp_path: Path):
+    path = tmp_path / "hello.txt"
+    path.write_bytes(b"hello")
+    assert git_blob_sha1(path) == "b6fc4c620b67d95f953a5c1c1230aaab5db5a1b0"
+
+
+def test_fetch_imgs_downloads_all_files(tmp_path: Path):
+    files = {f"{i}.jpg": bytes([i]) * 200_000 for i in range(3)}
+    with _StandInServer(files) as server:
+        fetch_imgs([server.url(name) for name in files], str(tmp_path))
+    for name, data in files.items():
+        assert (tmp_path / name).read_bytes() == data
+    assert not list(tmp_path.glob("*.partial"))
+
+
+def test_download_resumes_partial_file(tmp_path: Path):
+    data = bytes(range(256)) * 1000
+    dest = tmp_path / "a.jpg"
+    (tmp_path / "a.jpg.partial").write_bytes(data[:1000])
+    with _StandInServer({"a.jpg": data}) as server:
+        _download(server.url("a.jpg"), dest)
+        assert server.ranges == ["bytes=1000-"]
+    assert dest.read_bytes() == data
+
+
+def test_download_completes_when_partial_is_whole_file(tmp_path: Path):
+    data = b"complete"
+    dest = tmp_path / "a.jpg"
+    (tmp_path / "a.jpg.partial").write_bytes(data)
+    with _StandInServer({"a.jpg": data}) as server:
+        _download(server.url("a.jpg"), dest)
+    assert dest.read_bytes() == data
+
+
+def test_download_verifies_checksum(tmp_path: Path):
+    data = b"hello"
+    dest = tmp_path / "a.jpg"
+    with _StandInServer({"a.jpg": data}) as server:
+        _download(server.url("a.jpg"), dest, "b6fc4c620b67d95f953a5c1c1230aaab5db5a1b0")
+    assert dest.read_bytes() == data
+
+
+def test_download_checksum_mismatch_raises(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(setup_samples, "MAX_ATTEMPTS", 1)
+    dest = tmp_path / "a.jpg"
+    with _StandInServer({"a.jpg": b"hello"}) as server:
+        with pytest.raises(RuntimeError, match="Failed to download"):
+            _download(server.url("a.jpg"), dest, "0" * 40)
+    assert not dest.exists()
+    assert not (tmp_path / "a.jpg.partial").exists()
+
+
+def test_fetch_imgs_respects_connection_limit(tmp_path: Path):
+    files = {f"{i}.jpg": b"x" for i in range(8)}
+    with _StandInServer(files, delay=0.05) as server:
+        fetch_imgs(
+            [server.url(name) for name in files], str(tmp_path), max_connections=2
+        )
+        assert server.max_active <= 2
+    assert len(list(tmp_path.glob("*.jpg"))) == 8
@@ -1,10 +1,11 @@
-"""safe_extract should reject zip-slip paths and skip when markers exist."""
+"""safe_extract should reject zip-slip paths and only extract changed members."""
 
 from pathlib import Path
 from zipfile import ZipFile, ZipInfo
 
 import pytest
 
+import static.setup_samples as setup_samples
 from static.setup_samples import extract_if_needed, safe_extract
 
 
@@ -42,3 +43,61 @@ def test_extract_if_needed_skips_when_marker_exists(tmp_path: Path):
     marker.write_text("already\n", encoding="utf-8")
     extract_if_needed(zip_path, dest, marker)
     assert not (dest / "file.txt").exists()
+
+
+def test_safe_extract_skips_current_members(tmp_path: Path):
+    zip_path = tmp_path / "thumbs.zip"
+    _write_zip(zip_path, {"thumbnails/a.jpg": b"aaa", "thumbnails/b.jpg": b"bbb"})
+    out = tmp_path / "out"
+    out.mkdir()
+    assert safe_extract(zip_path, out) == 2
+    (out / ".thumbs.zip.extracted.json").unlink()
+    assert safe_extract(zip_path, out) == 0
+
+
+def test_safe_extract_repairs_partial_extraction(tmp_path: Path):
+    zip_path = tmp_path / "thumbs.zip"
+    _write_zip(zip_path, {"thumbnails/a.jpg": b"aaa", "thumbnails/b.jpg": b"bbb"})
+    out = tmp_path / "out"
+    (out / "thumbnails").mkdir(parents=True)
+    (out / "thumbnails" / "a.jpg").write_bytes(b"aaa")
+    (out / "thumbnails" / "b.jpg").write_bytes(b"bb")
+    assert safe_extract(zip_path, out) == 1
+    assert (out / "thumbnails" / "b.jpg").read_bytes() == b"bbb"
+
+
+def test_safe_extract_rewrites_member_with_crc_mismatch(tmp_path: Path):
+    zip_path = tmp_path / "thumbs.zip"
+    _write_zip(zip_path, {"a.jpg": b"aaa"})
+    out = tmp_path / "out"
+    out.mkdir()
+    (out / "a.jpg").write_bytes(b"xyz")
+    assert safe_extract(zip_path, out) == 1
+    assert (out / "a.jpg").read_bytes() == b"aaa"
+
+
+def test_safe_extract_manifest_skips_crc_checks(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    zip_path = tmp_path / "thumbs.zip"
+    _write_zip(zip_path, {"a.jpg": b"aaa", "b.jpg": b"bbb"})
+    out = tmp_path / "out"
+    out.mkdir()
+    safe_extract(zip_path, out)
+
+    def fail(*args):
+        raise AssertionError("member content should not be read")
+
+    monkeypatch.setattr(setup_samples, "_member_is_current", fail)
+    assert safe_extract(zip_path, out) == 0
+
+
+def test_safe_extract_manifest_detects_missing_member(tmp_path: Path):
+    zip_path = tmp_path / "thumbs.zip"
+    _write_zip(zip_path, {"a.jpg": b"aaa", "b.jpg": b"bbb"})
+    out = tmp_path / "out"
+    out.mkdir()
+    safe_extract(zip_path, out)
+    (out / "b.jpg").unlink()
+    assert safe_extract(zip_path, out) == 1
+    assert (out / "b.jpg").read_bytes() == b"bbb"
@@ -2,10 +2,13 @@
 This module provides functions to assign 2D embeddings to a grid.
 """
 
+from collections.abc import Iterator
+
 import numpy as np
-from scipy.optimize import linear_sum_assignment
-from scipy.spatial.distance import cdist
-from sklearn.manifold import TSNE
+
+from .metrics import timed
+
+# scipy and sklearn are imported on first use to keep the server start fast.
 
 
 def get_embeddings_2d(embeddings: np.ndarray) -> np.ndarray:
@@ -21,11 +24,32 @@ def get_embeddings_2d(embeddings: np.ndarray) -> np.ndarray:
     if n == 2:
         # Two points on a line — enough for assignment without t-SNE.
         return np.array([[0.0, 0.0], [1.0, 0.0]], dtype=float)
-    return TSNE(
-        n_components=2,
-        random_state=0,
-        perplexity=min(30, n / 3),
-    ).fit_transform(embeddings)
+    from sklearn.manifold import TSNE
+
+    with timed("tsne"):
+        return TSNE(
+            n_components=2,
+            random_state=0,
+            perplexity=min(30, n / 3),
+        ).fit_transform(embeddings)
+
+
+def get_embeddings_2d_coarse(embeddings: np.ndarray) -> np.ndarray:
+    """
+    Compute 2D embeddings by projecting onto the two principal axes.
+    Much cheaper than t-SNE, but clusters may overlap.
+    """
+
+    n = embeddings.shape[0]
+    if n < 3:
+        return get_embeddings_2d(embeddings)
+    centered = embeddings - embeddings.mean(axis=0)
+    # The right singular vectors are the principal axes.
+    _, _, vt = np.linalg.svd(centered, full_matrices=False)
+    projected = centered @ vt[:2].T
+    if projected.shape[1] < 2:
+        projected = np.hstack([projected, np.zeros((n, 2 - projected.shape[1]))])
+    return projected
 
 
 def fit_to_rect(
@@ -61,10 +85,42 @@ def build_grid(width: float, height: float, n_rows: int, n_cols: int) -> np.ndar
 def solve_assignment(cost_matrix: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
     """Solve a bipartite graph assignment problem given the edge costs."""
 
-    row_ind, col_ind = linear_sum_assignment(cost_matrix)
+    from scipy.optimize import linear_sum_assignment
+
+    with timed("linear_sum_assignment"):
+        row_ind, col_ind = linear_sum_assignment(cost_matrix)
     return row_ind, col_ind
 
 
+def assign_greedy(points: np.ndarray, n_rows: int, n_cols: int) -> np.ndarray:
+    """
+    Assign 2D points to a grid by sorting instead of solving the assignment.
+
+    The points are split into n_rows bands of (nearly) equal size by y,
+    and the points of each band are spread over the columns in the order of x.
+    Runs in O(n log n) and keeps the relative positions, though not optimally.
+
+    Returns
+    -------
+    The (row index, column index) assigned to each point, with shape (n, 2).
+    """
+
+    n = points.shape[0]
+    assigned_coords = np.zeros((n, 2), dtype=int)
+    by_y = np.argsort(points[:, 1], kind="stable")
+    bounds = np.linspace(0, n, n_rows + 1).round().astype(int)
+    for row, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+        band = by_y[start:end]
+        if len(band) == 0:
+            continue
+        band = band[np.argsort(points[band, 0], kind="stable")]
+        # Distinct columns, as a band holds at most n_cols points.
+        cols = np.linspace(0, n_cols - 1, len(band)).round().astype(int)
+        assigned_coords[band, 0] = row
+        assigned_coords[band, 1] = cols
+    return assigned_coords
+
+
 def invert(a: np.ndarray) -> np.ndarray:
     """Invert a permutation."""
 
@@ -73,6 +129,30 @@ def invert(a: np.ndarray) -> np.ndarray:
     return inverted
 
 
+def assign_exact(points: np.ndarray, n_rows: int, n_cols: int) -> np.ndarray:
+    """
+    Assign 2D points fitted to [0, 1] * [0, n_rows / n_cols] to the grid cells
+    minimizing the total squared distance.
+    """
+
+    from scipy.spatial.distance import cdist
+
+    width = 1
+    height = n_rows / n_cols
+
+    grid = build_grid(width=width, height=height, n_rows=n_rows, n_cols=n_cols)
+    with timed("cdist"):
+        cost = cdist(grid, points, "sqeuclidean")
+
+    row_ind, col_ind = solve_assignment(cost)
+    col_ind = row_ind[invert(col_ind)]
+
+    assigned_rows = col_ind // n_cols
+    assigned_cols = col_ind % n_cols
+    assigned_coords = np.vstack([assigned_rows, assigned_cols]).T
+    return assigned_coords
+
+
 def assign_grid(embeddings: np.ndarray, n_rows: int, n_cols: int) -> np.ndarray:
     """
     Assign 2D embeddings to a grid of size n_rows * n_cols.
@@ -86,17 +166,30 @@ def assign_grid(embeddings: np.ndarray, n_rows: int, n_cols: int) -> np.ndarray:
     assigned to embeddings[i].
     """
 
-    width = 1
-    height = n_rows / n_cols
+    embeddings_2d = fit_to_rect(get_embeddings_2d(embeddings), 1, n_rows / n_cols)
+    return assign_exact(embeddings_2d, n_rows, n_cols)
 
-    embeddings_2d = fit_to_rect(get_embeddings_2d(embeddings), width, height)
-    grid = build_grid(width=width, height=height, n_rows=n_rows, n_cols=n_cols)
-    cost = cdist(grid, embeddings_2d, "sqeuclidean")
 
-    row_ind, col_ind = solve_assignment(cost)
-    col_ind = row_ind[invert(col_ind)]
+def assign_grid_progressive(
+    embeddings: np.ndarray, n_rows: int, n_cols: int
+) -> Iterator[tuple[str, np.ndarray]]:
+    """
+    Assign 2D embeddings to a grid in stages of increasing quality and cost.
+
+    Yields
+    ------
+    The stage name and the assignment (in the format of `assign_grid`):
+    - "coarse": the principal axes with the greedy assignment,
+    - "tsne": t-SNE with the greedy assignment,
+    - "final": t-SNE with the exact assignment, equal to `assign_grid`.
+    """
 
-    assigned_rows = col_ind // n_cols
-    assigned_cols = col_ind % n_cols
-    assigned_coords = np.vstack([assigned_rows, assigned_cols]).T
-    return assigned_coords
+    height = n_rows / n_cols
+    with timed("pca_2d"):
+        coarse = fit_to_rect(get_embeddings_2d_coarse(embeddings), 1, height)
+    yield "coarse", assign_greedy(coarse, n_rows, n_cols)
+
+    embeddings_2d = fit_to_rect(get_embeddings_2d(embeddings), 1, height)
+    yield "tsne", assign_greedy(embeddings_2d, n_rows, n_cols)
+
+    yield "final", assign_exact(embeddings_2d, n_rows, n_cols)
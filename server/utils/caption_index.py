@@ -0,0 +1,155 @@
+"""
+This module provides an inverted index over the processed captions,
+answering term and prefix queries without scanning the captions.
+The index follows the caption store as it grows, indexing only appended lines.
+"""
+
+import re
+import threading
+from bisect import bisect_left, insort
+from functools import cache
+
+from .captioning import process_caption
+from .loaders import JsonlTail, filename2uuid
+from .metrics import timed
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+# Suffix marking a query term as a prefix.
+PREFIX_MARK = "*"
+
+
+def tokenize(text: str) -> list[str]:
+    return _TOKEN.findall(text.lower())
+
+
+def parse_query(query: str) -> list[tuple[str, bool]]:
+    """
+    Parse a query into (term, is_prefix) pairs, all of which must match.
+
+    Examples
+    --------
+    >>> parse_query("Bar chart*")
+    [('bar', False), ('chart', True)]
+    """
+
+    parsed = []
+    for word in query.split():
+        terms = tokenize(word)
+        parsed.extend((d, False) for d in terms)
+        # Only the last term of the word, e.g., "chart" of "bar-chart*".
+        if terms and word.endswith(PREFIX_MARK):
+            parsed[-1] = (terms[-1], True)
+    return parsed
+
+
+class CaptionIndex:
+    """
+    Inverted index from caption terms to the uuids, in the order of the store.
+    Safe to use from multiple threads.
+    """
+
+    def __init__(self, caption_path: str):
+        self.caption_path = caption_path
+        self._lock = threading.Lock()
+        self._tail = JsonlTail(caption_path)
+        self._reset()
+
+    def _reset(self) -> None:
+        # Documents are numbered in the order of the store;
+        # the number of a uuid whose caption was replaced maps to None.
+        self._doc2uuid: list[str | None] = []
+        self._uuid2doc: dict[str, int] = {}
+        self._postings: dict[str, set[int]] = {}
+        # The terms in sorted order, for prefix queries.
+        self._terms: list[str] = []
+
+    def __len__(self) -> int:
+        return len(self._uuid2doc)
+
+    def _add(self, uuid: str, caption: str) -> None:
+        previous = self._uuid2doc.get(uuid)
+        if previous is not None:
+            self._doc2uuid[previous] = None
+        doc = len(self._doc2uuid)
+        self._doc2uuid.append(uuid)
+        self._uuid2doc[uuid] = doc
+        for term in set(tokenize(process_caption(caption))):
+            docs = self._postings.get(term)
+            if docs is None:
+                docs = self._postings[term] = set()
+                insort(self._terms, term)
+            docs.add(doc)
+
+    def update(self) -> None:
+        """
+        Index the lines appended to the store since the last update.
+        The index is rebuilt if the store was replaced or truncated.
+
+        Raises
+        ------
+        FileNotFoundError
+            If the store does not exist.
+        """
+
+        with self._lock:
+            reset, records = self._tail.follow()
+            if reset:
+                self._reset()
+            with timed("index_captions"):
+                for d in records:
+                    # The scripts write null captions for unreadable images.
+                    if d["caption"] is not None:
+                        self._add(filename2uuid(d["filename"]), d["caption"])
+
+    def _match(self, term: str, is_prefix: bool) -> set[int]:
+        if not is_prefix:
+            return self._postings.get(term, set())
+        docs: set[int] = set()
+        for i in range(bisect_left(self._terms, term), len(self._terms)):
+            if not self._terms[i].startswith(term):
+                break
+            docs |= self._postings[self._terms[i]]
+        return docs
+
+    def search(
+        self,
+        query: str,
+        uuids: list[str] | None = None,
+        offset: int = 0,
+        limit: int = 100,
+    ) -> tuple[int, list[str]]:
+        """
+        Find the uuids whose processed captions match all the query terms,
+        optionally among the given uuids, in the order of the store.
+        Returns the number of matches and the page of matching uuids.
+
+        Raises
+        ------
+        ValueError
+            If the query has no terms.
+        """
+
+        terms = parse_query(query)
+        if not terms:
+            raise ValueError("The query must contain a term")
+        with self._lock:
+            # Intersect starting from the rarest term.
+            matches = sorted(
+                (self._match(term, is_prefix) for term, is_prefix in terms), key=len
+            )
+            docs = set(matches[0]).intersection(*matches[1:])
+            if uuids is not None:
+                docs.intersection_update(
+                    self._uuid2doc[d] for d in uuids if d in self._uuid2doc
+                )
+            found = [self._doc2uuid[d] for d in sorted(docs)]
+        found = [d for d in found if d is not None]
+        return len(found), found[offset : offset + limit]
+
+
+@cache
+def get_caption_index(caption_path: str) -> CaptionIndex:
+    """Get the index of a caption store; the index is cached."""
+
+    return CaptionIndex(caption_path)
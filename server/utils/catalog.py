@@ -0,0 +1,70 @@
+"""
+This module provides lookups of the visualizations catalog by uuid,
+from the SQLite index built by packages/shared/assets/download.py,
+such that the apps fetch the records of the visible images only
+instead of parsing the whole catalog.
+"""
+
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+from .metrics import timed
+
+# Environment variable holding the path of the catalog index.
+CATALOG_PATH_ENV = "CATALOG_PATH"
+
+# Uuids per query, below the limit on the parameters of a SQLite statement.
+_BATCH = 500
+
+
+class Catalog:
+    """
+    Read-only lookups in a catalog index. Safe to use from multiple threads:
+    each thread has its own connection, reopened once the index is replaced.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        stat = os.stat(self.path)
+        file_id = (stat.st_dev, stat.st_ino)
+        local = self._local
+        if getattr(local, "file_id", None) != file_id:
+            if getattr(local, "connection", None) is not None:
+                local.connection.close()
+            uri = Path(self.path).resolve().as_uri() + "?mode=ro"
+            local.connection = sqlite3.connect(uri, uri=True)
+            local.file_id = file_id
+        return local.connection
+
+    def lookup(self, uuids: list[str]) -> list[str | None]:
+        """
+        Get the records of the uuids, in their order, as JSON text,
+        such that they are sent without being parsed.
+        Unknown uuids get None.
+
+        Raises
+        ------
+        FileNotFoundError
+            If the index does not exist.
+        """
+
+        connection = self._connect()
+        found: dict[str, str] = {}
+        with timed("lookup_catalog"):
+            unique = list(dict.fromkeys(uuids))
+            for start in range(0, len(unique), _BATCH):
+                batch = unique[start : start + _BATCH]
+                placeholders = ",".join("?" * len(batch))
+                found.update(
+                    connection.execute(
+                        "SELECT uuid, record FROM visualizations"
+                        f" WHERE uuid IN ({placeholders})",
+                        batch,
+                    )
+                )
+        return [found.get(uuid) for uuid in uuids]
@@ -2,16 +2,153 @@
 This module provides functions to cluster embeddings.
 """
 
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
 import numpy as np
-from sklearn.cluster import KMeans
+
+from .metrics import timed
+
+# sklearn is imported on first use to keep the server start fast.
+
+# Defaults of the automatic choice of the number of clusters.
+MIN_AUTO_CLUSTERS = 2
+MAX_AUTO_CLUSTERS = 30
+
+# Seconds for choosing the number of clusters and fitting it,
+# of which up to SCORING_SHARE for scoring the candidates.
+AUTO_TIME_BUDGET = 10.0
+MAX_TIME_BUDGET = 60.0
+SCORING_SHARE = 0.5
+
+# Points clustered and scored per candidate number of clusters.
+SAMPLE_SIZE = 2000
+
+# Candidate numbers of clusters scored at most, spread geometrically over the range.
+MAX_CANDIDATES = 12
 
 
 def clustering(embeddings: np.ndarray, n_clusters: int) -> np.ndarray:
+    from sklearn.cluster import KMeans
+
     model = KMeans(n_clusters=n_clusters, n_init="auto", random_state=0)
-    model.fit(embeddings)
+    with timed("kmeans"):
+        model.fit(embeddings)
     return model.labels_
 
 
+def _candidates(min_clusters: int, max_clusters: int) -> list[int]:
+    if max_clusters - min_clusters < MAX_CANDIDATES:
+        return list(range(min_clusters, max_clusters + 1))
+    spread = np.geomspace(min_clusters, max_clusters, num=MAX_CANDIDATES)
+    return sorted(set(np.round(spread).astype(int).tolist()))
+
+
+def check_auto_params(min_clusters: int, max_clusters: int, time_budget: float) -> None:
+    """
+    Raises
+    ------
+    ValueError
+        If the range or the time budget of auto_clustering is invalid.
+    """
+
+    if not MIN_AUTO_CLUSTERS <= min_clusters <= max_clusters:
+        raise ValueError(
+            f"minClusters must be at least {MIN_AUTO_CLUSTERS}"
+            " and at most maxClusters"
+        )
+    if not 0 < time_budget <= MAX_TIME_BUDGET:
+        raise ValueError(f"timeBudget must be in (0, {MAX_TIME_BUDGET:g}] seconds")
+
+
+def auto_clustering(
+    embeddings: np.ndarray,
+    min_clusters: int = MIN_AUTO_CLUSTERS,
+    max_clusters: int = MAX_AUTO_CLUSTERS,
+    time_budget: float = AUTO_TIME_BUDGET,
+) -> np.ndarray:
+    """
+    Cluster the embeddings into the number of clusters in a range
+    with the best silhouette score.
+
+    The candidate numbers are scored in parallel on a sample of the embeddings,
+    and the best one is then fitted on all of them.
+    Candidates not scored within their share of the time budget are dropped.
+    If the full fit is not expected to finish within the rest of the budget,
+    MiniBatchKMeans fits it instead of KMeans.
+
+    Parameters
+    ----------
+    embeddings : np.ndarray
+        The embeddings, of shape (n, dim).
+    min_clusters, max_clusters : int
+        The range of the number of clusters, with 2 <= min_clusters <= max_clusters.
+        The range is capped below the number of points, as the silhouette score
+        requires a point per cluster to spare; without any candidate left,
+        all the points are in one cluster.
+    time_budget : float
+        Seconds for choosing and fitting the number of clusters.
+
+    Returns
+    -------
+    np.ndarray
+        The cluster label of each embedding.
+    """
+
+    from sklearn.cluster import KMeans, MiniBatchKMeans
+    from sklearn.metrics import silhouette_score
+
+    deadline = time.perf_counter() + time_budget
+    n = len(embeddings)
+    if n > SAMPLE_SIZE:
+        rng = np.random.default_rng(0)
+        sample = embeddings[np.sort(rng.choice(n, SAMPLE_SIZE, replace=False))]
+    else:
+        sample = embeddings
+    max_clusters = min(max_clusters, len(sample) - 1)
+    if max_clusters < min_clusters:
+        return np.zeros(n, dtype=np.int32)
+
+    def score(k: int) -> tuple[float, float, np.ndarray]:
+        start = time.perf_counter()
+        labels = KMeans(n_clusters=k, n_init=1, random_state=0).fit(sample).labels_
+        elapsed = time.perf_counter() - start
+        if len(np.unique(labels)) < 2:
+            return -1.0, elapsed, labels
+        return silhouette_score(sample, labels), elapsed, labels
+
+    candidates = _candidates(min_clusters, max_clusters)
+    # KMeans and the silhouette score run in compiled code releasing the GIL.
+    executor = ThreadPoolExecutor(max_workers=min(len(candidates), os.cpu_count() or 1))
+    with timed("auto_clustering_scoring"):
+        futures = {executor.submit(score, k): k for k in candidates}
+        done, _ = wait(futures, timeout=time_budget * SCORING_SHARE)
+    # The candidates still being scored finish in the background, on the sample.
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    scores = {futures[d]: d.result() for d in done}
+    if scores:
+        # The smallest number of clusters among the best scores.
+        n_clusters = max(scores, key=lambda k: (scores[k][0], -k))
+        _, fit_seconds, sample_labels = scores[n_clusters]
+        if sample is embeddings:
+            return sample_labels
+    else:
+        n_clusters = int(np.clip(np.sqrt(n), min_clusters, max_clusters))
+        fit_seconds = float("inf")
+
+    # KMeans iterations are linear in the number of points.
+    expected_seconds = fit_seconds * n / len(sample)
+    if expected_seconds <= deadline - time.perf_counter():
+        with timed("kmeans"):
+            model = KMeans(n_clusters=n_clusters, n_init="auto", random_state=0)
+            return model.fit(embeddings).labels_
+    with timed("minibatch_kmeans"):
+        model = MiniBatchKMeans(n_clusters=n_clusters, n_init="auto", random_state=0)
+        return model.fit(embeddings).labels_
+
+
 def find_center_uuid(embeddings: np.ndarray, uuids: list[str]) -> str | None:
     """
     Get the uuid of the data point closest to the center of the embeddings.
@@ -21,6 +158,7 @@ def find_center_uuid(embeddings: np.ndarray, uuids: list[str]) -> str | None:
     if len(uuids) == 0:
         return None
 
-    center = np.mean(embeddings, axis=0)
-    index = np.argmin(np.linalg.norm(embeddings - center, axis=1))
+    with timed("find_center"):
+        center = np.mean(embeddings, axis=0)
+        index = np.argmin(np.linalg.norm(embeddings - center, axis=1))
     return uuids[index]
@@ -0,0 +1,280 @@
+"""
+This module provides collections: static trees (images, thumbnails, embeddings,
+captions) served side by side by one server. The resources of a collection
+are loaded on first use, and the least recently used collections are unloaded
+when the estimated memory of the loaded resources exceeds a budget.
+"""
+
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from pathlib import Path
+from typing import TypeVar
+
+import numpy as np
+
+from .caption_index import CaptionIndex
+from .loaders import (
+    EmbeddingStore,
+    Uuid2Caption,
+    build_uuid2filename,
+    load_embedding_store,
+    load_uuid2caption,
+)
+from .near_duplicates import load_uuid2phash, simhash
+
+# Environment variable holding the directory with a subdirectory per collection.
+COLLECTIONS_DIR_ENV = "COLLECTIONS_DIR"
+
+# Environment variable holding the memory budget of the collections in bytes.
+MEMORY_BUDGET_ENV = "COLLECTION_MEMORY_BYTES"
+DEFAULT_MEMORY_BUDGET = 4 << 30
+
+_NAME = re.compile(r"[A-Za-z0-9][A-Za-z0-9_.-]*")
+
+T = TypeVar("T")
+
+
+def estimate_size(obj: object) -> int:
+    """
+    Estimate the bytes of memory held by an object and the objects it references.
+    Memory-mapped arrays count as 0, as their pages belong to the page cache.
+    """
+
+    seen: set[int] = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        d = stack.pop()
+        if id(d) in seen:
+            continue
+        seen.add(id(d))
+        if isinstance(d, np.ndarray):
+            total += 0 if isinstance(d, np.memmap) else d.nbytes
+            continue
+        total += sys.getsizeof(d)
+        if isinstance(d, dict):
+            stack.extend(d.keys())
+            stack.extend(d.values())
+        elif isinstance(d, (list, tuple, set, frozenset)):
+            stack.extend(d)
+        elif hasattr(d, "__dict__") and not isinstance(d, type):
+            stack.append(vars(d))
+    return total
+
+
+def _build_caption_index(caption_path: str) -> CaptionIndex:
+    # Built when loaded, such that its estimated size covers the index.
+    index = CaptionIndex(caption_path)
+    index.update()
+    return index
+
+
+class Collection:
+    """
+    The resources of a static tree, each loaded on first use.
+    The loaded resources are held until the collection is unloaded.
+    """
+
+    def __init__(self, name: str, static_dir: Path):
+        self.name = name
+        self._static_dir = static_dir
+        # Called with the collection after each load, e.g., to enforce a budget.
+        self.on_load: Callable[["Collection"], None] | None = None
+        # Loaded resources and their estimated sizes by name.
+        self._resources: dict[str, tuple[object, int]] = {}
+        self._lock = threading.Lock()
+        # Serializes the loads such that each resource is loaded once.
+        self._load_lock = threading.Lock()
+
+    @property
+    def static_dir(self) -> Path:
+        return self._static_dir
+
+    @property
+    def image_dir(self) -> Path:
+        return self.static_dir / "images"
+
+    @property
+    def thumbnail_dir(self) -> Path:
+        return self.static_dir / "thumbnails"
+
+    @property
+    def embedding_path(self) -> str:
+        return str(self.static_dir / "embeddings.jsonl")
+
+    @property
+    def caption_path(self) -> str:
+        return str(self.static_dir / "captions.jsonl")
+
+    @property
+    def phash_path(self) -> str:
+        return str(self.static_dir / "phashes.jsonl")
+
+    def _get(self, key: str, load: Callable[[], T]) -> T:
+        with self._lock:
+            loaded = self._resources.get(key)
+        if loaded is not None:
+            return loaded[0]
+        with self._load_lock:
+            with self._lock:
+                loaded = self._resources.get(key)
+            if loaded is not None:
+                return loaded[0]
+            value = load()
+            size = estimate_size(value)
+            with self._lock:
+                self._resources[key] = (value, size)
+        if self.on_load is not None:
+            self.on_load(self)
+        return value
+
+    def is_loaded(self, key: str) -> bool:
+        with self._lock:
+            return key in self._resources
+
+    def uuid2filename(self) -> dict[str, str]:
+        return self._get("uuid2filename", lambda: build_uuid2filename(self.image_dir))
+
+    def _drop(self, key: str) -> None:
+        with self._lock:
+            self._resources.pop(key, None)
+
+    def embedding_store(self) -> EmbeddingStore:
+        """The embedding store, following the embeddings appended to the file."""
+
+        # Bypass the cache shared by the paths, as the collection holds the store.
+        def load() -> EmbeddingStore:
+            return load_embedding_store.__wrapped__(self.embedding_path, 20)
+
+        store = self._get("embedding_store", load)
+        if not store.refresh():
+            # The file was replaced: the projection is refitted.
+            self._drop("embedding_store")
+            self._drop("simhashes")
+            store = self._get("embedding_store", load)
+        return store
+
+    def uuid2caption(self) -> Uuid2Caption:
+        return self._get(
+            "uuid2caption", lambda: load_uuid2caption.__wrapped__(self.caption_path)
+        )
+
+    def caption_index(self) -> CaptionIndex:
+        return self._get(
+            "caption_index", lambda: _build_caption_index(self.caption_path)
+        )
+
+    def uuid2phash(self) -> dict[str, int]:
+        return self._get(
+            "uuid2phash", lambda: load_uuid2phash.__wrapped__(self.phash_path)
+        )
+
+    def simhashes(self) -> np.ndarray:
+        # The store is got first, as the loads hold the non-reentrant load lock.
+        store = self.embedding_store()
+        return self._get("simhashes", lambda: simhash(store.matrix))
+
+    def memory(self) -> dict[str, int]:
+        """The estimated bytes of each loaded resource."""
+
+        with self._lock:
+            return {k: size for k, (_, size) in self._resources.items()}
+
+    def unload(self) -> None:
+        """Drop the loaded resources; requests still using them keep them alive."""
+
+        with self._lock:
+            self._resources.clear()
+
+
+class CollectionRegistry:
+    """
+    The collections in the subdirectories of a directory, by name.
+    The least recently used collections are unloaded
+    when the loaded resources exceed the memory budget.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        max_bytes: int | None = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.root = root
+        if max_bytes is None:
+            max_bytes = int(os.environ.get(MEMORY_BUDGET_ENV, DEFAULT_MEMORY_BUDGET))
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self._lock = threading.Lock()
+        # Least recently used first.
+        self._collections: OrderedDict[str, Collection] = OrderedDict()
+        self._last_used: dict[str, float] = {}
+
+    def get(self, name: str) -> Collection | None:
+        """Get a collection, or None if there is no such collection."""
+
+        if _NAME.fullmatch(name) is None:
+            return None
+        static_dir = self.root / name
+        if not static_dir.is_dir():
+            with self._lock:
+                collection = self._collections.pop(name, None)
+            if collection is not None:
+                collection.unload()
+            return None
+        with self._lock:
+            collection = self._collections.get(name)
+            if collection is None:
+                collection = Collection(name, static_dir)
+                collection.on_load = self._enforce_budget
+                self._collections[name] = collection
+            self._collections.move_to_end(name)
+            self._last_used[name] = self.clock()
+            return collection
+
+    def _enforce_budget(self, loaded: Collection) -> None:
+        """Unload the least recently used collections other than the one loaded."""
+
+        with self._lock:
+            collections = list(self._collections.values())
+        total = sum(sum(d.memory().values()) for d in collections)
+        for collection in collections:
+            if total <= self.max_bytes:
+                break
+            if collection is loaded:
+                continue
+            total -= sum(collection.memory().values())
+            collection.unload()
+
+    def names(self) -> list[str]:
+        if not self.root.is_dir():
+            return []
+        return sorted(
+            d.name
+            for d in self.root.iterdir()
+            if d.is_dir() and _NAME.fullmatch(d.name) is not None
+        )
+
+    def usage(self) -> list[dict]:
+        """The memory of the resources loaded by each collection."""
+
+        with self._lock:
+            loaded = dict(self._collections)
+            last_used = dict(self._last_used)
+        usage = []
+        for name in self.names():
+            resources = loaded[name].memory() if name in loaded else {}
+            usage.append(
+                {
+                    "name": name,
+                    "memoryBytes": sum(resources.values()),
+                    "resources": resources,
+                    "lastUsed": last_used.get(name),
+                }
+            )
+        return usage
@@ -0,0 +1,121 @@
+"""
+This module provides the client of the compute workers (see worker.py):
+the API server sends the clustering and grid layout jobs to a separate tier,
+such that heavy jobs do not compete with image serving.
+Jobs on the same embedding store go to the same worker, which keeps it warm.
+"""
+
+import hashlib
+
+import numpy as np
+
+from .metrics import timed
+from .responses import BINARY_MEDIA_TYPE, SHAPE_HEADER
+
+# Environment variable holding the comma-separated base URLs of the workers.
+COMPUTE_WORKERS_ENV = "COMPUTE_WORKERS"
+
+# Seconds to wait for a worker to connect and to compute a job.
+CONNECT_TIMEOUT = 2.0
+JOB_TIMEOUT = 300.0
+
+
+class WorkerError(Exception):
+    """A job rejected by a worker, e.g., for an unknown uuid."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class WorkersUnavailable(Exception):
+    """No worker could be reached."""
+
+
+def decode_array(content: bytes, shape: str) -> np.ndarray:
+    """Decode little-endian int32 values with the shape of the X-Array-Shape header."""
+
+    dims = tuple(int(d) for d in shape.split(",")) if shape else ()
+    return np.frombuffer(content, dtype="<i4").reshape(dims)
+
+
+class WorkerPool:
+    """
+    The compute workers, by base URL.
+
+    Jobs are routed by rendezvous hashing of their key
+    (the collection and version of the embedding store):
+    each key has a preferred worker, and the keys of a worker that cannot be
+    reached move to the next worker in their order, leaving the other keys
+    on their workers. Adding a worker moves only the keys it becomes preferred for.
+    """
+
+    def __init__(self, urls: list[str], transport=None):
+        if not urls:
+            raise ValueError("A worker pool requires at least one worker")
+        self.urls = [d.rstrip("/") for d in urls]
+        # For tests, an httpx transport standing in for the network.
+        self.transport = transport
+
+    @classmethod
+    def from_env(cls, value: str | None) -> "WorkerPool | None":
+        """The pool of the comma-separated URLs, or None if there are none."""
+
+        urls = [d.strip() for d in (value or "").split(",") if d.strip()]
+        return cls(urls) if urls else None
+
+    def route(self, key: str) -> list[str]:
+        """The workers in the order they are tried for a key."""
+
+        def weight(url: str) -> bytes:
+            return hashlib.blake2b(f"{url}|{key}".encode(), digest_size=8).digest()
+
+        return sorted(self.urls, key=weight, reverse=True)
+
+    async def run(self, function: str, key: str, payload: dict) -> np.ndarray:
+        """
+        Run a job on the worker of its key.
+
+        Raises
+        ------
+        WorkerError
+            If the worker rejected the job.
+        WorkersUnavailable
+            If no worker could be reached, or the worker timed out on the job.
+        """
+
+        # Deferred, as most servers run without workers.
+        import httpx
+
+        timeout = httpx.Timeout(JOB_TIMEOUT, connect=CONNECT_TIMEOUT)
+        headers = {"Accept": BINARY_MEDIA_TYPE}
+        async with httpx.AsyncClient(
+            timeout=timeout, transport=self.transport
+        ) as client:
+            for url in self.route(key):
+                try:
+                    with timed(f"remote_{function}"):
+                        response = await client.post(
+                            f"{url}/compute/{function}", json=payload, headers=headers
+                        )
+                except (httpx.ConnectError, httpx.ConnectTimeout):
+                    continue
+                except httpx.TimeoutException as exc:
+                    # Not retried, as the job would time out on the next worker too.
+                    raise WorkersUnavailable(
+                        f"The compute worker timed out on {function}"
+                    ) from exc
+                except httpx.TransportError:
+                    # E.g., the worker closed the connection as it went down.
+                    continue
+                if response.status_code != 200:
+                    try:
+                        detail = response.json()["detail"]
+                    except (ValueError, KeyError, TypeError):
+                        detail = response.text
+                    raise WorkerError(response.status_code, str(detail))
+                return decode_array(
+                    response.content, response.headers.get(SHAPE_HEADER, "")
+                )
+        raise WorkersUnavailable(f"No compute worker reachable for {function}")
@@ -0,0 +1,216 @@
+"""
+This module provides resized variants (derivatives) of the images,
+rendered in a process pool on first request and kept in a size-bounded
+LRU cache on disk. Concurrent requests for the same variant share one render.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import tempfile
+from collections import OrderedDict
+from collections.abc import Callable
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import NamedTuple
+
+from PIL import Image
+
+from .metrics import timed
+
+# Suppress PIL.Image.DecompressionBombError for large images.
+Image.MAX_IMAGE_PIXELS = 5e8
+
+# Largest width or height of a derivative.
+MAX_DIMENSION = 4096
+
+# Environment variable holding the size budget of the cache in bytes.
+CACHE_BYTES_ENV = "DERIVATIVE_CACHE_BYTES"
+DEFAULT_CACHE_BYTES = 1 << 30
+
+# Environment variable holding the number of server workers sharing the cache,
+# each of which keeps its share of the budget.
+SERVER_WORKERS_ENV = "SERVER_WORKERS"
+
+# Environment variable holding the number of render processes.
+WORKERS_ENV = "DERIVATIVE_WORKERS"
+
+
+class DerivativeFormat(NamedTuple):
+    # The format name of PIL.
+    pil_format: str
+    media_type: str
+    suffix: str
+
+
+FORMATS = {
+    "jpeg": DerivativeFormat("JPEG", "image/jpeg", ".jpg"),
+    "png": DerivativeFormat("PNG", "image/png", ".png"),
+    "webp": DerivativeFormat("WEBP", "image/webp", ".webp"),
+}
+
+
+def render_derivative(
+    source: str, dest: str, w: int | None, h: int | None, pil_format: str
+) -> None:
+    """
+    Resize the image to fit within w * h (without upscaling) and save it.
+    A missing w or h leaves that dimension unbounded.
+    Runs in a render process.
+    """
+
+    with Image.open(source) as image:
+        w_limit = w or image.width
+        h_limit = h or image.height
+        # Decode JPEGs at a reduced scale close to the target size.
+        image.draft("RGB", (w_limit, h_limit))
+        image.thumbnail((w_limit, h_limit), Image.LANCZOS, reducing_gap=3.0)
+        if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        # A unique name, as the server workers may render the same derivative.
+        fd, tmp_path = tempfile.mkstemp(
+            suffix=".partial", dir=os.path.dirname(dest) or "."
+        )
+        os.close(fd)
+        try:
+            image.save(tmp_path, format=pil_format)
+            os.replace(tmp_path, dest)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+
+def _make_executor() -> Executor:
+    workers = int(os.environ.get(WORKERS_ENV, min(4, os.cpu_count() or 1)))
+    # Spawned rather than forked, as the server process runs threads.
+    context = multiprocessing.get_context("spawn")
+    return ProcessPoolExecutor(max_workers=max(1, workers), mp_context=context)
+
+
+class DerivativeCache:
+    """
+    Derivatives on disk, evicted least recently used first
+    once their total size exceeds the budget.
+    Meant to be used from the event loop only.
+
+    Each server worker evicts among the derivatives it knows of (those on disk
+    when it indexed the directory and those it rendered), so the default budget
+    is split among the SERVER_WORKERS workers, such that the directory stays
+    within DERIVATIVE_CACHE_BYTES in total.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        max_bytes: int | None = None,
+        make_executor: Callable[[], Executor] = _make_executor,
+    ):
+        self.directory = directory
+        if max_bytes is None:
+            max_bytes = int(os.environ.get(CACHE_BYTES_ENV, DEFAULT_CACHE_BYTES))
+            max_bytes //= max(1, int(os.environ.get(SERVER_WORKERS_ENV) or 1))
+        self.max_bytes = max_bytes
+        self._make_executor = make_executor
+        self._executor: Executor | None = None
+        # Sizes of the cached derivatives by filename, least recently used first.
+        self._entries: OrderedDict[str, int] | None = None
+        self._total = 0
+        self._pending: dict[str, asyncio.Future] = {}
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total
+
+    def _load_entries(self) -> OrderedDict[str, int]:
+        """Index the derivatives left by a previous run, oldest first."""
+
+        if self._entries is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            files = [
+                (d.stat().st_mtime_ns, d.name, d.stat().st_size)
+                for d in self.directory.iterdir()
+                if d.is_file() and not d.name.endswith(".partial")
+            ]
+            self._entries = OrderedDict((name, size) for _, name, size in sorted(files))
+            self._total = sum(self._entries.values())
+        return self._entries
+
+    def _add(self, name: str) -> None:
+        entries = self._load_entries()
+        size = (self.directory / name).stat().st_size
+        self._total += size - entries.pop(name, 0)
+        entries[name] = size
+        # Never evict the derivative just added.
+        while self._total > self.max_bytes and len(entries) > 1:
+            evicted, evicted_size = entries.popitem(last=False)
+            self._total -= evicted_size
+            try:
+                os.remove(self.directory / evicted)
+            except FileNotFoundError:
+                pass
+
+    async def get(
+        self,
+        source: Path,
+        name: str,
+        w: int | None,
+        h: int | None,
+        fmt: DerivativeFormat,
+    ) -> Path:
+        """
+        Get the path of a derivative, rendering it if it is not cached.
+        The name must identify the source version and the parameters.
+        """
+
+        entries = self._load_entries()
+        path = self.directory / name
+        # Another server worker sharing the directory may have evicted it.
+        if name in entries and path.is_file():
+            entries.move_to_end(name)
+            return path
+
+        pending = self._pending.get(name)
+        if pending is not None:
+            # Shielded such that a cancelled request does not cancel the others.
+            await asyncio.shield(pending)
+            return path
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[name] = future
+        try:
+            if self._executor is None:
+                self._executor = self._make_executor()
+            executor = self._executor
+            try:
+                with timed("render_derivative"):
+                    await asyncio.get_running_loop().run_in_executor(
+                        executor,
+                        render_derivative,
+                        str(source),
+                        str(path),
+                        w,
+                        h,
+                        fmt.pil_format,
+                    )
+            except BrokenProcessPool:
+                # E.g., a render process was killed: the next render starts
+                # a new pool, unless another render already did.
+                if self._executor is executor:
+                    self.shutdown()
+                raise
+            self._add(name)
+            future.set_result(None)
+        except BaseException as exc:
+            future.set_exception(exc)
+            # Retrieved, such that asyncio does not warn without waiters.
+            future.exception()
+            raise
+        finally:
+            del self._pending[name]
+        return path
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
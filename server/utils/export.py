@@ -0,0 +1,219 @@
+"""
+This module provides the bulk export of a collection: the uuid, caption,
+and projected embedding of each row of its embedding store,
+streamed as NDJSON, Arrow, or Parquet.
+The rows are read from the loaded stores and encoded chunk by chunk,
+such that the memory of an export is bounded by the chunk size.
+"""
+
+import io
+from collections.abc import Iterator
+from typing import NamedTuple
+
+import numpy as np
+import orjson
+
+from .captioning import process_caption
+from .loaders import EmbeddingStore
+from .metrics import timed
+
+# Media type by export format.
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# Fields exported besides the row and the uuid.
+EXPORT_FIELDS = ("caption", "embedding")
+
+# Rows read and encoded at once.
+CHUNK_ROWS = 1024
+
+# Response header holding the cursor of the rows left out by the limit, if any.
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class Chunk(NamedTuple):
+    rows: np.ndarray
+    uuids: list[str]
+    # None for the fields not exported.
+    captions: list[str | None] | None
+    embeddings: np.ndarray | None
+
+
+def require_pyarrow():
+    """
+    Import pyarrow, an optional dependency of the Arrow and Parquet exports.
+
+    Raises
+    ------
+    ImportError
+        If pyarrow is not installed.
+    """
+
+    import pyarrow
+
+    return pyarrow
+
+
+def select_rows(
+    store: EmbeddingStore,
+    indices: np.ndarray | None,
+    cursor: int,
+    limit: int | None,
+) -> tuple[np.ndarray, int | None]:
+    """
+    Get the rows to export in store order, from the cursor on, and the cursor
+    to resume from if the limit left rows out (else None).
+
+    Rows keep their index as embeddings are appended,
+    such that a cursor stays valid while the store grows.
+
+    Parameters
+    ----------
+    store : EmbeddingStore
+        The embedding store of the collection.
+    indices : np.ndarray | None
+        The rows of the uuids to export, or None to export all the rows.
+    cursor : int
+        The first row to export, e.g., the last row received plus one.
+    limit : int | None
+        The maximum number of rows to export.
+    """
+
+    if indices is None:
+        rows = np.arange(cursor, len(store.uuids), dtype=np.intp)
+    else:
+        rows = np.unique(indices)
+        rows = rows[rows >= cursor]
+    if limit is not None and len(rows) > limit:
+        return rows[:limit], int(rows[limit - 1]) + 1
+    return rows, None
+
+
+def iter_chunks(
+    store: EmbeddingStore,
+    rows: np.ndarray,
+    uuid2caption: dict[str, str | None] | None,
+    embeddings: bool,
+) -> Iterator[Chunk]:
+    """Read the rows in chunks, with the captions if uuid2caption is given."""
+
+    for start in range(0, len(rows), CHUNK_ROWS):
+        with timed("export_chunk"):
+            chunk = rows[start : start + CHUNK_ROWS]
+            uuids = [store.uuids[d] for d in chunk]
+            captions = None
+            if uuid2caption is not None:
+                captions = [uuid2caption.get(d) for d in uuids]
+                captions = [None if d is None else process_caption(d) for d in captions]
+            matrix = None
+            if embeddings:
+                matrix = store.take(chunk).astype(np.float32)
+        yield Chunk(chunk, uuids, captions, matrix)
+
+
+def encode_ndjson(chunks: Iterator[Chunk]) -> Iterator[bytes]:
+    """Encode a JSON object per row, with the fields exported."""
+
+    for chunk in chunks:
+        lines = []
+        for i, (row, uuid) in enumerate(zip(chunk.rows.tolist(), chunk.uuids)):
+            record = {"row": row, "uuid": uuid}
+            if chunk.captions is not None:
+                record["caption"] = chunk.captions[i]
+            if chunk.embeddings is not None:
+                record["embedding"] = chunk.embeddings[i]
+            lines.append(orjson.dumps(record, option=orjson.OPT_SERIALIZE_NUMPY))
+        yield b"\n".join(lines) + b"\n"
+
+
+def _schema(pa, captions: bool, dim: int | None):
+    fields = [pa.field("row", pa.int64()), pa.field("uuid", pa.string())]
+    if captions:
+        fields.append(pa.field("caption", pa.string()))
+    if dim is not None:
+        fields.append(pa.field("embedding", pa.list_(pa.float32(), dim)))
+    return pa.schema(fields)
+
+
+def _record_batch(pa, schema, chunk: Chunk):
+    columns = [pa.array(chunk.rows, pa.int64()), pa.array(chunk.uuids, pa.string())]
+    if chunk.captions is not None:
+        columns.append(pa.array(chunk.captions, pa.string()))
+    if chunk.embeddings is not None:
+        dim = chunk.embeddings.shape[1]
+        values = pa.array(chunk.embeddings.reshape(-1), pa.float32())
+        columns.append(pa.FixedSizeListArray.from_arrays(values, dim))
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+class _Sink(io.RawIOBase):
+    """
+    A write-only stream handing over the bytes written so far,
+    while telling the position in the whole stream,
+    which the Parquet footer records the offsets of the row groups by.
+    """
+
+    def __init__(self):
+        self._parts: list[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def take(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def _encode_batches(
+    chunks: Iterator[Chunk], captions: bool, dim: int | None, parquet: bool
+) -> Iterator[bytes]:
+    pa = require_pyarrow()
+    schema = _schema(pa, captions, dim)
+    # The encoded bytes are taken from the sink after each chunk.
+    sink = _Sink()
+    if parquet:
+        import pyarrow.parquet as pq
+
+        writer = pq.ParquetWriter(sink, schema)
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+    with writer:
+        for chunk in chunks:
+            batch = _record_batch(pa, schema, chunk)
+            if parquet:
+                # A row group per chunk.
+                writer.write_batch(batch, row_group_size=len(chunk.rows))
+            else:
+                writer.write_batch(batch)
+            yield sink.take()
+    yield sink.take()
+
+
+def encode_arrow(
+    chunks: Iterator[Chunk], captions: bool, dim: int | None
+) -> Iterator[bytes]:
+    """Encode the rows as an Arrow IPC stream, a record batch per chunk."""
+
+    return _encode_batches(chunks, captions, dim, parquet=False)
+
+
+def encode_parquet(
+    chunks: Iterator[Chunk], captions: bool, dim: int | None
+) -> Iterator[bytes]:
+    """Encode the rows as a Parquet file, a row group per chunk."""
+
+    return _encode_batches(chunks, captions, dim, parquet=True)
@@ -0,0 +1,123 @@
+"""
+This module provides HTTP conditional caching: validators (ETag, Last-Modified)
+from a stat of the served files, and 304 responses to requests whose
+validators match, which are answered without reading the files.
+"""
+
+import hashlib
+import os
+import stat
+from email.utils import formatdate, parsedate_to_datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import NamedTuple
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+
+# Thumbnails may be regenerated (e.g., at another size), hence revalidated daily.
+REVALIDATE_DAILY = "public, max-age=86400"
+
+# Images may be rewritten in place (e.g., re-ingested) and captions change
+# when the caption store is appended to or regenerated; always revalidate.
+REVALIDATE = "no-cache"
+
+# Number of file versions whose validators are kept in memory.
+MAX_CACHED_STATS = 1 << 16
+
+
+class FileValidators(NamedTuple):
+    etag: str
+    last_modified: str
+    # Whole seconds, as Last-Modified has a resolution of one second.
+    mtime: int
+    stat_result: os.stat_result
+
+
+def make_etag(*parts: object) -> str:
+    """A strong ETag from the parts identifying a representation."""
+
+    digest = hashlib.blake2b("-".join(map(str, parts)).encode(), digest_size=8)
+    return f'"{digest.hexdigest()}"'
+
+
+@lru_cache(maxsize=MAX_CACHED_STATS)
+def get_version_validators(size: int, mtime_ns: int) -> tuple[str, str]:
+    """Get the ETag and Last-Modified of a file version, cached by version."""
+
+    last_modified = formatdate(mtime_ns / 1e9, usegmt=True)
+    return make_etag(size, mtime_ns), last_modified
+
+
+def get_file_validators(path: str) -> FileValidators:
+    """
+    Get the validators of a file from its size and mtime.
+    The file is stat'ed on every call, such that files rewritten in place
+    (e.g., regenerated thumbnails) are served with their current size;
+    only the validators derived from the stat are cached.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the path is not a regular file.
+    """
+
+    stat_result = os.stat(path)
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise FileNotFoundError(path)
+    etag, last_modified = get_version_validators(
+        stat_result.st_size, stat_result.st_mtime_ns
+    )
+    return FileValidators(
+        etag=etag,
+        last_modified=last_modified,
+        mtime=int(stat_result.st_mtime),
+        stat_result=stat_result,
+    )
+
+
+def _matches_etag(header: str, etag: str) -> bool:
+    # If-None-Match uses the weak comparison.
+    if header.strip() == "*":
+        return True
+    tags = [d.strip().removeprefix("W/") for d in header.split(",")]
+    return etag.removeprefix("W/") in tags
+
+
+def is_not_modified(request: Request, etag: str, mtime: int | None = None) -> bool:
+    """
+    Check the conditional headers of a GET request against the validators.
+    If-None-Match takes precedence over If-Modified-Since (RFC 9110).
+    """
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _matches_etag(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None or mtime is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    return mtime <= since.timestamp()
+
+
+def not_modified_response(headers: dict[str, str]) -> Response:
+    return Response(status_code=304, headers=headers)
+
+
+def cached_file_response(
+    request: Request, path: Path, validators: FileValidators, cache_control: str
+) -> Response:
+    """Respond with the file, or 304 if the client's copy is current."""
+
+    headers = {
+        "ETag": validators.etag,
+        "Last-Modified": validators.last_modified,
+        "Cache-Control": cache_control,
+    }
+    if is_not_modified(request, validators.etag, validators.mtime):
+        return not_modified_response(headers)
+    # With the fresh stat, FileResponse does not stat the file again.
+    return FileResponse(path, headers=headers, stat_result=validators.stat_result)
@@ -0,0 +1,290 @@
+"""
+This module provides the ingestion of new images without restarting the server.
+The images are queued for thumbnailing, embedding and captioning
+in a background thread. Each stage appends its results to the files
+of the collection, as the scripts in scripts/ do, and the loaded indexes
+(filename index, embedding store, captions) follow the appended lines in place.
+"""
+
+import hmac
+import importlib
+import json
+import logging
+import os
+import queue
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+from pathlib import Path
+
+from PIL import Image
+
+from . import manifest
+from .collection import Collection
+from .derivatives import render_derivative
+from .metrics import timed
+
+# Environment variables holding the stage functions as "module:function",
+# e.g., "cache_embeddings:embed_files" with scripts/ on the Python path.
+INGEST_EMBEDDER_ENV = "INGEST_EMBEDDER"
+INGEST_CAPTIONER_ENV = "INGEST_CAPTIONER"
+
+# Environment variable holding the token required in the X-Ingest-Token header.
+# Ingestion is disabled if it is not set.
+INGEST_TOKEN_ENV = "INGEST_TOKEN"
+INGEST_TOKEN_HEADER = "X-Ingest-Token"
+
+# The bounds of the thumbnails, as of scripts/cache_thumbnails.py.
+THUMBNAIL_SIZE = 100
+
+# The size in bytes above which an uploaded image is rejected.
+MAX_UPLOAD_BYTES = 64 * 2**20
+
+# Number of images passed to a stage function at once.
+BATCH_SIZE = 16
+
+# Number of statuses kept; the oldest are forgotten.
+MAX_STATUSES = 10000
+
+STAGES = ("thumbnail", "embedding", "caption")
+
+logger = logging.getLogger(__name__)
+
+# A stage function maps image paths to a result per path, None if it failed.
+StageFunction = Callable[[list[str]], list]
+
+
+def is_ingest_authorized(token: str | None) -> bool:
+    """Check an ingest token against the configured one."""
+
+    expected = os.environ.get(INGEST_TOKEN_ENV)
+    if not expected or token is None:
+        return False
+    return hmac.compare_digest(token.encode(), expected.encode())
+
+
+def load_stage_function(spec: str | None) -> StageFunction | None:
+    """Import the function of a "module:function" spec, if any."""
+
+    if not spec:
+        return None
+    module_name, _, name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), name)
+
+
+def _append_lines(path: str, records: list[dict]) -> None:
+    # One write of whole lines, such that readers never see a partial record
+    # unless it is still being written.
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("".join(json.dumps(d) + "\n" for d in records))
+
+
+def record_processed(image_dir: Path, manifest_path: str, filenames: list[str]) -> None:
+    """
+    Record processed images in a manifest of the scripts (see scripts/manifest.py),
+    such that the scripts do not process them again.
+    A missing manifest is left to the scripts, which rebuild it from the output.
+    """
+
+    if not os.path.exists(manifest_path):
+        return
+    entries = [manifest.stat_source(str(image_dir), d) for d in filenames]
+    with open(manifest_path, "a", encoding="utf-8") as f:
+        for entry in entries:
+            if entry is not None:
+                manifest.record(f, entry)
+
+
+def is_image(path: Path) -> bool:
+    """Whether PIL can open the file as an image."""
+
+    try:
+        with Image.open(path) as image:
+            image.verify()
+    except Exception:
+        return False
+    return True
+
+
+class IngestQueue:
+    """
+    The images queued for ingestion, processed in batches by a background thread.
+    Without an embedder or a captioner, that stage is skipped,
+    and its results are left to the scripts.
+    """
+
+    def __init__(
+        self,
+        embedder: StageFunction | None = None,
+        captioner: StageFunction | None = None,
+        batch_size: int = BATCH_SIZE,
+    ):
+        self.embedder = embedder
+        self.captioner = captioner
+        self.batch_size = batch_size
+        self._queue: queue.Queue[tuple[Collection, str]] = queue.Queue()
+        self._lock = threading.Lock()
+        # The stage statuses by (static directory of the collection, uuid).
+        self._statuses: OrderedDict[tuple[str, str], dict[str, str]] = OrderedDict()
+        self._thread: threading.Thread | None = None
+
+    @classmethod
+    def from_env(cls) -> "IngestQueue":
+        return cls(
+            load_stage_function(os.environ.get(INGEST_EMBEDDER_ENV)),
+            load_stage_function(os.environ.get(INGEST_CAPTIONER_ENV)),
+        )
+
+    def submit(self, collection: Collection, uuids: list[str]) -> None:
+        """Queue images of the collection, already in its images directory."""
+
+        with self._lock:
+            for uuid in uuids:
+                key = (str(collection.static_dir), uuid)
+                self._statuses[key] = {d: "queued" for d in STAGES}
+                self._statuses.move_to_end(key)
+            while len(self._statuses) > MAX_STATUSES:
+                self._statuses.popitem(last=False)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="ingest", daemon=True
+                )
+                self._thread.start()
+        for uuid in uuids:
+            self._queue.put((collection, uuid))
+
+    def status(self, collection: Collection, uuid: str) -> dict[str, str] | None:
+        """The status of each stage of a queued image, or None if unknown."""
+
+        with self._lock:
+            status = self._statuses.get((str(collection.static_dir), uuid))
+            return None if status is None else dict(status)
+
+    def is_pending(self, collection: Collection, uuid: str) -> bool:
+        status = self.status(collection, uuid)
+        return status is not None and "queued" in status.values()
+
+    def join(self) -> None:
+        """Wait until the queued images are processed."""
+
+        self._queue.join()
+
+    def _set(self, collection: Collection, uuid: str, stage: str, value: str) -> None:
+        with self._lock:
+            status = self._statuses.get((str(collection.static_dir), uuid))
+            if status is not None:
+                status[stage] = value
+
+    def _fail_queued(self, collection: Collection, uuids: list[str]) -> None:
+        with self._lock:
+            for uuid in uuids:
+                status = self._statuses.get((str(collection.static_dir), uuid), {})
+                for stage, value in status.items():
+                    if value == "queued":
+                        status[stage] = "failed"
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            by_collection: dict[Collection, list[str]] = {}
+            for collection, uuid in batch:
+                by_collection.setdefault(collection, []).append(uuid)
+            for collection, uuids in by_collection.items():
+                try:
+                    with timed("ingest"):
+                        self._process(collection, uuids)
+                except Exception:
+                    # E.g., a stage function raised: the remaining stages fail.
+                    logger.exception("Ingesting %d images failed", len(uuids))
+                    self._fail_queued(collection, uuids)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _process(self, collection: Collection, uuids: list[str]) -> None:
+        uuid2filename = collection.uuid2filename()
+        uuid2filename.refresh()
+        filenames = {d: uuid2filename[d] for d in uuids if d in uuid2filename}
+        self._fail_queued(collection, [d for d in uuids if d not in filenames])
+        uuids = list(filenames)
+        paths = [str(collection.image_dir / filenames[d]) for d in uuids]
+
+        collection.thumbnail_dir.mkdir(parents=True, exist_ok=True)
+        thumbnails = []
+        for uuid, path in zip(uuids, paths):
+            status = self._thumbnail(collection, path)
+            self._set(collection, uuid, "thumbnail", status)
+            if status == "done":
+                thumbnails.append(os.path.basename(path))
+        # The manifest of the thumbnails of scripts/setup_cache.py.
+        manifest_path = str(collection.static_dir / "thumbnails.manifest.jsonl")
+        record_processed(collection.image_dir, manifest_path, thumbnails)
+
+        self._run_stage(
+            collection,
+            uuids,
+            paths,
+            "embedding",
+            self.embedder,
+            collection.embedding_path,
+            lambda filename, result: {"filename": filename, "embedding": result},
+        )
+        self._run_stage(
+            collection,
+            uuids,
+            paths,
+            "caption",
+            self.captioner,
+            collection.caption_path,
+            lambda filename, result: {"filename": filename, "caption": result},
+        )
+
+    def _thumbnail(self, collection: Collection, path: str) -> str:
+        filename = os.path.basename(path)
+        extension = os.path.splitext(filename)[1].lower()
+        pil_format = Image.registered_extensions().get(extension)
+        if pil_format is None:
+            return "failed"
+        dest = str(collection.thumbnail_dir / filename)
+        try:
+            with timed("ingest_thumbnail"):
+                render_derivative(
+                    path, dest, THUMBNAIL_SIZE, THUMBNAIL_SIZE, pil_format
+                )
+        except (OSError, ValueError):
+            return "failed"
+        return "done"
+
+    def _run_stage(
+        self,
+        collection: Collection,
+        uuids: list[str],
+        paths: list[str],
+        stage: str,
+        function: StageFunction | None,
+        output_path: str,
+        to_record: Callable[[str, object], dict],
+    ) -> None:
+        if function is None:
+            for uuid in uuids:
+                self._set(collection, uuid, stage, "skipped")
+            return
+        with timed(f"ingest_{stage}"):
+            results = function(paths)
+        records = [
+            to_record(os.path.basename(path), result)
+            for path, result in zip(paths, results)
+            if result is not None
+        ]
+        # The loaded indexes follow the appended lines on their next use.
+        if records:
+            _append_lines(output_path, records)
+            manifest_path = manifest.get_manifest_path(output_path)
+            filenames = [d["filename"] for d in records]
+            record_processed(collection.image_dir, manifest_path, filenames)
+        for uuid, result in zip(uuids, results):
+            self._set(collection, uuid, stage, "failed" if result is None else "done")
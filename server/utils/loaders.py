@@ -3,12 +3,22 @@ This module provides functions to load precomputed image embeddings, captions,
 and the on-disk image filename index.
 """
 
+import json
+import os
+import threading
+from collections.abc import Iterable, Iterator
 from functools import cache
 from pathlib import Path
+from typing import NamedTuple
 
 import numpy as np
-from libquery.utils.jsonl import load_jl
-from sklearn.decomposition import PCA
+
+from .metrics import timed
+
+# libquery and sklearn are imported on first use to keep the server start fast.
+
+# Environment variable pointing to a directory with an exported embedding store.
+EMBEDDING_STORE_ENV = "EMBEDDING_STORE_DIR"
 
 
 def filename2uuid(filename: str) -> str:
@@ -17,7 +27,38 @@ def filename2uuid(filename: str) -> str:
     return filename.split(".")[0]
 
 
-def build_uuid2filename(image_dir: Path) -> dict[str, str]:
+class Uuid2Filename(dict):
+    """
+    Mapping from image UUID to filename, rescanned by refresh()
+    once files were added to or removed from the directory.
+    """
+
+    def __init__(self, image_dir: Path):
+        super().__init__()
+        self.image_dir = image_dir
+        self.mtime_ns: int | None = None
+        self.refresh()
+
+    def refresh(self) -> bool:
+        """Rescan the directory if it changed; returns whether it changed."""
+
+        mtime_ns = os.stat(self.image_dir).st_mtime_ns
+        if mtime_ns == self.mtime_ns:
+            return False
+        self.mtime_ns = mtime_ns
+        scanned = {
+            f.name.split(".")[0]: f.name
+            for f in self.image_dir.iterdir()
+            if f.is_file()
+        }
+        # Updated in place, as requests may be reading the mapping.
+        self.update(scanned)
+        for uuid in self.keys() - scanned.keys():
+            self.pop(uuid, None)
+        return True
+
+
+def build_uuid2filename(image_dir: Path) -> Uuid2Filename:
     """
     Map image UUID (filename stem) to filename for files directly under image_dir.
 
@@ -31,16 +72,229 @@ def build_uuid2filename(image_dir: Path) -> dict[str, str]:
             f"images directory not found: {image_dir}. "
             "Run `uv run python static/setup_samples.py` or see server/README.md."
         )
-    return {f.name.split(".")[0]: f.name for f in image_dir.iterdir() if f.is_file()}
+    return Uuid2Filename(image_dir)
 
 
-@cache
-def load_uuid2embedding(
+class JsonlTail:
+    """
+    Follows the records appended to a JSONL file, such that the contents
+    loaded from it are updated in place instead of reloaded.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # Bytes read so far, and the file they were read from.
+        self.offset = 0
+        self.file_id: tuple[int, int] | None = None
+
+    def follow(self) -> tuple[bool, Iterator[dict]]:
+        """
+        Get the records appended since the last read.
+        If the file was replaced or truncated, the records are read
+        from its start, and the returned flag is True.
+        The offset advances as the records are consumed.
+
+        Raises
+        ------
+        FileNotFoundError
+            If the file does not exist.
+        """
+
+        stat = os.stat(self.path)
+        file_id = (stat.st_dev, stat.st_ino)
+        reset = file_id != self.file_id or stat.st_size < self.offset
+        if reset:
+            self.offset = 0
+            self.file_id = file_id
+        return reset, self._records(stat.st_size)
+
+    def _records(self, size: int) -> Iterator[dict]:
+        if self.offset >= size:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            while self.offset < size:
+                line = f.readline(size - self.offset)
+                if not line.endswith(b"\n"):
+                    # The last line may still be being written:
+                    # it is consumed only if it is complete.
+                    try:
+                        record = json.loads(line) if line.strip() else None
+                    except ValueError:
+                        return
+                    if isinstance(record, dict):
+                        self.offset += len(line)
+                        yield record
+                    return
+                self.offset += len(line)
+                if line.strip():
+                    yield json.loads(line)
+
+
+class Projection(NamedTuple):
+    """The PCA projection fitted to an embedding store."""
+
+    mean: np.ndarray
+    components: np.ndarray
+
+    def apply(self, embeddings: np.ndarray) -> np.ndarray:
+        return (embeddings - self.mean) @ self.components.T
+
+
+class EmbeddingStore:
+    """
+    The embeddings of the images, growing as embeddings are appended
+    to the JSONL file (see refresh).
+
+    The rows loaded with the store (the base) are never copied:
+    when memory-mapped read-only from an exported store, the server workers
+    share their pages. The appended rows go to a private overflow segment,
+    and the replaced rows of a read-only base are kept aside.
+    Rows keep their index once added.
+    """
+
+    def __init__(
+        self,
+        uuids: list[str],
+        uuid2index: dict[str, int],
+        matrix: np.ndarray,
+        projection: Projection | None = None,
+        tail: JsonlTail | None = None,
+    ):
+        self.uuids = uuids
+        self.uuid2index = uuid2index
+        self._base = matrix
+        # The rows appended beyond the base, with spare capacity beyond them.
+        self._overflow = np.empty((0, matrix.shape[1]), dtype=float)
+        # The rows replaced since the store was loaded, if the base is read-only.
+        # Replaced as a whole on writes, such that readers can iterate it.
+        self._replaced: dict[int, np.ndarray] = {}
+        self.projection = projection
+        # Follows the source, if any; the store is fixed without it.
+        self.tail = tail
+        self._lock = threading.RLock()
+
+    @property
+    def dim(self) -> int:
+        return self._base.shape[1]
+
+    def take(self, indices) -> np.ndarray:
+        """Get a copy of the rows at the indices, with shape (len(indices), dim)."""
+
+        # Readers take the segments as they are: appends publish the indices
+        # only after the rows are written, and grown segments keep the old rows.
+        base, overflow, replaced = self._base, self._overflow, self._replaced
+        indices = np.asarray(indices, dtype=np.intp).reshape(-1)
+        n_base = len(base)
+        in_base = indices < n_base
+        if in_base.all():
+            rows = np.asarray(base[indices], dtype=float)
+        else:
+            rows = np.empty((len(indices), self.dim), dtype=float)
+            rows[in_base] = base[indices[in_base]]
+            rows[~in_base] = overflow[indices[~in_base] - n_base]
+        if replaced:
+            for i in np.flatnonzero(np.isin(indices, list(replaced))):
+                rows[i] = replaced[int(indices[i])]
+        return rows
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """
+        The embeddings with shape (len(uuids), dim).
+        The base itself (read-only when attached from an exported store)
+        until rows are appended or replaced, a private copy after:
+        prefer take for the rows of a request.
+        """
+
+        # The length is read first, as appends write the rows before the uuids.
+        n = len(self.uuids)
+        if n <= len(self._base) and not self._replaced:
+            return self._base[:n]
+        return self.take(np.arange(n))
+
+    def append(self, records: Iterable[dict]) -> int:
+        """
+        Add or replace the embeddings of records of the JSONL file,
+        projected with the projection of the store.
+        Returns the number of embeddings added or replaced.
+        """
+
+        uuid2embedding = {
+            filename2uuid(d["filename"]): d["embedding"]
+            for d in records
+            if d["embedding"] is not None
+        }
+        if not uuid2embedding:
+            return 0
+        rows = np.array(list(uuid2embedding.values()), dtype=float)
+        rows = rows.reshape(len(uuid2embedding), -1)
+        if self.projection is not None:
+            rows = self.projection.apply(rows)
+        with self._lock:
+            n = len(self.uuids)
+            n_base = len(self._base)
+            new = [d for d in uuid2embedding if d not in self.uuid2index]
+            needed = n + len(new) - n_base
+            if needed > len(self._overflow):
+                # Grown geometrically, such that appends take amortized O(1) copies
+                # of the overflow; the base is never copied.
+                overflow = np.empty(
+                    (max(needed, 2 * len(self._overflow)), self.dim), dtype=float
+                )
+                overflow[: n - n_base] = self._overflow[: n - n_base]
+                self._overflow = overflow
+            index = dict(zip(new, range(n, n + len(new))))
+            replaced = {}
+            for uuid, row in zip(uuid2embedding, rows):
+                i = index[uuid] if uuid in index else self.uuid2index[uuid]
+                if i >= n_base:
+                    self._overflow[i - n_base] = row
+                elif self._base.flags.writeable:
+                    self._base[i] = row
+                else:
+                    replaced[i] = row
+            if replaced:
+                self._replaced = {**self._replaced, **replaced}
+            # Published after the rows are written, the index last,
+            # such that readers never see an index beyond the rows.
+            self.uuids.extend(new)
+            self.uuid2index.update(index)
+        return len(rows)
+
+    def refresh(self) -> bool:
+        """
+        Append the embeddings appended to the JSONL file since the last refresh.
+        Returns False if the file was replaced or truncated,
+        in which case the store is stale and must be rebuilt.
+
+        Raises
+        ------
+        FileNotFoundError
+            If the JSONL file does not exist.
+        """
+
+        if self.tail is None:
+            return True
+        with self._lock:
+            reset, records = self.tail.follow()
+            if reset:
+                return False
+            records = list(records)
+            if records:
+                with timed("refresh_embedding_store"):
+                    self.append(records)
+        return True
+
+
+def build_embedding_store(
     embedding_path: str, max_dim: int | None = None
-) -> dict[str, np.ndarray]:
+) -> EmbeddingStore:
     """
-    Load the mapping from uuid to embedding.
-    The loaded mapping is cached.
+    Load the embeddings from the JSONL file into a matrix.
+
+    The last entry of a filename takes precedence,
+    and entries without an embedding (unreadable images) are skipped.
 
     Parameters
     ----------
@@ -49,28 +303,163 @@ def load_uuid2embedding(
     max_dim : int or None
         Maximum number of dimensions to keep after PCA.
         If None, no PCA is applied.
-
-    Returns
-    -------
-    dict[str, np.ndarray]
-        Mapping from UUID to embedding.
     """
 
-    embedding_objects = load_jl(embedding_path)
+    from sklearn.decomposition import PCA
+
+    tail = JsonlTail(embedding_path)
+    _, records = tail.follow()
+    uuid2embedding = {
+        filename2uuid(d["filename"]): d["embedding"]
+        for d in records
+        if d["embedding"] is not None
+    }
+    uuids = list(uuid2embedding.keys())
 
     # Compress to 20 dimensions using PCA to accelerate distance computation.
-    embeddings = [d["embedding"] for d in embedding_objects]
-    embeddings = np.array(embeddings).reshape(len(embeddings), -1)
+    # The projection is kept to project the embeddings appended later.
+    embeddings = np.array(list(uuid2embedding.values())).reshape(len(uuids), -1)
+    projection = None
     if max_dim is not None and embeddings.shape[1] > max_dim:
-        embeddings = PCA(n_components=max_dim, random_state=0).fit_transform(embeddings)
-    embeddings = embeddings.tolist()
+        pca = PCA(n_components=max_dim, random_state=0)
+        embeddings = pca.fit_transform(embeddings)
+        projection = Projection(pca.mean_, pca.components_)
+
+    return EmbeddingStore(
+        uuids, {d: i for i, d in enumerate(uuids)}, embeddings, projection, tail
+    )
 
+
+def _store_paths(store_dir: Path, max_dim: int | None) -> tuple[Path, Path, Path, Path]:
+    suffix = "full" if max_dim is None else f"d{max_dim}"
+    return (
+        store_dir / f"embeddings-{suffix}.npy",
+        store_dir / f"uuids-{suffix}.json",
+        store_dir / f"projection-{suffix}.npz",
+        store_dir / f"meta-{suffix}.json",
+    )
+
+
+def _source_stamp(embedding_path: str, max_dim: int | None, tail: JsonlTail) -> dict:
+    # The file and the bytes the store was built from.
+    dev, ino = tail.file_id
     return {
-        filename2uuid(d["filename"]): embeddings[i]
-        for i, d in enumerate(embedding_objects)
+        "source": os.path.abspath(embedding_path),
+        "dev": dev,
+        "ino": ino,
+        "size": tail.offset,
+        "max_dim": max_dim,
     }
 
 
+def _read_current_stamp(
+    meta_path: Path, embedding_path: str, max_dim: int | None
+) -> dict | None:
+    """
+    Read the stamp of an exported store if the store holds the current file:
+    the same file, possibly with lines appended since, which are followed.
+    Returns None otherwise, e.g., if the file was replaced.
+    """
+
+    if not meta_path.is_file():
+        return None
+    stamp = json.loads(meta_path.read_text())
+    stat = os.stat(embedding_path)
+    current = (
+        stamp.get("source") == os.path.abspath(embedding_path)
+        and stamp.get("max_dim") == max_dim
+        and stamp.get("dev") == stat.st_dev
+        and stamp.get("ino") == stat.st_ino
+        and stat.st_size >= stamp["size"]
+    )
+    return stamp if current else None
+
+
+def export_embedding_store(
+    embedding_path: str, max_dim: int | None, store_dir: Path
+) -> None:
+    """
+    Write the embedding store to store_dir such that server workers can
+    memory-map it and share the same pages.
+    The export is skipped if store_dir holds a store of the same file,
+    even with lines appended since, such that the projection is not refitted.
+    """
+
+    matrix_path, uuids_path, projection_path, meta_path = _store_paths(
+        store_dir, max_dim
+    )
+    if _read_current_stamp(meta_path, embedding_path, max_dim) is not None:
+        return
+
+    store = build_embedding_store(embedding_path, max_dim)
+    stamp = _source_stamp(embedding_path, max_dim, store.tail)
+    store_dir.mkdir(parents=True, exist_ok=True)
+    np.save(matrix_path, np.ascontiguousarray(store.matrix))
+    uuids_path.write_text(json.dumps(store.uuids))
+    projection_path.unlink(missing_ok=True)
+    if store.projection is not None:
+        np.savez(projection_path, **store.projection._asdict())
+    # Written last such that a partial export is never attached.
+    meta_path.write_text(json.dumps(stamp))
+
+
+def attach_embedding_store(
+    embedding_path: str, max_dim: int | None, store_dir: Path
+) -> EmbeddingStore | None:
+    """
+    Memory-map an exported embedding store read-only.
+    The lines appended to the file since the export are followed
+    and projected with the exported projection, which is never refitted,
+    such that all the workers project the embeddings alike.
+    Returns None if store_dir holds no store of the current embedding file.
+    """
+
+    matrix_path, uuids_path, projection_path, meta_path = _store_paths(
+        store_dir, max_dim
+    )
+    stamp = _read_current_stamp(meta_path, embedding_path, max_dim)
+    if stamp is None:
+        return None
+    uuids: list[str] = json.loads(uuids_path.read_text())
+    matrix = np.load(matrix_path, mmap_mode="r")
+    projection = None
+    if projection_path.is_file():
+        with np.load(projection_path) as d:
+            projection = Projection(d["mean"], d["components"])
+    # The store follows the lines appended after the export.
+    tail = JsonlTail(embedding_path)
+    tail.offset = stamp["size"]
+    tail.file_id = (stamp["dev"], stamp["ino"])
+    store = EmbeddingStore(
+        uuids, {d: i for i, d in enumerate(uuids)}, matrix, projection, tail
+    )
+    store.refresh()
+    return store
+
+
+@cache
+def load_embedding_store(
+    embedding_path: str, max_dim: int | None = None
+) -> EmbeddingStore:
+    """
+    Load the embedding store.
+    The loaded store is cached.
+
+    If the environment variable ``EMBEDDING_STORE_DIR`` points to a store
+    exported by ``export_embedding_store``, the store is memory-mapped from there.
+    Otherwise, it is built from the JSONL file.
+    """
+
+    store_dir = os.environ.get(EMBEDDING_STORE_ENV)
+    if store_dir:
+        with timed("attach_embedding_store"):
+            store = attach_embedding_store(embedding_path, max_dim, Path(store_dir))
+        if store is not None:
+            return store
+    with timed("build_embedding_store"):
+        return build_embedding_store(embedding_path, max_dim)
+
+
 def load_embeddings(
     uuids: list[str], embedding_path: str, max_dim: int | None = 20
 ) -> np.ndarray:
@@ -94,16 +483,58 @@ def load_embeddings(
         Embeddings of the files with the given UUIDs.
     """
 
-    uuid2embedding = load_uuid2embedding(embedding_path, max_dim)
-    embeddings = [uuid2embedding[uuid] for uuid in uuids]
-    return np.array(embeddings).reshape(len(embeddings), -1)
+    store = load_embedding_store(embedding_path, max_dim)
+    with timed("load_embeddings"):
+        indices = [store.uuid2index[uuid] for uuid in uuids]
+        return store.take(indices)
+
+
+class Uuid2Caption(dict):
+    """Mapping from uuid to caption, following the captions appended to the file."""
+
+    def __init__(self, caption_path: str):
+        super().__init__()
+        self.tail = JsonlTail(caption_path)
+        self._lock = threading.Lock()
+        self.refresh()
+
+    @property
+    def version(self) -> str:
+        """
+        Identify the captions loaded: the file they were read from and the
+        bytes read, which change as captions are appended or the file replaced.
+        """
+
+        with self._lock:
+            dev, ino = self.tail.file_id
+            return f"{dev:x}-{ino:x}-{self.tail.offset:x}"
+
+    def refresh(self) -> None:
+        """
+        Add the captions appended to the file since the last refresh,
+        or reload the captions if the file was replaced.
+
+        Raises
+        ------
+        FileNotFoundError
+            If the file does not exist.
+        """
+
+        with self._lock:
+            reset, records = self.tail.follow()
+            loaded = {filename2uuid(d["filename"]): d["caption"] for d in records}
+            if reset:
+                for uuid in self.keys() - loaded.keys():
+                    self.pop(uuid, None)
+            self.update(loaded)
 
 
 @cache
-def load_uuid2caption(caption_path: str) -> dict[str, str]:
+def load_uuid2caption(caption_path: str) -> Uuid2Caption:
     """
     Load the mapping from uuid to caption.
-    The loaded mapping is cached.
+    The loaded mapping is cached; refresh() follows the file.
     """
 
-    return {filename2uuid(d["filename"]): d["caption"] for d in load_jl(caption_path)}
+    with timed("load_uuid2caption"):
+        return Uuid2Caption(caption_path)
@@ -0,0 +1,47 @@
+"""
+This module provides the entries of the sidecar manifests of the scripts
+(see scripts/manifest.py), which record the images an output JSONL file
+already covers, such that the server records the images it processes
+in the format the scripts read.
+"""
+
+import json
+import os
+from typing import TextIO, TypedDict
+
+
+class ManifestEntry(TypedDict):
+    filename: str
+    mtime_ns: int
+    size: int
+    # SHA-256 of the image content, if computed.
+    sha256: str | None
+
+
+def get_manifest_path(output_path: str) -> str:
+    """The manifest of an output, e.g., captions.manifest.jsonl of captions.jsonl."""
+
+    root, ext = os.path.splitext(output_path)
+    return f"{root}.manifest{ext}"
+
+
+def stat_source(img_dir: str, filename: str) -> ManifestEntry | None:
+    """
+    Get the manifest entry describing the current state of a source image.
+    Returns None if the image does not exist.
+    """
+
+    try:
+        stat = os.stat(os.path.join(img_dir, filename))
+    except FileNotFoundError:
+        return None
+    return {
+        "filename": filename,
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "sha256": None,
+    }
+
+
+def record(manifest_file: TextIO, entry: ManifestEntry) -> None:
+    manifest_file.write(f"{json.dumps(entry)}\n")
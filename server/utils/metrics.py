@@ -0,0 +1,322 @@
+"""
+This module provides a lightweight registry of metrics in the Prometheus text format.
+
+Recording an observation only takes a bucket lookup and a few additions,
+while rendering, including the evaluation of the collected values
+(e.g., cache statistics), only happens when /metrics is scraped.
+"""
+
+import asyncio
+import threading
+import time
+from bisect import bisect_left
+from collections.abc import Callable
+from functools import _lru_cache_wrapper
+
+from .profiling import CURRENT_TRACE
+
+# Upper bounds (seconds) of the latency buckets.
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+# Upper bounds of the input size buckets (number of items).
+SIZE_BUCKETS = (1, 10, 100, 1_000, 5_000, 10_000, 50_000, 100_000, 500_000)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(names, values))
+    return f"{{{pairs}}}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Histogram with a fixed set of buckets per combination of label values."""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # Per label values: the non-cumulative bucket counts
+        # (the last one for +Inf) and the sum of the observations.
+        self._series: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = ([0] * (len(self.buckets) + 1), [0.0])
+                self._series[labelvalues] = series
+            series[0][index] += 1
+            series[1][0] += value
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            series = [(k, list(c), s[0]) for k, (c, s) in self._series.items()]
+        names = (*self.labelnames, "le")
+        for labelvalues, counts, total in sorted(series):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                labels = _format_labels(names, (*labelvalues, _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Gauge that is incremented and decremented."""
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        self._value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value -= amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def render(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {_format_value(self._value)}",
+        ]
+
+
+class Collected:
+    """Metric whose samples are computed by a callback when scraped."""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        metric_type: str,
+        labelnames: tuple[str, ...],
+        collect: Callable[[], list[tuple[tuple[str, ...], float]]],
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.metric_type = metric_type
+        self.labelnames = labelnames
+        self.collect = collect
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        for labelvalues, value in self.collect():
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}{labels} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[Histogram | Gauge | Collected] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.register(
+    Histogram(
+        "http_request_duration_seconds",
+        "Latency of HTTP requests by route.",
+        ("method", "route", "status"),
+    )
+)
+
+STAGE_SECONDS = REGISTRY.register(
+    Histogram(
+        "stage_duration_seconds",
+        "Latency of the stages of the compute endpoints and the loaders.",
+        ("stage",),
+    )
+)
+
+INPUT_SIZE = REGISTRY.register(
+    Histogram(
+        "request_input_size",
+        "Number of UUIDs in the requests of the compute endpoints.",
+        ("route",),
+        SIZE_BUCKETS,
+    )
+)
+
+THREAD_TASKS = REGISTRY.register(
+    Gauge(
+        "thread_tasks_in_flight",
+        "Number of tasks submitted to worker threads and not yet finished.",
+    )
+)
+
+# The functools caches reported as cache metrics.
+_CACHES: dict[str, _lru_cache_wrapper] = {}
+
+
+def register_cache(name: str, cached: _lru_cache_wrapper) -> None:
+    """Report the hits and misses of a functools cache."""
+
+    _CACHES[name] = cached
+
+
+def _collect_caches() -> list[tuple[tuple[str, ...], float]]:
+    samples = []
+    for name, cached in sorted(_CACHES.items()):
+        info = cached.cache_info()
+        samples.append(((name, "hit"), info.hits))
+        samples.append(((name, "miss"), info.misses))
+    return samples
+
+
+def _collect_queue_depth() -> list[tuple[tuple[str, ...], float]]:
+    # Called from the /metrics coroutine, hence within the running loop.
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return []
+    # The default executor serving asyncio.to_thread is created lazily.
+    executor = getattr(loop, "_default_executor", None)
+    queue = getattr(executor, "_work_queue", None)
+    return [((), 0 if queue is None else queue.qsize())]
+
+
+REGISTRY.register(
+    Collected(
+        "thread_pool_queue_depth",
+        "Number of tasks waiting for a thread of the default executor.",
+        "gauge",
+        (),
+        _collect_queue_depth,
+    )
+)
+
+REGISTRY.register(
+    Collected(
+        "cache_requests_total",
+        "Lookups of the loader caches by result.",
+        "counter",
+        ("cache", "result"),
+        _collect_caches,
+    )
+)
+
+
+class timed:
+    """
+    Context manager recording the duration of a stage.
+
+    Examples
+    --------
+    >>> with timed("tsne"):
+    ...     pass
+    """
+
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *args) -> None:
+        duration = time.perf_counter() - self.start
+        STAGE_SECONDS.observe(duration, self.stage)
+        trace = CURRENT_TRACE.get()
+        if trace is not None:
+            trace.stages.append((self.stage, duration))
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording the latency of HTTP requests by route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = "500"
+
+        async def send_with_status(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router stores the matched route in the scope.
+            # Unmatched paths share one label to bound the number of series.
+            route = scope.get("route")
+            path = getattr(route, "path", "<unmatched>")
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - start, scope["method"], path, status
+            )
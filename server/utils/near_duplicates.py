@@ -0,0 +1,248 @@
+"""
+This module provides near-duplicate detection (e.g., rescans of the same plate)
+by banded locality-sensitive hashing: images sharing any band of their
+perceptual hash or of the SimHash of their embedding become candidate pairs,
+which are verified exactly and grouped, without comparing all pairs.
+"""
+
+import json
+from functools import cache
+
+import numpy as np
+
+from .loaders import EmbeddingStore, filename2uuid, load_embedding_store
+from .metrics import timed
+
+# Number of bits of the SimHash signatures of the embeddings,
+# and bytes per band. The bits of the low-dimensional embeddings are correlated,
+# hence long bands keep the buckets small; 8 bands of 24 bits still find
+# about 97% of the pairs with a cosine similarity of 0.99.
+SIMHASH_BITS = 192
+SIMHASH_BAND_BYTES = 3
+
+# Bytes per band of the 64-bit perceptual hashes.
+PHASH_BAND_BYTES = 2
+
+# Number of candidate pairs verified at once, bounding the memory.
+VERIFY_CHUNK = 1 << 18
+
+# Number of set bits of each byte value.
+_POPCOUNT = np.array([bin(d).count("1") for d in range(256)], dtype=np.uint8)
+
+
+@cache
+def load_uuid2phash(phash_path: str) -> dict[str, int]:
+    """
+    Load the mapping from uuid to 64-bit perceptual hash.
+    Images that could not be hashed are skipped; the loaded mapping is cached.
+    """
+
+    uuid2phash = {}
+    with timed("load_uuid2phash"), open(phash_path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            d = json.loads(line)
+            uuid = filename2uuid(d["filename"])
+            if d["phash"] is None:
+                uuid2phash.pop(uuid, None)
+            else:
+                uuid2phash[uuid] = int(d["phash"], 16)
+    return uuid2phash
+
+
+def simhash(
+    matrix: np.ndarray, n_bits: int = SIMHASH_BITS, seed: int = 0
+) -> np.ndarray:
+    """
+    Compute the SimHash signatures of the rows: the signs of their projections
+    onto random hyperplanes, such that the fraction of differing bits
+    estimates the angle between two rows.
+
+    Returns
+    -------
+    np.ndarray
+        The signatures packed into bytes, with shape (len(matrix), n_bits // 8).
+    """
+
+    rng = np.random.default_rng(seed)
+    planes = rng.standard_normal((matrix.shape[1], n_bits))
+    return np.packbits(np.asarray(matrix) @ planes > 0, axis=1)
+
+
+@cache
+def load_store_simhashes(embedding_path: str) -> np.ndarray:
+    """
+    Compute the SimHash signatures of the embedding store, in its row order.
+    The signatures are cached.
+    """
+
+    store = load_embedding_store(embedding_path, 20)
+    with timed("simhash"):
+        return simhash(store.matrix)
+
+
+def extend_simhashes(simhashes: np.ndarray, store: EmbeddingStore) -> np.ndarray:
+    """
+    Extend the signatures of the rows of a store to the rows appended since,
+    e.g., the embeddings of ingested images.
+    """
+
+    n = len(store.uuids)
+    if len(simhashes) >= n:
+        return simhashes
+    appended = store.take(np.arange(len(simhashes), n))
+    return np.concatenate([simhashes, simhash(appended)])
+
+
+def to_bands(signatures: np.ndarray, band_bytes: int) -> np.ndarray:
+    """
+    Split byte-packed signatures into bands of band_bytes bytes,
+    with shape (len(signatures), n_bytes // band_bytes).
+    """
+
+    n, n_bytes = signatures.shape
+    bands = np.zeros((n, n_bytes // band_bytes), dtype=np.int64)
+    for k in range(band_bytes):
+        bands = (bands << 8) | signatures[:, k::band_bytes]
+    return bands
+
+
+def phash_bytes(phashes: list[int]) -> np.ndarray:
+    """Pack 64-bit perceptual hashes into bytes, with shape (len(phashes), 8)."""
+
+    return np.array(phashes, dtype=">u8").view(np.uint8).reshape(-1, 8)
+
+
+def hamming_distances(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """The numbers of differing bits between the rows of byte-packed signatures."""
+
+    return _POPCOUNT[np.bitwise_xor(a, b)].sum(axis=1, dtype=np.int64)
+
+
+def candidate_pairs(bands: np.ndarray) -> np.ndarray:
+    """
+    Find the pairs of rows sharing the value of any band.
+
+    For each band, the rows are sorted by the band value,
+    such that the rows of a bucket are contiguous, and rows k apart in the
+    sorted order are paired for k = 1, 2, ... while any bucket is that large.
+    The time is linear in n (times log n) plus the number of pairs.
+
+    Parameters
+    ----------
+    bands : np.ndarray
+        The band values with shape (n, n_bands).
+
+    Returns
+    -------
+    np.ndarray
+        The unique pairs (i, j) with i < j, with shape (n_pairs, 2).
+    """
+
+    n = len(bands)
+    keys = []
+    for band in bands.T:
+        order = np.argsort(band, kind="stable")
+        values = band[order]
+        for k in range(1, n):
+            same = np.flatnonzero(values[:-k] == values[k:])
+            if len(same) == 0:
+                break
+            i = order[same]
+            j = order[same + k]
+            keys.append(np.minimum(i, j) * n + np.maximum(i, j))
+    if not keys:
+        return np.empty((0, 2), dtype=np.int64)
+    unique = np.unique(np.concatenate(keys))
+    return np.stack([unique // n, unique % n], axis=1)
+
+
+class UnionFind:
+    def __init__(self, n: int):
+        self.parents = list(range(n))
+
+    def find(self, i: int) -> int:
+        while self.parents[i] != i:
+            # Path halving.
+            self.parents[i] = self.parents[self.parents[i]]
+            i = self.parents[i]
+        return i
+
+    def union(self, i: int, j: int) -> None:
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i != root_j:
+            self.parents[max(root_i, root_j)] = min(root_i, root_j)
+
+
+def find_near_duplicates(
+    embeddings: np.ndarray,
+    simhashes: np.ndarray,
+    phashes: list[int | None] | None = None,
+    min_similarity: float = 0.95,
+    max_distance: int = 10,
+) -> list[list[int]]:
+    """
+    Group the near-duplicate rows.
+
+    Two rows are near duplicates if the cosine similarity of their embeddings
+    is at least min_similarity and, if both have perceptual hashes,
+    those differ in at most max_distance bits.
+    Candidate pairs come from the banded SimHash signatures
+    and the banded perceptual hashes; groups are their transitive closure.
+
+    Parameters
+    ----------
+    embeddings : np.ndarray
+        The embeddings with shape (n, dim), in the space min_similarity is meant
+        for, e.g., the mean-centered PCA projections of an embedding store,
+        whose cosine similarities are lower than those of the raw embeddings.
+    simhashes : np.ndarray
+        The byte-packed SimHash signatures of the embeddings.
+    phashes : list[int | None] | None
+        The perceptual hashes, None for rows without one.
+
+    Returns
+    -------
+    list[list[int]]
+        The groups of at least two rows, each in ascending order,
+        ordered by their first row.
+    """
+
+    n = len(embeddings)
+    with timed("lsh_candidates"):
+        bands = [to_bands(simhashes, SIMHASH_BAND_BYTES)]
+        hashed = np.zeros(n, dtype=bool)
+        hash_bytes = np.zeros((n, 8), dtype=np.uint8)
+        if phashes is not None:
+            hashed = np.array([d is not None for d in phashes], dtype=bool)
+            hash_bytes = phash_bytes([d or 0 for d in phashes])
+            # Rows without a hash get unique band values, such that they never collide.
+            phash_bands = to_bands(hash_bytes, PHASH_BAND_BYTES)
+            phash_bands[~hashed] = -1 - np.arange(n)[~hashed, None]
+            bands.append(phash_bands)
+        pairs = candidate_pairs(np.concatenate(bands, axis=1))
+
+    with timed("verify_candidates"):
+        norms = np.linalg.norm(embeddings, axis=1)
+        norms[norms == 0] = 1
+        normalized = embeddings / norms[:, None]
+        verified = []
+        for start in range(0, len(pairs), VERIFY_CHUNK):
+            chunk = pairs[start : start + VERIFY_CHUNK]
+            i, j = chunk[:, 0], chunk[:, 1]
+            similarities = np.einsum("ij,ij->i", normalized[i], normalized[j])
+            both_hashed = hashed[i] & hashed[j]
+            close = hamming_distances(hash_bytes[i], hash_bytes[j]) <= max_distance
+            verified.append(
+                chunk[(similarities >= min_similarity) & (~both_hashed | close)]
+            )
+        verified = np.concatenate(verified) if verified else pairs
+
+    union_find = UnionFind(n)
+    for a, b in verified.tolist():
+        union_find.union(a, b)
+    groups: dict[int, list[int]] = {}
+    for a in np.unique(verified).tolist():
+        groups.setdefault(union_find.find(a), []).append(a)
+    return sorted(groups.values())
@@ -0,0 +1,317 @@
+"""
+This module provides opt-in per-request profiling and a slow-request log.
+
+A request sent with ``?profile=1`` and the token of the environment variable
+``PROFILE_TOKEN`` in the ``X-Profile-Token`` header is profiled by sampling
+the stacks of the worker threads doing its work; the report is kept in memory
+and its id is returned in the ``X-Profile-Id`` header.
+Requests slower than ``SLOW_REQUEST_SECONDS`` are logged with their input sizes,
+stage timings, and a stack sample taken when they crossed the threshold,
+except for streamed responses, whose duration depends on the client.
+"""
+
+import asyncio
+import hmac
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from collections.abc import Callable
+from contextvars import ContextVar
+from types import FrameType
+from urllib.parse import parse_qs
+
+from fastapi.responses import JSONResponse
+
+# Environment variable holding the token required to profile requests.
+# Profiling is disabled if it is unset.
+PROFILE_TOKEN_ENV = "PROFILE_TOKEN"
+
+# Environment variable holding the slow-request threshold in seconds.
+# The slow-request log is disabled if it is set to 0.
+SLOW_REQUEST_ENV = "SLOW_REQUEST_SECONDS"
+
+# Environment variable holding a JSONL file to append the slow requests to,
+# in addition to logging them.
+SLOW_REQUEST_LOG_ENV = "SLOW_REQUEST_LOG"
+
+DEFAULT_SLOW_REQUEST_SECONDS = 5.0
+
+TOKEN_HEADER = "X-Profile-Token"
+PROFILE_HEADER = "X-Profile-Id"
+
+# Seconds between two stack samples of a profiled request.
+SAMPLE_INTERVAL = 0.005
+
+# Seconds between two checks for requests crossing the slow threshold.
+WATCHDOG_INTERVAL = 0.1
+
+# Number of profile reports kept in memory.
+MAX_REPORTS = 32
+
+logger = logging.getLogger(__name__)
+
+
+class RequestTrace:
+    """What happened during a request: its threads, stages, and input sizes."""
+
+    def __init__(self, method: str, path: str, slow_threshold: float = 0.0):
+        self.method = method
+        self.path = path
+        self.slow_threshold = slow_threshold
+        self.start = time.perf_counter()
+        # Idents of the worker threads currently working on the request (see
+        # call_traced), not the event loop thread, which serves other requests too.
+        self.threads: set[int] = set()
+        self.stages: list[tuple[str, float]] = []
+        self.inputs: dict[str, int] = {}
+        # The stack sample taken when the request crossed the slow threshold.
+        self.slow_stacks: dict[int, list[str]] | None = None
+
+    def to_dict(self, duration: float) -> dict:
+        return {
+            "method": self.method,
+            "path": self.path,
+            "duration": round(duration, 6),
+            "inputs": self.inputs,
+            "stages": [[name, round(t, 6)] for name, t in self.stages],
+        }
+
+
+CURRENT_TRACE: ContextVar[RequestTrace | None] = ContextVar(
+    "current_trace", default=None
+)
+
+
+def record_input(name: str, size: int) -> None:
+    """Record an input size with the current request."""
+
+    trace = CURRENT_TRACE.get()
+    if trace is not None:
+        trace.inputs[name] = size
+
+
+def call_traced(func: Callable, /, *args):
+    """
+    Call a function, counting the calling thread as working on the current request.
+    Meant for worker threads, to which asyncio.to_thread copies the context.
+    """
+
+    trace = CURRENT_TRACE.get()
+    if trace is None:
+        return func(*args)
+    ident = threading.get_ident()
+    trace.threads.add(ident)
+    try:
+        return func(*args)
+    finally:
+        trace.threads.discard(ident)
+
+
+def format_stack(frame: FrameType | None) -> list[str]:
+    """Format a stack from the outermost to the innermost frame."""
+
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        filename = os.path.basename(code.co_filename)
+        stack.append(f"{code.co_name} ({filename}:{frame.f_lineno})")
+        frame = frame.f_back
+    return stack[::-1]
+
+
+def sample_stacks(threads: set[int]) -> dict[int, list[str]]:
+    frames = sys._current_frames()
+    return {t: format_stack(frames[t]) for t in list(threads) if t in frames}
+
+
+class SamplingProfiler:
+    """Sample the stacks of the threads of a request at a fixed interval."""
+
+    def __init__(self, trace: RequestTrace, interval: float = SAMPLE_INTERVAL):
+        self.trace = trace
+        self.interval = interval
+        self.counts: Counter[tuple[str, ...]] = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            for stack in sample_stacks(self.trace.threads).values():
+                self.counts[tuple(stack)] += 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self) -> str:
+        """The samples in the collapsed format read by flame graph tools."""
+
+        return "\n".join(
+            f"{';'.join(stack)} {count}" for stack, count in self.counts.most_common()
+        )
+
+
+class ProfileStore:
+    """The most recent profile reports by id."""
+
+    def __init__(self, max_size: int = MAX_REPORTS):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._reports: OrderedDict[str, dict] = OrderedDict()
+
+    def add(self, report_id: str, report: dict) -> None:
+        with self._lock:
+            self._reports[report_id] = report
+            while len(self._reports) > self.max_size:
+                self._reports.popitem(last=False)
+
+    def get(self, report_id: str) -> dict | None:
+        with self._lock:
+            return self._reports.get(report_id)
+
+
+PROFILES = ProfileStore()
+
+
+class SlowRequestWatchdog:
+    """
+    Take a stack sample of each request still running after its slow threshold.
+    Runs in its own thread, such that it samples even while the event loop is busy.
+    """
+
+    def __init__(self, interval: float = WATCHDOG_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._active: set[RequestTrace] = set()
+        self._thread: threading.Thread | None = None
+
+    def add(self, trace: RequestTrace) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._active.add(trace)
+
+    def remove(self, trace: RequestTrace) -> None:
+        with self._lock:
+            self._active.discard(trace)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            now = time.perf_counter()
+            with self._lock:
+                overdue = [
+                    d
+                    for d in self._active
+                    if d.slow_stacks is None and now - d.start >= d.slow_threshold
+                ]
+            for trace in overdue:
+                trace.slow_stacks = sample_stacks(trace.threads)
+
+
+WATCHDOG = SlowRequestWatchdog()
+
+
+def get_slow_threshold() -> float:
+    return float(os.environ.get(SLOW_REQUEST_ENV, DEFAULT_SLOW_REQUEST_SECONDS))
+
+
+def log_slow_request(record: dict) -> None:
+    line = json.dumps(record)
+    logger.warning("Slow request: %s", line)
+    log_path = os.environ.get(SLOW_REQUEST_LOG_ENV)
+    if log_path:
+        with open(log_path, "a", encoding="utf-8") as f:
+            f.write(f"{line}\n")
+
+
+def is_authorized(token: str | None) -> bool:
+    """Check a profile token against the configured one."""
+
+    expected = os.environ.get(PROFILE_TOKEN_ENV)
+    if not expected or token is None:
+        return False
+    return hmac.compare_digest(token.encode(), expected.encode())
+
+
+class ProfilingMiddleware:
+    """ASGI middleware tracing requests for the profiler and the slow-request log."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        query = parse_qs(scope["query_string"].decode("latin-1"))
+        profile = query.get("profile") == ["1"]
+        if profile:
+            headers = dict(scope["headers"])
+            token = headers.get(TOKEN_HEADER.lower().encode())
+            if not is_authorized(None if token is None else token.decode("latin-1")):
+                response = JSONResponse(
+                    {"detail": "Profiling requires a valid token"}, status_code=403
+                )
+                await response(scope, receive, send)
+                return
+        threshold = get_slow_threshold()
+        if not profile and threshold <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace(scope["method"], scope["path"], threshold)
+        context_token = CURRENT_TRACE.set(trace)
+        if threshold > 0:
+            WATCHDOG.add(trace)
+
+        profiler = None
+        report_id = None
+        if profile:
+            report_id = uuid.uuid4().hex
+            profiler = SamplingProfiler(trace)
+            profiler.start()
+
+        streamed = False
+
+        async def send_traced(message) -> None:
+            nonlocal streamed
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                # Without a length, the body is streamed, e.g., server-sent events.
+                streamed = all(k.lower() != b"content-length" for k, _ in headers)
+                if streamed:
+                    WATCHDOG.remove(trace)
+                if report_id is not None:
+                    headers.append(
+                        (PROFILE_HEADER.lower().encode(), report_id.encode())
+                    )
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_traced)
+        finally:
+            duration = time.perf_counter() - trace.start
+            CURRENT_TRACE.reset(context_token)
+            WATCHDOG.remove(trace)
+            if profiler is not None:
+                profiler.stop()
+                report = trace.to_dict(duration)
+                report["samples"] = profiler.collapsed()
+                PROFILES.add(report_id, report)
+            if 0 < threshold <= duration and not streamed:
+                record = trace.to_dict(duration)
+                record["stacks"] = trace.slow_stacks or {}
+                # Written in a thread, as the file may block the event loop.
+                await asyncio.to_thread(log_slow_request, record)
@@ -0,0 +1,82 @@
+"""
+This module provides response encodings for the arrays of the compute endpoints.
+"""
+
+import gzip
+
+import numpy as np
+import orjson
+from fastapi import Request
+from fastapi.responses import ORJSONResponse, Response
+
+# Media type of the compact encoding: little-endian int32 values in row-major order.
+BINARY_MEDIA_TYPE = "application/octet-stream"
+
+# Header carrying the shape of a binary-encoded array, e.g., "120,2".
+SHAPE_HEADER = "X-Array-Shape"
+
+EVENT_STREAM_MEDIA_TYPE = "text/event-stream"
+
+# Bodies smaller than this are sent uncompressed.
+COMPRESS_MIN_SIZE = 4096
+
+
+def _accepts(request: Request, header: str, token: str) -> bool:
+    return token in request.headers.get(header, "").lower()
+
+
+def _compress(response: Response, request: Request) -> Response:
+    """Gzip the body if it is large and the client accepts gzip."""
+
+    response.headers["Vary"] = "Accept, Accept-Encoding"
+    if len(response.body) < COMPRESS_MIN_SIZE:
+        return response
+    if not _accepts(request, "accept-encoding", "gzip"):
+        return response
+    response.body = gzip.compress(response.body, compresslevel=5)
+    response.headers["Content-Encoding"] = "gzip"
+    response.headers["Content-Length"] = str(len(response.body))
+    return response
+
+
+def array_response(array: np.ndarray, request: Request) -> Response:
+    """
+    Encode an integer array for the client.
+
+    Clients accepting ``application/octet-stream`` receive little-endian int32
+    values with the shape in the ``X-Array-Shape`` header.
+    Other clients receive JSON serialized by orjson directly from the array.
+    """
+
+    if _accepts(request, "accept", BINARY_MEDIA_TYPE):
+        data = np.ascontiguousarray(array, dtype="<i4")
+        response = Response(
+            data.tobytes(),
+            media_type=BINARY_MEDIA_TYPE,
+            headers={SHAPE_HEADER: ",".join(str(d) for d in data.shape)},
+        )
+    else:
+        # orjson serializes numpy arrays natively if they are C-contiguous.
+        response = ORJSONResponse(np.ascontiguousarray(array))
+    return _compress(response, request)
+
+
+def json_text_response(items: list[str | None], request: Request) -> Response:
+    """
+    Encode a JSON array from items already serialized as JSON text
+    (None for null), without parsing and serializing them again.
+    """
+
+    body = "[" + ",".join("null" if d is None else d for d in items) + "]"
+    response = Response(body.encode(), media_type="application/json")
+    return _compress(response, request)
+
+
+def sse_event(event: str, data: object) -> bytes:
+    """
+    Encode a server-sent event with JSON data.
+    NumPy arrays in the data must be C-contiguous.
+    """
+
+    payload = orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY)
+    return b"event: " + event.encode() + b"\ndata: " + payload + b"\n\n"
@@ -0,0 +1,249 @@
+"""
+This module provides a registry of UUID selections,
+such that clients can send a short handle in place of a large UUID list.
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from pathlib import Path
+
+import numpy as np
+
+from .loaders import EmbeddingStore
+
+# Seconds a selection is kept after it was last used.
+SELECTION_TTL = 3600
+
+# Maximum number of selections kept; the least recently used are evicted.
+MAX_SELECTIONS = 256
+
+# Maximum bytes of the selections kept, in memory and in the shared directory.
+MAX_SELECTION_BYTES = 256 * 2**20
+
+# Environment variable holding the directory through which
+# the server processes share the selections, if any.
+SELECTIONS_DIR_ENV = "SELECTIONS_DIR"
+
+_HANDLE = re.compile(r"[0-9a-f]{32}")
+
+
+def get_selection_handle(uuids: list[str]) -> str:
+    """
+    Get the content-addressed handle of a UUID list.
+
+    The digest covers the order of the UUIDs,
+    as the compute results are aligned with it.
+    """
+
+    digest = hashlib.blake2b(digest_size=16)
+    for uuid in uuids:
+        # Length-prefixed such that no two lists share an encoding.
+        encoded = uuid.encode()
+        digest.update(len(encoded).to_bytes(4, "little"))
+        digest.update(encoded)
+    return digest.hexdigest()
+
+
+class Selection:
+    """A registered UUID list with its row indices in the embedding stores."""
+
+    def __init__(self, handle: str, uuids: list[str]):
+        self.handle = handle
+        self.uuids = uuids
+        # About the bytes of the list as stored, quoted and separated.
+        self.nbytes = sum(len(d) for d in uuids) + 4 * len(uuids)
+        self._lock = threading.Lock()
+        # The row indices per embedding store,
+        # keyed by id and holding the store to detect reloads.
+        self._indices: dict[int, tuple[EmbeddingStore, np.ndarray]] = {}
+
+    def get_indices(self, store: EmbeddingStore) -> np.ndarray:
+        """
+        Get the row indices of the UUIDs in the embedding store.
+        The indices are resolved once per store.
+
+        Raises
+        ------
+        KeyError
+            If a UUID is not in the store.
+        """
+
+        with self._lock:
+            cached = self._indices.get(id(store))
+            if cached is not None and cached[0] is store:
+                return cached[1]
+        indices = np.fromiter(
+            (store.uuid2index[uuid] for uuid in self.uuids),
+            dtype=np.intp,
+            count=len(self.uuids),
+        )
+        with self._lock:
+            # Drop the indices of reloaded stores.
+            self._indices = {id(store): (store, indices)}
+        return indices
+
+
+class SelectionRegistry:
+    """
+    Selections by handle with TTL and LRU eviction.
+
+    Given a directory, the selections are also written there, a file per handle
+    with the time of last use as its modification time, such that the server
+    processes get the selections registered by each other.
+    The files expire with the same TTL and the oldest are removed beyond
+    max_bytes; the LRU eviction by count is per process.
+    The directory is read and written by the calls, hence meant for worker threads.
+    """
+
+    def __init__(
+        self,
+        max_size: int = MAX_SELECTIONS,
+        ttl: float = SELECTION_TTL,
+        clock: Callable[[], float] = time.time,
+        directory: Path | None = None,
+        max_bytes: int = MAX_SELECTION_BYTES,
+    ):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.directory = directory
+        self._clock = clock
+        self._lock = threading.Lock()
+        # Selections with the time of last use, least recently used first.
+        self._selections: OrderedDict[str, tuple[Selection, float]] = OrderedDict()
+        self._nbytes = 0
+        if directory is not None:
+            directory.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_env(cls, value: str | None) -> "SelectionRegistry":
+        """The registry sharing the selections through the directory, if any."""
+
+        return cls(directory=Path(value) if value else None)
+
+    def __len__(self) -> int:
+        return len(self._selections)
+
+    def _evict_oldest(self) -> None:
+        _, (selection, _) = self._selections.popitem(last=False)
+        self._nbytes -= selection.nbytes
+
+    def _expire(self, now: float) -> None:
+        while self._selections:
+            _, last_used = next(iter(self._selections.values()))
+            if now - last_used < self.ttl:
+                break
+            self._evict_oldest()
+
+    def _insert(self, selection: Selection, now: float) -> Selection:
+        # The selection already registered is kept, with its cached indices.
+        entry = self._selections.pop(selection.handle, None)
+        if entry is None:
+            self._nbytes += selection.nbytes
+        else:
+            selection = entry[0]
+        self._selections[selection.handle] = (selection, now)
+        while len(self._selections) > self.max_size or self._nbytes > self.max_bytes:
+            self._evict_oldest()
+        return selection
+
+    def _touch(self, selection: Selection, now: float) -> None:
+        # Written to a temporary file and moved in,
+        # such that the other processes never read a partial selection.
+        path = self.directory / f"{selection.handle}.json"
+        try:
+            os.utime(path, (now, now))
+            return
+        except FileNotFoundError:
+            pass
+        with tempfile.NamedTemporaryFile(
+            "w", dir=self.directory, suffix=".partial", delete=False
+        ) as f:
+            json.dump(selection.uuids, f)
+        os.utime(f.name, (now, now))
+        os.replace(f.name, path)
+
+    def _load(self, handle: str, now: float) -> Selection | None:
+        path = self.directory / f"{handle}.json"
+        try:
+            if now - path.stat().st_mtime >= self.ttl:
+                return None
+            with path.open(encoding="utf-8") as f:
+                return Selection(handle, json.load(f))
+        except FileNotFoundError:
+            return None
+
+    def _expire_files(self, now: float) -> None:
+        # The expired files are removed, then the oldest beyond max_bytes.
+        files = []
+        for path in self.directory.glob("*.json"):
+            try:
+                stat = path.stat()
+                if now - stat.st_mtime >= self.ttl:
+                    path.unlink()
+                else:
+                    files.append((stat.st_mtime, stat.st_size, path))
+            except FileNotFoundError:
+                # Expired by another process.
+                pass
+        total = 0
+        for _, size, path in sorted(files, reverse=True):
+            total += size
+            if total > self.max_bytes:
+                path.unlink(missing_ok=True)
+
+    def register(self, uuids: list[str]) -> Selection:
+        """
+        Register a UUID list.
+        Registering the same list again returns the existing selection.
+
+        Raises
+        ------
+        ValueError
+            If the list is larger than max_bytes.
+        """
+
+        handle = get_selection_handle(uuids)
+        selection = Selection(handle, uuids)
+        if selection.nbytes > self.max_bytes:
+            raise ValueError(f"Selections must be at most {self.max_bytes} bytes")
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            selection = self._insert(selection, now)
+        if self.directory is not None:
+            self._touch(selection, now)
+            self._expire_files(now)
+        return selection
+
+    def get(self, handle: str) -> Selection | None:
+        """
+        Get the selection with the given handle.
+        Returns None if it was never registered or has been evicted.
+        """
+
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            entry = self._selections.get(handle)
+            selection = None if entry is None else self._insert(entry[0], now)
+        if self.directory is None:
+            return selection
+        if selection is None:
+            if not _HANDLE.fullmatch(handle):
+                return None
+            # Registered by another process, if at all.
+            selection = self._load(handle, now)
+            if selection is None:
+                return None
+            with self._lock:
+                selection = self._insert(selection, now)
+        self._touch(selection, now)
+        return selection
@@ -0,0 +1,122 @@
+"""
+Compute worker: runs the clustering and grid layout jobs of the API server
+when it is started with COMPUTE_WORKERS (see README.md).
+The worker reads the same static/ and collections/ trees as the server,
+and keeps the embedding stores it loaded warm, following the embeddings
+appended to their files.
+"""
+
+import os
+from pathlib import Path
+from typing import Literal
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+import numpy as np
+from pydantic import BaseModel
+import uvicorn
+
+from utils.assign_grid import assign_grid
+from utils.clustering import (
+    AUTO_TIME_BUDGET,
+    MAX_AUTO_CLUSTERS,
+    MIN_AUTO_CLUSTERS,
+    auto_clustering,
+    check_auto_params,
+    clustering,
+)
+from utils.collection import COLLECTIONS_DIR_ENV, Collection, CollectionRegistry
+from utils.metrics import CONTENT_TYPE, REGISTRY, MetricsMiddleware, timed
+from utils.responses import array_response
+
+BASE_DIR = Path(__file__).parent
+
+app = FastAPI()
+app.add_middleware(MetricsMiddleware)
+
+DEFAULT_COLLECTION = Collection("default", BASE_DIR / "static")
+COLLECTIONS = CollectionRegistry(
+    Path(os.environ.get(COLLECTIONS_DIR_ENV, BASE_DIR / "collections"))
+)
+
+
+def _get_collection(name: str | None) -> Collection:
+    if name is None:
+        return DEFAULT_COLLECTION
+    collection = COLLECTIONS.get(name)
+    if collection is None:
+        raise HTTPException(status_code=404, detail=f"Unknown collection: {name}")
+    return collection
+
+
+def _load_embeddings(collection: Collection, uuids: list[str]) -> np.ndarray:
+    store = collection.embedding_store()
+    with timed("load_embeddings"):
+        indices = [store.uuid2index[uuid] for uuid in uuids]
+        return store.take(indices)
+
+
+def _run(collection_name: str | None, uuids: list[str], compute) -> np.ndarray:
+    collection = _get_collection(collection_name)
+    try:
+        return compute(_load_embeddings(collection, uuids))
+    except FileNotFoundError as exc:
+        raise HTTPException(
+            status_code=503, detail="Embeddings not found on the worker"
+        ) from exc
+    except KeyError as exc:
+        raise HTTPException(status_code=404, detail=f"Unknown uuid: {exc}") from exc
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+
+class ClusteringJob(BaseModel):
+    collection: str | None = None
+    uuids: list[str]
+    nClusters: int | Literal["auto"]
+    minClusters: int = MIN_AUTO_CLUSTERS
+    maxClusters: int = MAX_AUTO_CLUSTERS
+    timeBudget: float = AUTO_TIME_BUDGET
+
+
+class AssignGridJob(BaseModel):
+    collection: str | None = None
+    uuids: list[str]
+    nRows: int
+    nCols: int
+
+
+# Sync handlers, as the jobs are CPU-bound: FastAPI runs them in its thread pool.
+@app.post("/compute/clustering")
+def run_clustering(job: ClusteringJob, request: Request):
+    def compute(embeddings: np.ndarray) -> np.ndarray:
+        if job.nClusters != "auto":
+            return clustering(embeddings, job.nClusters)
+        check_auto_params(job.minClusters, job.maxClusters, job.timeBudget)
+        return auto_clustering(
+            embeddings, job.minClusters, job.maxClusters, job.timeBudget
+        )
+
+    labels = _run(job.collection, job.uuids, compute)
+    return array_response(labels, request)
+
+
+@app.post("/compute/assignGrid")
+def run_assign_grid(job: AssignGridJob, request: Request):
+    assignment = _run(
+        job.collection, job.uuids, lambda d: assign_grid(d, job.nRows, job.nCols)
+    )
+    return array_response(assignment, request)
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+if __name__ == "__main__":
+    uvicorn.run(
+        f"{Path(__file__).stem}:app",
+        host=os.environ.get("WORKER_HOST", "127.0.0.1"),
+        port=int(os.environ.get("WORKER_PORT", 5002)),
+    )